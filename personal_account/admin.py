@@ -1,13 +1,67 @@
+from django import forms
 from django.contrib import admin
-from django.utils.safestring import mark_safe
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied
 from . import models as md
 from django.utils.html import format_html
 from django.utils import timezone
+from django.contrib import messages
+from django.shortcuts import render
+from django.urls import path
+from .forms import MemberImportForm
+from .importer import import_members, read_rows
+from .exporter import members_for, stream_members_csv
+from .images import thumbnail_url
+from .mail import send_bulk_notification
+from .delivery import deliver, get_targets
 
 admin.site.site_header = "Панель администратора"
 admin.site.index_title = "Управление сайтом"
 
 
+class UserAutocompleteFilter(admin.FieldListFilter):
+    """
+    Фильтр по пользователю с поиском вместо списка всех пользователей.
+
+    Подсказки приходят из стандартного autocomplete админки (поиск по
+    search_fields UserAdmin), в боковую панель выводится только
+    выбранный пользователь.
+    """
+    template = 'admin/personal_account/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        value = params.get(self.lookup_kwarg)
+        self.lookup_val = value[-1] if isinstance(value, list) else value
+        super().__init__(field, request, params, model, model_admin, field_path)
+        self.form_field = forms.ModelChoiceField(
+            queryset=field.remote_field.model._default_manager.all(),
+            widget=AutocompleteSelect(field, model_admin.admin_site),
+            required=False,
+        )
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        self.reset_query_string = changelist.get_query_string(remove=[self.lookup_kwarg])
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': self.reset_query_string,
+            'display': 'Все',
+        }
+
+    @property
+    def media(self):
+        return self.form_field.widget.media
+
+    def rendered_widget(self):
+        return self.form_field.widget.render(self.lookup_kwarg, self.lookup_val, attrs={
+            'data-lookup': self.lookup_kwarg,
+            'data-reset-url': self.reset_query_string,
+        })
+
+
 @admin.register(md.Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ['user',
@@ -17,6 +71,8 @@ class ProfileAdmin(admin.ModelAdmin):
                     'phone',
                     ]
 
+    list_select_related = ['user']
+
     search_fields = ['user__email',
                      'user__first_name',
                      'user__last_name',
@@ -73,16 +129,58 @@ class ProfileAdmin(admin.ModelAdmin):
 
     def get_document_photo_main_preview(self, obj):
         if obj.document_photo_main:
-            return mark_safe(f'<img src="{obj.document_photo_main.url}" width="350" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" width="350" /></a>',
+                               obj.document_photo_main.url, thumbnail_url(obj.document_photo_main))
         return "Нет изображения"
     get_document_photo_main_preview.short_description = 'Предпросмотр основного фото'
 
     def get_document_photo_reg_preview(self, obj):
         if obj.document_photo_reg:
-            return mark_safe(f'<img src="{obj.document_photo_reg.url}" width="350" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" width="350" /></a>',
+                               obj.document_photo_reg.url, thumbnail_url(obj.document_photo_reg))
         return "Нет изображения"
     get_document_photo_reg_preview.short_description = 'Предпросмотр фото регистрации'
 
+    change_list_template = 'admin/personal_account/profile/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/',
+                 self.admin_site.admin_view(self.import_members_view),
+                 name='personal_account_profile_import'),
+        ] + super().get_urls()
+
+    def import_members_view(self, request):
+        if not request.user.has_perm('auth.add_user'):
+            raise PermissionDenied
+        result = None
+        form = MemberImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                result = import_members(read_rows(upload, upload.name, form.cleaned_data['delimiter']),
+                                        dry_run=form.cleaned_data['dry_run'],
+                                        with_history=form.cleaned_data['with_history'])
+            except ValueError as e:
+                messages.error(request, str(e))
+            else:
+                verb = 'Можно загрузить' if form.cleaned_data['dry_run'] else 'Загружено участников'
+                messages.success(request, f"{verb}: {result.created}, строк с ошибками: {len(result.errors)}")
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Импорт участников',
+            'form': form,
+            'result': result,
+        }
+        return render(request, 'admin/personal_account/profile/import_members.html', context)
+
+    def export_members(self, request, queryset):
+        return stream_members_csv(members_for(queryset))
+    export_members.short_description = 'Выгрузить участников в CSV'
+
+    actions = ['export_members']
+
     def formfield_for_choice_field(self, db_field, request, **kwargs):
         if db_field.name == 'can_edit':
             kwargs['choices'] = [
@@ -103,6 +201,8 @@ class ProfileAddressAdmin(admin.ModelAdmin):
                     'info'
                     ]
 
+    list_select_related = ['user']
+
     list_filter = ['reg_country', 'reg_region', 'reg_city', 'info']
     search_fields = ['user__email',
                      'user__first_name',
@@ -152,6 +252,8 @@ class ProfileinviteeAdmin(admin.ModelAdmin):
                     'parther_phone',
                     ]
 
+    list_select_related = ['user']
+
     list_filter = ['parther_phone']
 
     search_fields = [
@@ -181,6 +283,8 @@ class ProfileQueueAdmin(admin.ModelAdmin):
         'id_coor',
     ]
 
+    list_select_related = ['user']
+
     list_filter = [
         'status',
         'additional_status',
@@ -239,28 +343,38 @@ class ProfileQueueAdmin(admin.ModelAdmin):
 
     def consultant_contract_photo_preview(self, obj):
         if obj.consultant_contract_photo:
-            return mark_safe(f'<img src="{obj.consultant_contract_photo.url}" style="max-height: 100px;" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" style="max-height: 100px;" /></a>',
+                               obj.consultant_contract_photo.url, thumbnail_url(obj.consultant_contract_photo))
         return "Нет изображения"
     consultant_contract_photo_preview.short_description = 'Предпросмотр'
 
     def contract_photo_preview(self, obj):
         if obj.contract_photo:
-            return mark_safe(f'<img src="{obj.contract_photo.url}" style="max-height: 100px;" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" style="max-height: 100px;" /></a>',
+                               obj.contract_photo.url, thumbnail_url(obj.contract_photo))
         return "Нет изображения"
     contract_photo_preview.short_description = 'Предпросмотр'
 
     def share_payment_photo_preview(self, obj):
         if obj.share_payment_photo:
-            return mark_safe(f'<img src="{obj.share_payment_photo.url}" style="max-height: 100px;" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" style="max-height: 100px;" /></a>',
+                               obj.share_payment_photo.url, thumbnail_url(obj.share_payment_photo))
         return "Нет изображения"
     share_payment_photo_preview.short_description = 'Предпросмотр'
 
     def membership_fee_photo_preview(self, obj):
         if obj.membership_fee_photo:
-            return mark_safe(f'<img src="{obj.membership_fee_photo.url}" style="max-height: 100px;" />')
+            return format_html('<a href="{}" target="_blank"><img src="{}" style="max-height: 100px;" /></a>',
+                               obj.membership_fee_photo.url, thumbnail_url(obj.membership_fee_photo))
         return "Нет изображения"
     membership_fee_photo_preview.short_description = 'Предпросмотр'
 
+    def export_members(self, request, queryset):
+        return stream_members_csv(members_for(queryset))
+    export_members.short_description = 'Выгрузить участников в CSV'
+
+    actions = ['export_members']
+
 
 @admin.register(md.Profile_partner)
 class ProfilePartnerAdmin(admin.ModelAdmin):
@@ -279,7 +393,9 @@ class ProfilePartnerAdmin(admin.ModelAdmin):
     # Добавьте поисковые поля для autocomplete
     search_fields = ['user__email', 'user__first_name', 'user__last_name']
 
-    list_filter = ['referred']
+    list_select_related = ['user', 'referred']
+
+    list_filter = [('referred', UserAutocompleteFilter)]
 
     fieldsets = (
         ('Основная информация', {
@@ -304,14 +420,22 @@ class ProfilePartnerAdmin(admin.ModelAdmin):
     get_last_name.short_description = 'Фамилия'
 
 
+class SystemNotificationTargetInline(admin.TabularInline):
+    model = md.SystemNotificationTarget
+    extra = 1
+
+
 @admin.register(md.SystemNotification)
 class SystemNotificationAdmin(admin.ModelAdmin):
     list_display = [
         'title',
         'status_display',
+        'delivery_mode',
         'created_at',
     ]
 
+    inlines = [SystemNotificationTargetInline]
+
     list_filter = [
         'status',
         'priority',
@@ -330,7 +454,9 @@ class SystemNotificationAdmin(admin.ModelAdmin):
     readonly_fields = [
         'created_at',
         'updated_at',
-        'notification_type'
+        'notification_type',
+        'delivery_mode',
+        'delivered_at'
     ]
 
     fieldsets = (
@@ -338,10 +464,10 @@ class SystemNotificationAdmin(admin.ModelAdmin):
             'fields': ('title', 'message')
         }),
         ('Настройки уведомления', {
-            'fields': ('status', 'priority', 'notification_type')
+            'fields': ('status', 'priority', 'notification_type', 'delivery_mode')
         }),
         ('Даты', {
-            'fields': ('created_at', 'updated_at'),
+            'fields': ('created_at', 'updated_at', 'delivered_at'),
             'classes': ('collapse',)
         }),
     )
@@ -382,6 +508,38 @@ class SystemNotificationAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         return super().get_queryset(request).select_related()
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            return
+        # получатели из инлайна сохранены — теперь можно доставлять
+        mode, size = deliver(form.instance)
+        self.message_user(
+            request,
+            f'Сообщение доставлено ({form.instance.get_delivery_mode_display().lower()}), получателей: {size}'
+        )
+
+    def send_by_email(self, request, queryset):
+        for notification in queryset:
+            if not get_targets(notification):
+                self.message_user(
+                    request,
+                    f'«{notification.title}»: не выбраны получатели',
+                    messages.WARNING
+                )
+                continue
+            result = send_bulk_notification(notification)
+            rate = result.sent / result.seconds if result.seconds else 0
+            self.message_user(
+                request,
+                f'«{notification.title}»: отправлено {result.sent}, ошибок {result.failed}, '
+                f'{result.seconds:.1f} с ({rate:.1f} писем/с)',
+                messages.ERROR if result.failed else messages.SUCCESS
+            )
+    send_by_email.short_description = 'Разослать выбранные на почту получателям'
+
+    actions = ['send_by_email']
+
 
 @admin.register(md.MessageNotification)
 class MessageNotificationAdmin(admin.ModelAdmin):
@@ -393,11 +551,13 @@ class MessageNotificationAdmin(admin.ModelAdmin):
         'created_at'
     ]
 
+    list_select_related = ['to_user']
+
     list_filter = [
         'is_read',
         'created_at',
         'read_at',
-        'to_user'
+        ('to_user', UserAutocompleteFilter),
     ]
 
     search_fields = [
@@ -467,3 +627,48 @@ class MessageNotificationAdmin(admin.ModelAdmin):
         elif not obj.is_read:
             obj.read_at = None
         super().save_model(request, obj, form, change)
+
+
+@admin.register(md.OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = [
+        'subject',
+        'to',
+        'status',
+        'attempts',
+        'next_attempt_at',
+        'created_at',
+        'sent_at',
+    ]
+
+    list_filter = [
+        'status',
+        'created_at',
+    ]
+
+    search_fields = [
+        'subject',
+        'to',
+    ]
+
+    readonly_fields = [
+        'created_at',
+        'sent_at',
+        'attempts',
+        'last_error',
+    ]
+
+    def retry_now(self, request, queryset):
+        # письма, которые сейчас отправляет воркер, не трогаем: их захват истечёт сам
+        updated = queryset.exclude(status__in=[md.OutgoingEmail.STATUS_SENT,
+                                               md.OutgoingEmail.STATUS_SENDING]).update(
+            status=md.OutgoingEmail.STATUS_PENDING,
+            next_attempt_at=timezone.now()
+        )
+        self.message_user(
+            request,
+            f'{updated} писем поставлено в очередь повторно'
+        )
+    retry_now.short_description = 'Отправить повторно'
+
+    actions = ['retry_now']
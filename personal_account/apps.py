@@ -7,3 +7,8 @@ class PersonalAccountConfig(AppConfig):
     verbose_name = 'База персональных данных'
     verbose_name_plural = "База персональных данных"
 
+    def ready(self):
+        from . import revisions
+
+        for model in revisions.history_models():
+            revisions.register(model)
@@ -0,0 +1,575 @@
+# personal_account/benchmarks.py
+"""
+Сценарии команды benchmark. Данные, которые сценарий создаёт в базе,
+откатываются в конце (rolled_back) или пишутся во временную копию базы
+(sqlite_copy), так что запускать можно на рабочей копии.
+"""
+import asyncio
+import logging
+import os
+import random
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import BytesIO, StringIO
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, models, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from PIL import ExifTags, Image, ImageDraw, ImageFilter
+
+from . import delivery, events, exporter, images, importer, notifications, referrals, revisions, storage, utils
+from .cache import SQLiteCache
+from .codes import make_referral_code
+from .models import (MessageNotification, Profile, Profile_partner, Profile_queue, SystemNotification,
+                     SystemNotificationTarget)
+from .ratelimit import RateLimit
+
+SCENARIOS = {}
+
+
+def scenario(name, description):
+    def register(func):
+        SCENARIOS[name] = (func, description)
+        return func
+    return register
+
+
+@contextmanager
+def rolled_back():
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def timed(func, *args, **kwargs):
+    """(секунды, результат) одного вызова func."""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def create_members(count, status='Пайщик', batch_size=5000):
+    """count пользователей с Profile_queue без сигналов (bulk_create); возвращает их id."""
+    prefix = f'bench{time.time_ns()}_'
+    users = User.objects.bulk_create([User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com')
+                                      for i in range(count)], batch_size=batch_size)
+    Profile_queue.objects.bulk_create([Profile_queue(user=user, status=status) for user in users],
+                                      batch_size=batch_size)
+    return [user.pk for user in users]
+
+
+def in_threads(func, threads, iterations):
+    """Вызывает func(i) iterations раз, поровну в threads потоках; возвращает секунды."""
+    def worker(offset):
+        try:
+            for i in range(offset, iterations, threads):
+                func(i)
+        finally:
+            connections.close_all()  # соединения этого потока
+
+    with ThreadPoolExecutor(threads) as pool:
+        started = time.perf_counter()
+        list(pool.map(worker, range(threads)))
+        return time.perf_counter() - started
+
+
+@scenario('ratelimit', 'Проверок лимита в секунду на бэкендах кеша (locmem, SQLite, Redis с --redis-url)')
+def ratelimit_checks(out, options):
+    iterations = options['iterations'] or 20000
+    threads = options['threads']
+    with tempfile.TemporaryDirectory() as directory:
+        backends = [
+            ('locmem', LocMemCache('benchmark', {})),
+            ('sqlite', SQLiteCache(os.path.join(directory, 'cache.sqlite3'), {})),
+        ]
+        if options['redis_url']:
+            backends.append(('redis', RedisCache(options['redis_url'], {})))
+        out.write(f'{"бэкенд":8} {"проверок/с":>12}  потоков: {threads}')
+        for name, cache in backends:
+            # лимит не достигается: измеряется путь «разрешено», самый частый
+            limiter = RateLimit(f'benchmark:{time.time_ns()}', limit=iterations * 2, period=60, cache=cache)
+            seconds = in_threads(lambda i: limiter.hit(i % 100), threads, iterations)
+            out.write(f'{name:8} {iterations / seconds:>12,.0f}')
+
+
+@scenario('delivery', 'Доставка системного сообщения: запись (личные сообщения) и чтение, 1k/10k/100k получателей')
+def delivery_cost(out, options):
+    sizes = options['sizes'] or [1000, 10000, 100000]
+    out.write(f'{"получателей":>12} {"при записи, с":>14} {"строк":>8} {"при чтении, с":>14} {"страница, мс":>13}')
+    for size in sizes:
+        with rolled_back():
+            user_ids = create_members(size)
+            reader = User.objects.select_related('profile_queue').get(pk=user_ids[-1])
+
+            on_write = SystemNotification.objects.create(title='Запись', message='Текст', status='Пайщик')
+            write_seconds, _ = timed(delivery.deliver, on_write, fanout_on_write_limit=size)
+            rows = MessageNotification.objects.filter(title='Запись').count()
+
+            on_read = SystemNotification.objects.create(title='Чтение', message='Текст', status='Пайщик')
+            read_seconds, _ = timed(delivery.deliver, on_read, fanout_on_write_limit=0)
+            # цена доставки при чтении переносится на страницу уведомлений
+            page_seconds, _ = timed(lambda: notifications.keyset_page(notifications.system_notifications_for(reader)))
+        out.write(f'{size:>12,} {write_seconds:>14.2f} {rows:>8,} {read_seconds:>14.2f} {page_seconds * 1000:>13.1f}')
+
+
+def create_tree(size, fanout=5, batch_size=5000):
+    """Структура из size участников, у каждого fanout прямых партнёров; возвращает id корня."""
+    user_ids = create_members(size, batch_size=batch_size)
+    # bulk_create минует Profile_partner.save: таблицу замыкания сценарий строит сам, если она нужна
+    Profile_partner.objects.bulk_create(
+        [Profile_partner(user_id=user_id, referred_id=user_ids[(i - 1) // fanout] if i else None)
+         for i, user_id in enumerate(user_ids)],
+        batch_size=batch_size
+    )
+    return user_ids[0]
+
+
+def walk_levels(root_id, max_depth=referrals.MAX_DEPTH):
+    """
+    Прежний способ: запрос на каждый уровень, с теми же данными, что и
+    get_downline (статус, телефон, число прямых партнёров).
+    """
+    members = User.objects.select_related('profile_queue', 'profile').annotate(direct_count=Count('referrals'))
+    level, downline = [root_id], []
+    for _ in range(max_depth):
+        # по 10 000 id на запрос: у SQLite ограничено число параметров
+        level = [user for start in range(0, len(level), 10000)
+                 for user in members.filter(profile_partner__referred_id__in=level[start:start + 10000])]
+        if not level:
+            break
+        downline.extend(level)
+        level = [user.pk for user in level]
+    return len(downline)
+
+
+@scenario('downline', 'Вся структура консультанта: WITH RECURSIVE, запрос на уровень и таблица замыкания')
+def downline_queries(out, options):
+    sizes = options['sizes'] or [1000, 10000, 100000]
+    out.write(f'{"участников":>11} {"CTE, с":>8} {"строк":>8} {"по уровням, с":>14} '
+              f'{"замыкание, с":>13} {"размер, мс":>11} {"rebuild, с":>11}')
+    for size in sizes:
+        with rolled_back():
+            root = User.objects.get(pk=create_tree(size))
+            cte_seconds, downline = timed(referrals.get_downline, root)
+            walk_seconds, _ = timed(walk_levels, root.pk)
+            rebuild_seconds, _ = timed(referrals.rebuild_closure)
+            closure_seconds, _ = timed(lambda: list(referrals.descendants(root)))
+            size_seconds, _ = timed(referrals.subtree_size, root)
+        out.write(f'{size:>11,} {cte_seconds:>8.2f} {len(downline):>8,} {walk_seconds:>14.2f} '
+                  f'{closure_seconds:>13.2f} {size_seconds * 1000:>11.1f} {rebuild_seconds:>11.2f}')
+
+
+def probe_referral_code():
+    """Прежний генератор: случайный код и запрос на проверку, пока не найдётся свободный."""
+    code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+    while Profile_partner.objects.filter(referral_code=code):
+        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+    return code
+
+
+@scenario('partners', 'Создание партнёров через Profile_partner.save и цена реферального кода: новый и прежний способ')
+def partner_creation(out, options):
+    sizes = options['sizes'] or [1000, 10000]
+    out.write(f'{"партнёров":>10} {"создание, с":>12} {"в секунду":>10} {"код, мкс":>9} {"код с проверкой, мкс":>21}')
+    for size in sizes:
+        with rolled_back():
+            user_ids = create_members(size)
+            seconds, _ = timed(lambda: [Profile_partner.objects.create(user_id=user_id) for user_id in user_ids])
+            code_seconds, _ = timed(lambda: [make_referral_code(user_id) for user_id in user_ids])
+            probe_seconds, _ = timed(lambda: [probe_referral_code() for _ in user_ids])
+        out.write(f'{size:>10,} {seconds:>12.2f} {size / seconds:>10,.0f} {code_seconds * 1e6 / size:>9.1f} '
+                  f'{probe_seconds * 1e6 / size:>21.1f}')
+
+
+def member_rows(count):
+    """Строки файла импорта: каждая десятая — партнёр предыдущей, каждая пятидесятая с ошибкой."""
+    prefix = f'import{time.time_ns()}_'
+    for i in range(count):
+        referrer = f'{prefix}{i - 1}@example.com' if i % 10 else ''
+        phone = '8999' if i % 50 == 49 else f'+7999{i:07d}'
+        yield i + 2, {'email': f'{prefix}{i}@example.com', 'first_name': 'Иван', 'phone': phone,
+                      'status': 'Пайщик', 'price': '1000000', 'referrer_email': referrer}
+
+
+@scenario('import', 'Импорт участников (import_members) пачками, с пересборкой структуры')
+def member_import(out, options):
+    sizes = options['sizes'] or [5000, 50000]
+    out.write(f'{"строк":>8} {"загружено":>10} {"ошибок":>7} {"время, с":>9} {"строк/с":>8}')
+    for size in sizes:
+        with rolled_back():
+            seconds, result = timed(importer.import_members, member_rows(size))
+        out.write(f'{size:>8,} {result.created:>10,} {len(result.errors):>7,} {seconds:>9.1f} {size / seconds:>8,.0f}')
+
+
+def _stream(response):
+    """(секунды до первой строки данных, всего секунд, байт) чтения StreamingHttpResponse."""
+    started = time.perf_counter()
+    first_row, total = None, 0
+    for index, chunk in enumerate(response.streaming_content):
+        total += len(chunk)
+        if index == 2:  # BOM, заголовок, первая строка
+            first_row = time.perf_counter() - started
+    return first_row, time.perf_counter() - started, total
+
+
+@scenario('export', 'Потоковая выгрузка участников в CSV: первая строка, общее время и пик памяти')
+def member_export(out, options):
+    sizes = options['sizes'] or [10000, 100000]
+    out.write(f'{"участников":>11} {"первая строка, мс":>18} {"всего, с":>9} {"МБ":>7} {"пик памяти, МБ":>15}')
+    for size in sizes:
+        with rolled_back():
+            user_ids = create_members(size)
+            users = User.objects.filter(pk__gte=user_ids[0])
+            first_row, seconds, total = _stream(exporter.stream_members_csv(users))
+            # память — отдельным проходом: tracemalloc замедляет выгрузку в разы
+            tracemalloc.start()
+            _stream(exporter.stream_members_csv(users))
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        out.write(f'{size:>11,} {first_row * 1000:>18.1f} {seconds:>9.2f} {total / 2 ** 20:>7.1f} '
+                  f'{peak / 2 ** 20:>15.1f}')
+
+
+WIZARD_EDITS = [
+    ('can_edit', {'can_edit': 'One_done'}),
+    ('блок целиком', {'surname': 'Петрович', 'phone': '+79990000001', 'inn': '500100732259',
+                      'issued_by_whom': 'Отделом МВД', 'can_edit': 'One_done'}),
+    ('без изменений', {}),
+]
+
+
+def _full_save(profile):
+    """Прежний Profile.save: полная проверка и запись всех колонок."""
+    profile.full_clean()
+    models.Model.save(profile)
+
+
+@scenario('profile_save', 'Сохранение Profile в шагах анкеты: только изменённые поля и прежний полный save')
+def profile_save(out, options):
+    count = options['iterations'] or 2000
+    out.write(f'{"изменение":16} {"изменённые, мс":>15} {"полный save, мс":>16} {"выигрыш":>8}')
+    for name, changes in WIZARD_EDITS:
+        results = []
+        for save in (Profile.save, _full_save):
+            with rolled_back():
+                user_ids = create_members(count)
+                Profile.objects.bulk_create([Profile(user_id=user_id, phone='+79990000000', inn='770708389301',
+                                                     issued_by_whom='УФМС', can_edit='True')
+                                             for user_id in user_ids], batch_size=5000)
+                profiles = list(Profile.objects.filter(user_id__in=user_ids))
+                for profile in profiles:
+                    for field, value in changes.items():
+                        setattr(profile, field, value)
+                seconds, _ = timed(lambda: [save(profile) for profile in profiles])
+            results.append(seconds * 1000 / count)
+        out.write(f'{name:16} {results[0]:>15.3f} {results[1]:>16.3f} {results[1] / results[0]:>7.1f}x')
+
+
+@contextmanager
+def sqlite_copy(options, journal_mode='DELETE'):
+    """
+    Все соединения default, включая новые в потоках, открывают копию текущей
+    базы с OPTIONS = options; journal_mode записывается в сам файл, поэтому
+    копия для каждого варианта своя.
+    """
+    database = connections.settings['default']
+    saved = database['NAME'], database['OPTIONS']
+    connection.ensure_connection()
+    # рядом с рабочей базой: на том же диске, с той же ценой fsync
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(saved[0])) as directory:
+        path = os.path.join(directory, 'db.sqlite3')
+        target = sqlite3.connect(path)
+        connection.connection.backup(target)
+        target.execute(f'PRAGMA journal_mode={journal_mode}')
+        target.close()
+        connection.close()
+        database['NAME'], database['OPTIONS'] = path, options
+        try:
+            yield
+        finally:
+            connections.close_all()
+            database['NAME'], database['OPTIONS'] = saved
+
+
+def _register(count, threads, prefix):
+    """
+    count регистраций через VerifyRegistrationView в threads потоках, все по
+    приглашению одного консультанта, имена пользователей начинаются с prefix:
+    (секунды, неудачных запросов, самый долгий запрос в секундах).
+    """
+    referrer = User.objects.create(username=f'{prefix}referrer', email=f'{prefix}referrer@example.com')
+    password = make_password(None)
+    for i in range(count):
+        utils.cache_registration_data(f'{prefix}{i}', f'{prefix}{i}@example.com', {
+            'username': f'{prefix}{i}', 'email': f'{prefix}{i}@example.com', 'first_name': 'Иван',
+            'last_name': 'Петров', 'password_hash': password, 'phone': '', 'agree_to_terms': True,
+            'referrer_id': referrer.pk})
+    connection.close()  # основной поток не держит файл во время замера
+    errors, durations = [], []
+
+    def register(i):
+        # блокировка при записи сессии — ответ 400, в транзакции регистрации — 500
+        seconds, response = timed(Client(raise_request_exception=False).post,
+                                  reverse('personal_account:verify_email'), {'code': f'{prefix}{i}'})
+        durations.append(seconds)
+        if response.status_code != 302:
+            errors.append(response.status_code)
+
+    seconds = in_threads(register, threads, count)
+    return seconds, len(errors), max(durations, default=0)
+
+
+@scenario('registration', 'Параллельные регистрации (VerifyRegistrationView) на файле SQLite: без настроек '
+                          'и с WAL, BEGIN IMMEDIATE и busy_timeout из settings')
+def concurrent_registration(out, options):
+    if connection.vendor != 'sqlite':
+        out.write('Сценарий только для SQLite')
+        return
+    count = options['iterations'] or 400
+    variants = [('без настроек', {}, 'DELETE'),
+                ('настройки', connections.settings['default']['OPTIONS'], 'WAL')]
+    out.write(f'{"потоков":>8} ' + ' '.join(f'{name + ", рег/с":>20} {"ошибок":>7} {"макс., мс":>10}'
+                                            for name, _, _ in variants))
+    # коды регистрации — в памяти процесса, чтобы замер касался только базы
+    shared = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-registration',
+              'OPTIONS': {'MAX_ENTRIES': count * 3}}
+    logging.disable(logging.CRITICAL)  # трассировки неудачных запросов из django.request
+    try:
+        for threads in options['sizes'] or [1, 8, 32, 64]:
+            row = []
+            for name, database_options, journal_mode in variants:
+                with sqlite_copy(database_options, journal_mode), \
+                        override_settings(CACHES={**settings.CACHES, 'shared': shared}):
+                    seconds, errors, slowest = _register(count, threads, f'verify{time.time_ns()}_')
+                row.append(f'{(count - errors) / seconds:>20,.1f} {errors:>7} {slowest * 1000:>10,.0f}')
+            out.write(f'{threads:>8} ' + ' '.join(row))
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+def delete_users(prefix):
+    """Удаляет пользователей, созданных сценарием без отката, и историю их профилей."""
+    user_ids = list(User.objects.filter(username__startswith=prefix).values_list('pk', flat=True))
+    User.objects.filter(pk__in=user_ids).delete()
+    for historical in revisions.historical_models():
+        if any(field.attname == 'user_id' for field in historical._meta.concrete_fields):
+            historical.objects.filter(user_id__in=user_ids).delete()
+
+
+@scenario('views', 'Запросов в секунду к основным страницам кабинета и регистрации; запускать на SQLite '
+                   'и с DB_ENGINE=postgresql для сравнения')
+def view_throughput(out, options):
+    count = options['iterations'] or 400
+    thread_counts = options['sizes'] or [1, 8]
+    prefix = f'views{time.time_ns()}_'
+    # запросы из потоков видят только сохранённое: данные удаляются в конце, а не откатываются
+    consultant = User.objects.create(username=f'{prefix}consultant', email=f'{prefix}consultant@example.com')
+    Profile_queue.objects.create(user=consultant, status='Консультант')
+    Profile_partner.objects.create(user=consultant)
+    for i in range(50):
+        user = User.objects.create(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com')
+        Profile_queue.objects.create(user=user, status='Пайщик', price='1000000')
+        Profile_partner.objects.create(user=user, referred=consultant)
+    notifications = SystemNotification.objects.bulk_create([SystemNotification(title=f'Сообщение {i}', message='Текст')
+                                                            for i in range(20)])
+    pages = [('профиль', reverse('personal_account:user_profile', kwargs={'username': consultant.username})),
+             ('структура', reverse('personal_account:referral')),
+             ('уведомления', reverse('personal_account:notifications_list'))]
+    clients = {}
+    connection.close()  # соединение основного потока не занимает место в пуле во время замера
+
+    def get(url):
+        def request(i):
+            client = clients.get(threading.get_ident())
+            if client is None:
+                client = clients[threading.get_ident()] = Client()
+                client.force_login(consultant)
+            client.get(url)
+        return request
+
+    out.write(f'база: {connection.vendor}')
+    out.write(f'{"страница":14} ' + ' '.join(f'{f"{threads} пот., запр/с":>18}' for threads in thread_counts))
+    shared = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark-views',
+              'OPTIONS': {'MAX_ENTRIES': count * 3 * len(thread_counts)}}
+    logging.disable(logging.CRITICAL)
+    try:
+        for name, url in pages:
+            row = []
+            for threads in thread_counts:
+                clients.clear()
+                row.append(f'{count / in_threads(get(url), threads, count):>18,.1f}')
+            out.write(f'{name:14} ' + ' '.join(row))
+        row = []
+        with override_settings(CACHES={**settings.CACHES, 'shared': shared}):
+            for threads in thread_counts:
+                seconds, errors, _ = _register(count, threads, f'{prefix}verify{threads}_')
+                row.append(f'{(count - errors) / seconds:>18,.1f}')
+        out.write(f'{"регистрация":14} ' + ' '.join(row))
+    finally:
+        logging.disable(logging.NOTSET)
+        SystemNotification.objects.filter(pk__in=[notification.pk for notification in notifications]).delete()
+        delete_users(prefix)
+
+
+PHOTO_FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'photos')
+
+
+def phone_photo(width, height, seed, quality=95, orientation=6):
+    """
+    JPEG, похожий на снимок документа с телефона: светлый лист с текстом
+    на неровном фоне, шум матрицы, EXIF с поворотом, моделью и GPS.
+    """
+    rng = random.Random(seed)
+    image = Image.merge('RGB', [Image.linear_gradient('L').rotate(rng.randint(0, 359)).resize((width, height))
+                                for _ in range(3)])
+    draw = ImageDraw.Draw(image)
+    margin = width // 10
+    draw.rectangle([margin, margin, width - margin, height - margin], fill=(236, 233, 224))
+    line_height = max(height // 60, 4)
+    for top in range(margin * 2, height - margin * 2, line_height * 2):
+        left = margin * 2
+        while left < width - margin * 2:
+            word = rng.randint(line_height, line_height * 6)
+            draw.rectangle([left, top, min(left + word, width - margin * 2), top + line_height],
+                           fill=(rng.randint(20, 60),) * 3)
+            left += word + line_height
+    noise = Image.effect_noise((width, height), 18).convert('RGB')
+    image = Image.blend(image, noise, 0.12).filter(ImageFilter.GaussianBlur(0.6))
+
+    exif = Image.Exif()
+    if orientation:
+        exif[ExifTags.Base.Orientation] = orientation
+    exif[ExifTags.Base.Make] = 'Phone'
+    exif[ExifTags.Base.Model] = f'Camera {seed}'
+    exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: 'N', ExifTags.GPS.GPSLatitude: (55.0, 45.0, 0.0),
+                                   ExifTags.GPS.GPSLongitudeRef: 'E', ExifTags.GPS.GPSLongitude: (37.0, 37.0, 0.0)}
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=quality, exif=exif)
+    return buffer.getvalue()
+
+
+def photo_corpus():
+    """
+    Пары (имя, байты): крайние случаи из fixtures/photos и снимки в
+    разрешении телефонных камер (генерируются по seed, чтобы не хранить
+    в репозитории десятки мегабайт).
+    """
+    for name in sorted(os.listdir(PHOTO_FIXTURES)):
+        with open(os.path.join(PHOTO_FIXTURES, name), 'rb') as f:
+            yield name, f.read()
+    for seed, (width, height) in enumerate([(4032, 3024), (4000, 3000), (3264, 2448), (4624, 3472)]):
+        yield f'phone_{width}x{height}.jpg', phone_photo(width, height, seed)
+
+
+@scenario('photos', 'Перекодирование загруженных фото по набору fixtures/photos и снимкам с телефона')
+def photo_recompression(out, options):
+    out.write(f'{"файл":28} {"было, КБ":>10} {"стало, КБ":>10} {"сжатие":>7} {"мс":>7}')
+    total_in = total_out = 0
+    for name, data in photo_corpus():
+        seconds, result = timed(images.recompress_image, SimpleUploadedFile(name, data))
+        size = result.size if result is not None else len(data)
+        total_in += len(data)
+        total_out += size
+        out.write(f'{name:28} {len(data) / 1024:>10,.0f} {size / 1024:>10,.0f} {len(data) / size:>6.1f}x '
+                  f'{seconds * 1000:>7.0f}')
+    out.write(f'{"всего":28} {total_in / 1024:>10,.0f} {total_out / 1024:>10,.0f} {total_in / total_out:>6.1f}x')
+
+
+@scenario('media_gc', 'collect_media_garbage на синтетическом MEDIA_ROOT: каждый десятый файл с ссылкой из Profile')
+def media_garbage(out, options):
+    sizes = options['sizes'] or [100000, 1000000]
+    out.write(f'{"файлов":>10} {"ссылок":>8} {"ссылки, с":>10} {"команда, с":>12}')
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as root, override_settings(MEDIA_ROOT=root), rolled_back():
+            names = [f'documents/{i // 1000}/{i}.jpg' for i in range(size)]
+            for directory in {os.path.dirname(name) for name in names}:
+                os.makedirs(os.path.join(root, directory))
+            for name in names:
+                open(os.path.join(root, name), 'wb').close()
+            user_ids = create_members(size // 10)
+            Profile.objects.bulk_create([Profile(user_id=user_id, document_photo_main=names[i * 10])
+                                         for i, user_id in enumerate(user_ids)], batch_size=5000)
+            reference_seconds, _ = timed(storage.referenced_media)
+            # отчёт без удаления: stat() вызывается для каждого файла без ссылки
+            command_seconds, _ = timed(call_command, 'collect_media_garbage', grace_hours=0, stdout=StringIO())
+        out.write(f'{size:>10,} {len(user_ids):>8,} {reference_seconds:>10.2f} {command_seconds:>12.2f}')
+
+
+async def _idle_streams(count, events_to_send):
+    """
+    count открытых потоков NotificationStreamView на одном канале статуса:
+    (время подписки, байт на подключение, время доставки события всем).
+    """
+    from .views import NotificationStreamView
+
+    broker = events.get_broker()
+    view = NotificationStreamView()
+    channel = events.target_channel(SystemNotificationTarget.KIND_STATUS, 'Пайщик')
+    ready, received = [], []
+    all_ready, all_received = asyncio.Event(), asyncio.Event()
+
+    async def client(index):
+        async for chunk in view.stream([events.user_channel(index), channel]):
+            if chunk.startswith('retry:'):  # первая строка — подписка уже есть
+                ready.append(index)
+                if len(ready) == count:
+                    all_ready.set()
+            elif chunk.startswith('event:'):
+                received.append(index)
+                if len(received) == count * events_to_send:
+                    all_received.set()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(client(i)) for i in range(count)]
+    await asyncio.wait_for(all_ready.wait(), 120)
+    connect_seconds = time.perf_counter() - started
+    per_connection = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    await asyncio.sleep(0.2)  # Redis подтверждает SUBSCRIBE асинхронно
+
+    started = time.perf_counter()
+    for i in range(events_to_send):
+        await asyncio.to_thread(broker.publish, channel, {'type': 'notification', 'id': i})
+    await asyncio.wait_for(all_received.wait(), 120)
+    fanout_seconds = time.perf_counter() - started
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return connect_seconds, per_connection, fanout_seconds
+
+
+@scenario('sse', 'Простаивающие SSE-подключения в одном воркере: память и доставка события всем (--redis-url)')
+def sse_connections(out, options):
+    sizes = options['sizes'] or [100, 1000, 5000]
+    events_to_send = options['iterations'] or 1
+    brokers = [('inprocess', events.InProcessBroker)]
+    if options['redis_url']:
+        brokers.append(('redis', lambda: events.RedisBroker(options['redis_url'])))
+    out.write(f'{"брокер":10} {"подключений":>12} {"подписка, с":>12} {"КБ на подкл.":>13} {"доставка, мс":>13}')
+    for name, make_broker in brokers:
+        for size in sizes:
+            previous, events._broker = events._broker, make_broker()
+            try:
+                connect, per_connection, fanout = asyncio.run(_idle_streams(size, events_to_send))
+            finally:
+                events._broker = previous
+            out.write(f'{name:10} {size:>12,} {connect:>12.2f} {per_connection / 1024:>13.1f} '
+                      f'{fanout * 1000 / events_to_send:>13.1f}')
@@ -0,0 +1,184 @@
+# personal_account/cache.py
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """
+    Кеш в отдельном файле SQLite — локальная замена Redis.
+
+    Файл общий для всех воркеров на одном сервере, поэтому коды регистрации
+    и счётчики лимитов видны из любого процесса. Каждая операция, включая
+    пакетные set_many/get_many/delete_many, выполняется одной транзакцией
+    BEGIN IMMEDIATE (чтение — обычной), так что add и incr атомарны
+    между процессами. Соединение открывается одно на поток и живёт между
+    запросами (close() после запроса его не закрывает).
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = str(location)
+        self._timeout = options.get('timeout', 5)
+        # просроченные и лишние строки чистятся раз в cull_every записей, а не на каждой
+        self._cull_every = max(int(options.get('cull_every', 100)), 1)
+        self._writes = 0
+        self._local = threading.local()
+
+    def _connection(self):
+        """Одно соединение на поток; после fork воркера открывается новое."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self._path, timeout=self._timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)")
+        self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self, write=True):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def _select_live(self, conn, keys):
+        placeholders = ', '.join('?' * len(keys))
+        rows = conn.execute(
+            f"SELECT key, value FROM cache WHERE key IN ({placeholders}) "
+            "AND (expires IS NULL OR expires > ?)",
+            (*keys, time.time()),
+        )
+        return {key: pickle.loads(value) for key, value in rows}
+
+    def _write(self, conn, items, timeout):
+        expires = self.get_backend_timeout(timeout)
+        conn.executemany(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            [(key, self._dumps(value), expires) for key, value in items],
+        )
+        self._writes += 1
+        if self._writes % self._cull_every == 0:
+            self._cull(conn)
+
+    def _cull(self, conn):
+        conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+        count = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if count > self._max_entries:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN "
+                "(SELECT key FROM cache ORDER BY expires IS NULL, expires LIMIT ?)",
+                (count // self._cull_frequency,),
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            if self._select_live(conn, [key]):
+                return False
+            self._write(conn, [(key, value)], timeout)
+        return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction(write=False) as conn:
+            return self._select_live(conn, [key]).get(key, default)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            self._write(conn, [(key, value)], timeout)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE cache SET expires = ? WHERE key = ? AND (expires IS NULL OR expires > ?)",
+                (self.get_backend_timeout(timeout), key, time.time()),
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction(write=False) as conn:
+            return key in self._select_live(conn, [key])
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        with self._transaction() as conn:
+            current = self._select_live(conn, [key])
+            if key not in current:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = current[key] + delta
+            conn.execute("UPDATE cache SET value = ? WHERE key = ?", (self._dumps(new_value), key))
+        return new_value
+
+    def sliding_window_hit(self, current_key, previous_key, weight, limit, timeout, version=None):
+        """
+        Проверка лимита скользящего окна (ratelimit.RateLimit) одной транзакцией:
+        счётчик текущего окна растёт, только если попытка укладывается в limit.
+        Возвращает (разрешено, текущий счётчик, предыдущий).
+        """
+        current_key = self.make_and_validate_key(current_key, version=version)
+        previous_key = self.make_and_validate_key(previous_key, version=version)
+        with self._transaction() as conn:
+            counters = self._select_live(conn, [current_key, previous_key])
+            current, previous = counters.get(current_key, 0), counters.get(previous_key, 0)
+            if current + previous * weight + 1 > limit:
+                return False, current, previous
+            if current:
+                conn.execute("UPDATE cache SET value = ? WHERE key = ?", (self._dumps(current + 1), current_key))
+            else:
+                self._write(conn, [(current_key, 1)], timeout)
+        return True, current + 1, previous
+
+    def get_many(self, keys, version=None):
+        key_map = {self.make_and_validate_key(key, version=version): key for key in keys}
+        if not key_map:
+            return {}
+        with self._transaction(write=False) as conn:
+            found = self._select_live(conn, list(key_map))
+        return {key_map[key]: value for key, value in found.items()}
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        items = [(self.make_and_validate_key(key, version=version), value) for key, value in data.items()]
+        if items:
+            with self._transaction() as conn:
+                self._write(conn, items, timeout)
+        return []
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_and_validate_key(key, version=version) for key in keys]
+        if keys:
+            with self._transaction() as conn:
+                conn.executemany("DELETE FROM cache WHERE key = ?", [(key,) for key in keys])
+
+    def clear(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache")
@@ -0,0 +1,89 @@
+# personal_account/codes.py
+import hashlib
+import hmac
+import string
+
+from django.conf import settings
+
+ALPHABET = string.digits + string.ascii_uppercase
+CODE_DIGITS = 9          # 36**9 > 2**46 — любое число домена помещается в 9 знаков
+HALF_BITS = 23           # домен перестановки — 46 бит
+ROUNDS = 4
+TWEAK_SHIFT = 40         # до 2**40 пользователей, старшие 6 бит — номер попытки
+MAX_TWEAKS = 2 ** (2 * HALF_BITS - TWEAK_SHIFT)
+
+
+def _round_key(index):
+    key = getattr(settings, 'REFERRAL_CODE_KEY', settings.SECRET_KEY)
+    return hashlib.sha256(f"{key}:referral:{index}".encode()).digest()
+
+
+def _feistel(value):
+    """Перестановка 46-битных чисел: разные id всегда дают разные результаты."""
+    mask = (1 << HALF_BITS) - 1
+    left, right = value >> HALF_BITS, value & mask
+    for index in range(ROUNDS):
+        digest = hmac.new(_round_key(index), right.to_bytes(3, 'big'), hashlib.sha256).digest()
+        left, right = right, left ^ (int.from_bytes(digest[:3], 'big') & mask)
+    return (left << HALF_BITS) | right
+
+
+def _feistel_inverse(value):
+    mask = (1 << HALF_BITS) - 1
+    left, right = value >> HALF_BITS, value & mask
+    for index in reversed(range(ROUNDS)):
+        digest = hmac.new(_round_key(index), left.to_bytes(3, 'big'), hashlib.sha256).digest()
+        left, right = right ^ (int.from_bytes(digest[:3], 'big') & mask), left
+    return (left << HALF_BITS) | right
+
+
+def _check_char(body):
+    # ISO 7064 MOD 37,36: ловит любую замену одного знака и почти все перестановки соседних
+    modulus = len(ALPHABET)
+    product = modulus
+    for char in body:
+        total = (product + ALPHABET.index(char)) % modulus or modulus
+        product = total * 2 % (modulus + 1)
+    return ALPHABET[(modulus + 1 - product) % modulus]
+
+
+def make_referral_code(user_id, tweak=0):
+    """
+    Реферальный код пользователя: 9 знаков base36 и контрольный символ.
+
+    Код получается перестановкой id, поэтому новые коды между собой не
+    совпадают и проверять базу перед сохранением не нужно. Совпасть код
+    может только со старым случайным кодом — тогда сохранение падает на
+    уникальном индексе и код берётся со следующим tweak.
+    """
+    if not 0 <= user_id < 2 ** TWEAK_SHIFT or not 0 <= tweak < MAX_TWEAKS:
+        raise ValueError("id пользователя или номер попытки вне диапазона кода")
+    value = _feistel((tweak << TWEAK_SHIFT) | user_id)
+    digits = []
+    for _ in range(CODE_DIGITS):
+        value, digit = divmod(value, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    body = ''.join(reversed(digits))
+    return body + _check_char(body)
+
+
+def is_generated_code(code):
+    """True для кодов нового формата (старые случайные коды проверку обычно не проходят)."""
+    return (
+        bool(code) and len(code) == CODE_DIGITS + 1
+        and all(char in ALPHABET for char in code)
+        and _check_char(code[:-1]) == code[-1]
+    )
+
+
+def decode_referral_code(code):
+    """(user_id, tweak) кода нового формата; ValueError для чужих и старых кодов."""
+    if not is_generated_code(code):
+        raise ValueError("Код не в формате make_referral_code")
+    value = 0
+    for char in code[:-1]:
+        value = value * len(ALPHABET) + ALPHABET.index(char)
+    if value >> (2 * HALF_BITS):
+        raise ValueError("Код не в формате make_referral_code")
+    value = _feistel_inverse(value)
+    return value & (2 ** TWEAK_SHIFT - 1), value >> TWEAK_SHIFT
@@ -0,0 +1,136 @@
+# personal_account/delivery.py
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from . import events
+from .models import MessageNotification, NotificationCounter, SystemNotification, SystemNotificationTarget
+
+# До этого размера аудитории сообщение раскладывается по личным сообщениям
+FANOUT_ON_WRITE_LIMIT = getattr(settings, 'NOTIFICATION_FANOUT_ON_WRITE_LIMIT', 5000)
+FANOUT_CHUNK_SIZE = 1000
+
+
+def get_targets(notification):
+    """Словарь {тип получателей: [значения]}, включая старое поле status."""
+    targets = {}
+    if notification.status:
+        targets[SystemNotificationTarget.KIND_STATUS] = [notification.status]
+    for kind, value in notification.targets.values_list('kind', 'value'):
+        targets.setdefault(kind, []).append(value)
+    return targets
+
+
+def get_audience(notification):
+    targets = get_targets(notification)
+    if not targets:
+        return User.objects.none()
+
+    lookups = {
+        SystemNotificationTarget.KIND_STATUS: 'profile_queue__status__in',
+        SystemNotificationTarget.KIND_ADDITIONAL_STATUS: 'profile_queue__additional_status__in',
+        SystemNotificationTarget.KIND_CONSULTANT_LEVEL: 'profile_partner__consultant_level__in',
+    }
+    condition = Q()
+    for kind, values in targets.items():
+        condition |= Q(**{lookups[kind]: values})
+    return User.objects.filter(condition, is_active=True)
+
+
+def deliver(notification, fanout_on_write_limit=None):
+    """
+    Доставляет системное сообщение выбранным получателям.
+
+    Небольшой аудитории сообщение раскладывается при записи: каждому
+    создаётся MessageNotification (bulk_create порциями). Большой
+    аудитории — при чтении: страница уведомлений находит сообщение по
+    статусу пользователя, а в базе хранится одна строка.
+    Возвращает (способ доставки, размер аудитории).
+    """
+    if fanout_on_write_limit is None:
+        fanout_on_write_limit = FANOUT_ON_WRITE_LIMIT
+
+    audience = get_audience(notification)
+    size = audience.count()
+
+    with transaction.atomic():
+        if size <= fanout_on_write_limit:
+            mode = SystemNotification.DELIVERY_ON_WRITE
+            user_ids = audience.values_list('pk', flat=True).order_by('pk')
+            chunk = []
+            for user_id in user_ids.iterator(chunk_size=FANOUT_CHUNK_SIZE):
+                chunk.append(MessageNotification(
+                    to_user_id=user_id,
+                    title=notification.title,
+                    message=notification.message,
+                ))
+                if len(chunk) >= FANOUT_CHUNK_SIZE:
+                    MessageNotification.objects.bulk_create(chunk)
+                    chunk = []
+            if chunk:
+                MessageNotification.objects.bulk_create(chunk)
+            # счётчики непрочитанных увеличивает MessageNotificationQuerySet.bulk_create
+        else:
+            mode = SystemNotification.DELIVERY_ON_READ
+            NotificationCounter.add_unseen_system(audience)
+
+        notification.delivery_mode, notification.delivered_at = mode, timezone.now()
+        SystemNotification.objects.filter(pk=notification.pk).update(delivery_mode=mode,
+                                                                    delivered_at=notification.delivered_at)
+
+        # одно событие на канал получателей, а не на каждого пользователя
+        event = {'type': 'notification', 'id': notification.pk, 'title': notification.title}
+        channels = [events.target_channel(kind, value)
+                    for kind, values in get_targets(notification).items() for value in values]
+        transaction.on_commit(lambda: [events.publish(channel, event) for channel in channels])
+
+    return mode, size
+
+
+def deliver_pending(pk):
+    """Доставляет сообщение, если его ещё не доставили (сигнал post_save после COMMIT)."""
+    with transaction.atomic():
+        notification = (SystemNotification.objects.select_for_update()
+                        .filter(pk=pk, delivered_at__isnull=True).first())
+        if notification is not None:
+            return deliver(notification)
+    return None
+
+
+def channels_for_user(user):
+    """Каналы событий, на которые подписывается страница пользователя."""
+    channels = [events.user_channel(user.pk)]
+    profile_queue = getattr(user, 'profile_queue', None)
+    profile_partner = getattr(user, 'profile_partner', None)
+    if profile_queue:
+        channels.append(events.target_channel(SystemNotificationTarget.KIND_STATUS, profile_queue.status))
+        if profile_queue.additional_status:
+            channels.append(events.target_channel(SystemNotificationTarget.KIND_ADDITIONAL_STATUS,
+                                                  profile_queue.additional_status))
+    if profile_partner and profile_partner.consultant_level:
+        channels.append(events.target_channel(SystemNotificationTarget.KIND_CONSULTANT_LEVEL,
+                                              profile_partner.consultant_level))
+    return channels
+
+
+def notifications_for_user(user):
+    """Системные сообщения с доставкой при чтении, адресованные пользователю."""
+    profile_queue = getattr(user, 'profile_queue', None)
+    profile_partner = getattr(user, 'profile_partner', None)
+    status = profile_queue.status if profile_queue else None
+    additional_status = profile_queue.additional_status if profile_queue else None
+    consultant_level = profile_partner.consultant_level if profile_partner else None
+
+    target_condition = Q(kind=SystemNotificationTarget.KIND_STATUS, value=status)
+    if additional_status:
+        target_condition |= Q(kind=SystemNotificationTarget.KIND_ADDITIONAL_STATUS, value=additional_status)
+    if consultant_level:
+        target_condition |= Q(kind=SystemNotificationTarget.KIND_CONSULTANT_LEVEL, value=str(consultant_level))
+
+    targeted = SystemNotificationTarget.objects.filter(target_condition, notification=OuterRef('pk'))
+    return SystemNotification.objects.filter(
+        Q(status=status) | Exists(targeted),
+        delivery_mode=SystemNotification.DELIVERY_ON_READ,
+    )
@@ -0,0 +1,154 @@
+# personal_account/events.py
+import asyncio
+import json
+import logging
+import threading
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def target_channel(kind, value):
+    return f"{kind}:{value}"
+
+
+class InProcessBroker:
+    """
+    Pub/sub внутри одного процесса.
+
+    publish можно вызывать из любого потока (сигналы, синхронные view):
+    событие передаётся в цикл событий подписчика через call_soon_threadsafe.
+    Подписчики других процессов событие не получат — для нескольких
+    воркеров нужен RedisBroker.
+    """
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for queue, loop in subscribers:
+            loop.call_soon_threadsafe(self._put, queue, event)
+
+    @staticmethod
+    def _put(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass  # медленный клиент теряет событие, а не память сервера
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        entry = (queue, asyncio.get_running_loop())
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(entry)
+        try:
+            yield queue
+        finally:
+            with self._lock:
+                for channel in channels:
+                    self._subscribers[channel].discard(entry)
+                    if not self._subscribers[channel]:
+                        del self._subscribers[channel]
+
+
+class RedisBroker:
+    """
+    Pub/sub через Redis для нескольких процессов и серверов (settings.REDIS_URL).
+
+    Процесс держит одно соединение подписки на все открытые потоки: канал
+    подписывается в Redis с первым слушателем и отписывается после
+    последнего, а полученные события раздаются локальным очередям через
+    InProcessBroker.
+    """
+
+    prefix = 'notifications:'
+
+    def __init__(self, url=None):
+        self.url = url or settings.REDIS_URL
+        self._client = None
+        self._local = InProcessBroker()
+        self._listeners = Counter()
+        self._pubsub = None
+        self._reader = None
+        self._lock = None
+
+    def publish(self, channel, event):
+        import redis
+
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.prefix + channel, json.dumps(event))
+
+    async def _read(self):
+        import redis
+
+        while True:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except redis.ConnectionError as e:
+                # redis-py переподключится и восстановит подписки при следующем чтении
+                logger.warning("Потеряно соединение с Redis: %s", e)
+                await asyncio.sleep(1)
+                continue
+            if message is not None:
+                channel = message['channel'].decode()[len(self.prefix):]
+                self._local.publish(channel, json.loads(message['data']))
+
+    @asynccontextmanager
+    async def subscribe(self, channels):
+        import redis.asyncio
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        channels = set(channels)
+        async with self._local.subscribe(channels) as queue:
+            async with self._lock:
+                if self._pubsub is None:
+                    self._pubsub = redis.asyncio.Redis.from_url(self.url).pubsub()
+                new = [channel for channel in channels if not self._listeners[channel]]
+                self._listeners.update(channels)
+                if new:
+                    await self._pubsub.subscribe(*[self.prefix + channel for channel in new])
+                if self._reader is None:
+                    self._reader = asyncio.create_task(self._read())
+            try:
+                yield queue
+            finally:
+                async with self._lock:
+                    self._listeners.subtract(channels)
+                    idle = [channel for channel in channels if self._listeners[channel] <= 0]
+                    for channel in idle:
+                        del self._listeners[channel]
+                    if idle:
+                        await self._pubsub.unsubscribe(*[self.prefix + channel for channel in idle])
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.NOTIFICATION_BROKER)()
+        return _broker
+
+
+def publish(channel, event):
+    get_broker().publish(channel, event)
@@ -0,0 +1,92 @@
+# personal_account/exporter.py
+import csv
+
+from django.contrib.auth.models import User
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .importer import ADDRESS_COLUMNS, PROFILE_COLUMNS, QUEUE_COLUMNS
+
+CHUNK_SIZE = 2000
+
+EXPORT_RELATIONS = ('profile', 'profile_address', 'profile_queue', 'profile_partner', 'profile_partner__referred')
+
+# колонки совпадают с колонками импорта, выгрузку можно загрузить обратно
+EXPORT_COLUMNS = (
+    [('id', 'pk'), ('username', 'username'), ('email', 'email'), ('first_name', 'first_name'),
+     ('last_name', 'last_name'), ('date_joined', 'date_joined')]
+    + [(name, f'profile.{name}') for name in PROFILE_COLUMNS]
+    + [(name, f'profile_address.{name}') for name in ADDRESS_COLUMNS]
+    + [(name, f'profile_queue.{name}') for name in QUEUE_COLUMNS]
+    + [('referral_code', 'profile_partner.referral_code'),
+       ('consultant_level', 'profile_partner.consultant_level'),
+       ('referrer_email', 'profile_partner.referred.email')]
+)
+
+
+class Echo:
+    """Объект с write(), который просто возвращает строку — для csv.writer в потоке."""
+
+    def write(self, value):
+        return value
+
+
+def _value(user, path):
+    obj = user
+    for attr in path.split('.'):
+        obj = getattr(obj, attr, None)  # нет связанной строки профиля — пустая ячейка
+        if obj is None:
+            return ''
+    return obj
+
+
+def member_rows(users, chunk_size=CHUNK_SIZE):
+    """
+    Заголовок и строки выгрузки. Пользователи читаются порциями одним
+    JOIN-запросом на порцию, в памяти держится только текущая порция.
+    """
+    yield [header for header, _ in EXPORT_COLUMNS]
+    users = users.select_related(*EXPORT_RELATIONS).order_by('pk')
+    for user in users.iterator(chunk_size=chunk_size):
+        yield [_value(user, path) for _, path in EXPORT_COLUMNS]
+
+
+def members_for(queryset):
+    """Пользователи, которым принадлежат строки queryset (Profile, Profile_queue, ...)."""
+    return User.objects.filter(pk__in=queryset.values('user_id'))
+
+
+def stream_members_csv(users, filename=None):
+    writer = csv.writer(Echo())
+
+    def content():
+        yield '\ufeff'  # BOM — чтобы Excel открыл UTF-8 без перекодировки
+        for row in member_rows(users):
+            yield writer.writerow(row)
+
+    filename = filename or f"members_{timezone.localdate():%Y-%m-%d}.csv"
+    response = StreamingHttpResponse(content(), content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def write_members_xlsx(users, path):
+    try:
+        from openpyxl import Workbook
+    except ImportError:
+        raise ValueError("Для выгрузки в XLSX установите пакет openpyxl")
+    workbook = Workbook(write_only=True)  # строки пишутся сразу на диск
+    sheet = workbook.create_sheet('Участники')
+    count = -1
+    for count, row in enumerate(member_rows(users)):
+        sheet.append(row)
+    workbook.save(path)
+    return count
+
+
+def write_members_csv(users, file):
+    writer = csv.writer(file)
+    count = -1
+    for count, row in enumerate(member_rows(users)):
+        writer.writerow(row)
+    return count
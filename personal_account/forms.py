@@ -3,6 +3,7 @@ from django.contrib.auth.forms import UserCreationForm, AuthenticationForm
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator, FileExtensionValidator
 from . import models as md
+from .images import MAX_PHOTO_SIZE, recompress_image
 
 
 class LoginForm(AuthenticationForm):
@@ -231,14 +232,6 @@ class ProfileUpdateForm(forms.ModelForm):
             'document_photo_reg': forms.FileInput()
         }
 
-    def clean_document_photo(self):
-        photo_fields = ['document_photo_main', 'document_photo_reg']
-        for f in photo_fields:
-            f = self.cleaned_data.get('document_photo')
-            if f and f.size > 5 * 1024 * 1024:
-                raise md.ValidationError("Файл слишком большой (макс 5MB).")
-            return f
-
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if self.instance.birth_date:
@@ -502,6 +495,10 @@ class ProfileInviteeForm(forms.ModelForm):
                 if hasattr(self, 'instance') and self.instance.user_id == partner_profile.user_id:
                     raise forms.ValidationError("Вы не можете указать себя в качестве консультанта")
 
+                if hasattr(self, 'instance') and md.ReferralClosure.objects.filter(
+                        ancestor_id=self.instance.user_id, descendant_id=partner_profile.user_id).exists():
+                    raise forms.ValidationError("Нельзя указать консультантом участника своей структуры")
+
                 self.referred_user_id = partner_profile.user_id
             except md.Profile_partner.DoesNotExist:
                 raise forms.ValidationError("Реферальный код не найден")
@@ -600,14 +597,6 @@ class ProfileQueueForm(forms.ModelForm):
             'membership_fee_photo'
         ]
 
-    def clean_document_photo(self):
-        photo_fields = ['contract_photo', 'share_payment_photo', 'membership_fee_photo']
-        for f in photo_fields:
-            f = self.cleaned_data.get('document_photo')
-            if f and f.size > 5 * 1024 * 1024:
-                raise md.ValidationError("Файл слишком большой (макс 5MB).")
-            return f
-
 
 class ProcessingApplicationForm(forms.ModelForm):
     class Meta:
@@ -656,6 +645,23 @@ class FeedbackForm(forms.Form):
     def clean_photo(self):
         photo = self.cleaned_data.get('photo')
         if photo:
-            if photo.size > 5 * 1024 * 1024:  # 5MB
+            # в письмо уходит уменьшенная копия, предел — для неё
+            photo = recompress_image(photo) or photo
+            if photo.size > MAX_PHOTO_SIZE:
                 raise forms.ValidationError("Файл слишком большой. Максимальный размер 5MB.")
         return photo
+
+
+class MemberImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл участников',
+        validators=[FileExtensionValidator(allowed_extensions=['csv', 'xlsx'])],
+        help_text='CSV или XLSX, первая строка — названия колонок (email, first_name, last_name, phone, inn, ...)'
+    )
+    delimiter = forms.ChoiceField(
+        label='Разделитель CSV',
+        choices=[(',', 'Запятая'), (';', 'Точка с запятой')],
+        initial=','
+    )
+    dry_run = forms.BooleanField(label='Только проверить, ничего не записывать', required=False)
+    with_history = forms.BooleanField(label='Записать начальные версии в историю изменений', required=False)
@@ -0,0 +1,138 @@
+# personal_account/images.py
+import logging
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.db import models
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 350  # ширина превью в админке
+THUMBNAIL_QUALITY = 80
+
+MAX_IMAGE_SIDE = 2560  # текст документа читается, фото с телефона уменьшается в 2-3 раза
+UPLOAD_QUALITY = 82
+
+MAX_PHOTO_SIZE = 5 * 1024 * 1024    # предел для сохраняемого, уже перекодированного фото
+MAX_UPLOAD_SIZE = 40 * 1024 * 1024  # файлы больше не декодируются и отклоняются по MAX_PHOTO_SIZE
+
+
+def thumbnail_name(name, size=THUMBNAIL_SIZE):
+    """documents/1_Иван/фото.jpg -> documents/1_Иван/thumbs/фото_350.webp"""
+    directory, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    return os.path.join(directory, 'thumbs', f"{stem}_{size}.webp")
+
+
+def make_thumbnail(storage, name, size=THUMBNAIL_SIZE):
+    """
+    Создаёт уменьшенную копию изображения рядом с оригиналом, если её ещё нет.
+
+    Возвращает имя превью или None, если файл не найден или не изображение.
+    """
+    thumb = thumbnail_name(name, size)
+    if storage.exists(thumb):
+        return thumb
+    try:
+        with storage.open(name, 'rb') as f:
+            image = ImageOps.exif_transpose(Image.open(f))
+            image.thumbnail((size, size * 4))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGB')
+            buffer = BytesIO()
+            image.save(buffer, 'WEBP', quality=THUMBNAIL_QUALITY)
+    except (OSError, UnidentifiedImageError) as e:
+        logger.warning("Не удалось создать превью %s: %s", name, e)
+        return None
+    # storage.save не перезапишет файл, созданный параллельным запросом, а добавит суффикс
+    return storage.save(thumb, ContentFile(buffer.getvalue()))
+
+
+def thumbnail_url(fieldfile, size=THUMBNAIL_SIZE):
+    """URL превью для ImageField; превью создаётся при первом обращении."""
+    if not fieldfile:
+        return None
+    thumb = make_thumbnail(fieldfile.storage, fieldfile.name, size)
+    return fieldfile.storage.url(thumb) if thumb else fieldfile.url
+
+
+def image_fields():
+    """Пары (модель, поле) для всех ImageField приложения personal_account."""
+    for model in apps.get_app_config('personal_account').get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.ImageField):
+                yield model, field
+
+
+def recompress_image(file):
+    """
+    Перекодирует загруженное фото в JPEG: поворот по EXIF, уменьшение до
+    MAX_IMAGE_SIDE по длинной стороне, качество UPLOAD_QUALITY, без EXIF
+    (в снимках с телефона там координаты и модель устройства).
+
+    Возвращает ContentFile с именем *.jpg или None, если файл не удалось
+    прочитать как изображение — тогда он сохраняется как есть.
+    """
+    if file.size > MAX_UPLOAD_SIZE:
+        return None
+    try:
+        file.seek(0)
+        image = Image.open(file)
+        has_exif = bool(image.getexif())
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > MAX_IMAGE_SIDE
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', quality=UPLOAD_QUALITY, optimize=True, progressive=True)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning("Не удалось перекодировать %s: %s", getattr(file, 'name', file), e)
+        return None
+    finally:
+        file.seek(0)
+
+    # небольшой JPEG без EXIF перекодирование только увеличит
+    if not has_exif and not resized and buffer.tell() >= file.size:
+        return None
+    stem = os.path.splitext(os.path.basename(file.name))[0]
+    return ContentFile(buffer.getvalue(), name=f"{stem}.jpg")
+
+
+def process_uploaded_images(instance):
+    """
+    Перекодирует ещё не сохранённые файлы ImageField перед проверкой и
+    записью, чтобы валидаторы видели размер итогового файла, а upload_to
+    получил уже уменьшенный JPEG. Каждый файл перекодируется один раз.
+    Возвращает имена полей с новыми файлами.
+    """
+    uploaded = []
+    for field in instance._meta.concrete_fields:
+        if not isinstance(field, models.ImageField):
+            continue
+        fieldfile = getattr(instance, field.attname)
+        if not fieldfile or fieldfile._committed:
+            continue
+        if not getattr(fieldfile.file, 'recompressed', False):
+            recompressed = recompress_image(fieldfile.file)
+            if recompressed is not None:
+                fieldfile.file = recompressed
+                fieldfile.name = recompressed.name
+            fieldfile.file.recompressed = True
+        uploaded.append(field.attname)
+    return uploaded
+
+
+def make_thumbnails_for(instance, field_names):
+    for name in field_names:
+        fieldfile = getattr(instance, name)
+        if fieldfile:
+            make_thumbnail(fieldfile.storage, fieldfile.name)
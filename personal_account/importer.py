@@ -0,0 +1,301 @@
+# personal_account/importer.py
+import csv
+import io
+from collections import namedtuple
+from datetime import date, datetime
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
+from simple_history.utils import bulk_create_with_history
+
+from . import revisions
+from .codes import make_referral_code
+from .models import Profile, Profile_address, Profile_partner, Profile_queue
+from .referrals import rebuild_aggregates, rebuild_closure
+
+CHUNK_SIZE = 1000
+
+USER_COLUMNS = ('username', 'email', 'first_name', 'last_name')
+PROFILE_COLUMNS = ('surname', 'phone', 'document_type', 'id_document', 'issued_by_whom', 'inn',
+                   'birth_date', 'date_of_issue')
+ADDRESS_COLUMNS = tuple(field.name for field in Profile_address._meta.concrete_fields
+                        if field.name.startswith(('reg_', 'act_')))
+QUEUE_COLUMNS = ('type_of_purchase', 'status', 'additional_status', 'price', 'price_in_queue', 'id_coor')
+# пригласивший: код существующего консультанта или email (в том числе строки выше в файле)
+PARTNER_COLUMNS = ('consultant_level', 'referrer_code', 'referrer_email')
+
+ImportResult = namedtuple('ImportResult', ['created', 'errors'])
+RowError = namedtuple('RowError', ['line', 'email', 'message'])
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # телефоны и ИНН в Excel приходят числами
+    return value if isinstance(value, date) else str(value).strip()
+
+
+def read_rows(file, filename, delimiter=','):
+    """Построчно читает CSV или XLSX, возвращает пары (номер строки, словарь колонок)."""
+    if filename.lower().endswith('.xlsx'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ValueError("Для импорта XLSX установите пакет openpyxl")
+        workbook = load_workbook(file, read_only=True, data_only=True)
+        rows = workbook.active.iter_rows(values_only=True)
+    else:
+        if isinstance(file.read(0), bytes):
+            file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+        rows = csv.reader(file, delimiter=delimiter)
+
+    header = [str(name).strip() for name in next(rows, ()) if name is not None]
+    for line, values in enumerate(rows, start=2):
+        values = [_cell(value) for value in values]
+        if any(values):
+            yield line, dict(zip(header, values))
+
+
+def _parse_date(name, value):
+    if not value or isinstance(value, date):
+        return value or None
+    for fmt in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValidationError({name: 'Дата должна быть в формате ДД.ММ.ГГГГ'})
+
+
+def _messages(error):
+    if hasattr(error, 'message_dict'):
+        return '; '.join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+    return ' '.join(error.messages)
+
+
+class _Member:
+    """Проверенная строка файла: несохранённые объекты всех таблиц профиля."""
+
+    def __init__(self, line, row, password):
+        self.line = line
+        email = row.get('email', '')
+        self.user = User(username=row.get('username') or email,
+                         email=email,
+                         first_name=row.get('first_name', ''),
+                         last_name=row.get('last_name', ''),
+                         password=password)
+        profile_values = {name: row[name] for name in PROFILE_COLUMNS if name in row}
+        for name in ('birth_date', 'date_of_issue'):
+            if name in profile_values:
+                profile_values[name] = _parse_date(name, profile_values[name])
+        self.profile = Profile(**profile_values)
+        # адрес необязателен, но если заполнен — проверяется целиком, как в форме
+        address_values = {name: row[name] for name in ADDRESS_COLUMNS if name in row}
+        self.address = Profile_address(**address_values) if any(address_values.values()) else None
+        # пустые ячейки не затирают значения по умолчанию (статус «Обработка»)
+        self.queue = Profile_queue(**{name: row[name] for name in QUEUE_COLUMNS if row.get(name, '') != ''})
+        level = row.get('consultant_level')
+        try:
+            self.partner = Profile_partner(consultant_level=int(level) if level else None)
+        except ValueError:
+            raise ValidationError({'consultant_level': 'Уровень консультанта должен быть числом'})
+        self.referrer_code = row.get('referrer_code', '')
+        self.referrer_email = row.get('referrer_email', '').lower()
+        self.referred = None
+
+    def validate(self):
+        errors = {}
+        if not self.user.email:
+            errors['email'] = ['Не указан email']
+        checks = [(self.user, ['password']),
+                  (self.profile, ['user']),
+                  (self.queue, ['user']),
+                  (self.partner, ['user', 'referral_code', 'referral_link', 'referred'])]
+        if self.address:
+            checks.append((self.address, ['user']))
+        for instance, exclude in checks:
+            try:
+                instance.clean_fields(exclude=exclude)
+            except ValidationError as e:
+                errors.update(e.message_dict)
+        try:
+            self.profile.clean()
+        except ValidationError as e:
+            errors.setdefault('__all__', []).extend(e.messages)
+        if errors:
+            raise ValidationError(errors)
+
+    def attach(self, user):
+        for instance in (self.profile, self.address, self.queue, self.partner):
+            if instance is not None:
+                instance.user = user
+
+
+def _lowered_users():
+    return User.objects.annotate(username_lower=Lower('username'), email_lower=Lower('email'))
+
+
+class MemberImporter:
+    """
+    Загружает участников пачками: каждая пачка — одна транзакция и по одному
+    bulk_create на таблицу. Построчные сигналы (create_user_profile, таблица
+    замыкания, итоги структуры) не вызываются — структура и итоги
+    пересчитываются целиком после загрузки. Начальные записи истории
+    изменений пишутся только с with_history: они удваивают число вставок.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, dry_run=False, with_history=False):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.with_history = with_history
+        self.password = make_password(None)  # вход после смены пароля через «Забыли пароль»
+        self.seen = set()       # username и email, уже встреченные в файле
+        self.imported = {}      # email -> id загруженных пользователей
+        self.errors = []
+        self.created = 0
+
+    def run(self, rows):
+        chunk = []
+        for line, row in rows:
+            chunk.append((line, row))
+            if len(chunk) >= self.chunk_size:
+                self._import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self._import_chunk(chunk)
+
+        if self.created and not self.dry_run:
+            rebuild_closure()
+            rebuild_aggregates()
+        # проверки идут по этапам пачки — в отчёте ошибки по порядку строк
+        return ImportResult(self.created, sorted(self.errors))
+
+    def _error(self, line, email, message):
+        self.errors.append(RowError(line, email, message))
+
+    def _parse(self, chunk):
+        members = []
+        for line, row in chunk:
+            email = row.get('email', '')
+            try:
+                member = _Member(line, row, self.password)
+                member.validate()
+            except ValidationError as e:
+                self._error(line, email, _messages(e))
+                continue
+            keys = {member.user.username.lower(), member.user.email.lower()}
+            if keys & self.seen:
+                self._error(line, email, 'Повтор пользователя в файле')
+                continue
+            self.seen |= keys
+            members.append(member)
+        return members
+
+    def _drop_existing(self, members):
+        # без учёта регистра, как и повторы внутри файла
+        usernames = [member.user.username.lower() for member in members]
+        emails = [member.user.email.lower() for member in members]
+        existing = set()
+        for username, email in _lowered_users().filter(Q(username_lower__in=usernames) | Q(email_lower__in=emails)) \
+                                               .values_list('username_lower', 'email_lower'):
+            existing |= {username, email}
+        kept = []
+        for member in members:
+            if {member.user.username.lower(), member.user.email.lower()} & existing:
+                self._error(member.line, member.user.email, 'Пользователь уже зарегистрирован')
+            else:
+                kept.append(member)
+        return kept
+
+    def _resolve_referrers(self, members):
+        codes = {member.referrer_code for member in members if member.referrer_code}
+        by_code = dict(Profile_partner.objects.filter(referral_code__in=codes).values_list('referral_code', 'user_id'))
+        emails = {member.referrer_email for member in members if member.referrer_email} - set(self.imported)
+        by_email = dict(_lowered_users().filter(email_lower__in=emails).values_list('email_lower', 'pk'))
+
+        in_file = set(self.imported)
+        kept = []
+        for member in members:
+            if member.referrer_code:
+                member.referred = by_code.get(member.referrer_code)
+                if member.referred is None:
+                    self._error(member.line, member.user.email, 'Реферальный код пригласившего не найден')
+                    continue
+            elif member.referrer_email:
+                member.referred = by_email.get(member.referrer_email)
+                if member.referred is None and member.referrer_email not in in_file:
+                    self._error(member.line, member.user.email, 'Пригласивший не найден')
+                    continue
+            in_file.add(member.user.email.lower())
+            kept.append(member)
+        return kept
+
+    def _assign_referral_codes(self, partners):
+        codes = {partner.user_id: make_referral_code(partner.user_id) for partner in partners}
+        # новые коды не совпадают между собой, но могут совпасть со старыми случайными
+        taken = set(Profile_partner.objects.filter(referral_code__in=codes.values())
+                                           .values_list('referral_code', flat=True))
+        for partner in partners:
+            tweak = 0
+            code = codes[partner.user_id]
+            while code in taken:
+                tweak += 1
+                code = make_referral_code(partner.user_id, tweak)
+            partner.referral_code = code
+            partner.referral_link = f"/register?ref={code}"
+
+    def _bulk_create(self, objs, model):
+        if self.with_history and not revisions.enabled():
+            bulk_create_with_history(objs, model, default_change_reason='Импорт участников')
+            return
+        model.objects.bulk_create(objs)
+        if self.with_history:
+            revisions.record_created(objs, change_reason='Импорт участников')
+
+    def _import_chunk(self, chunk):
+        members = self._resolve_referrers(self._drop_existing(self._parse(chunk)))
+        if self.dry_run:
+            # при проверке без записи считаем, сколько строк было бы загружено
+            self.created += len(members)
+            self.imported.update((member.user.email.lower(), None) for member in members)
+            return
+        if not members:
+            return
+
+        with transaction.atomic():
+            users = User.objects.bulk_create([member.user for member in members])
+            for member, user in zip(members, users):
+                member.attach(user)
+                self.imported[user.email.lower()] = user.pk
+            for member in members:
+                if member.referred is None and member.referrer_email:
+                    member.referred = self.imported[member.referrer_email]
+                member.partner.referred_id = member.referred
+
+            partners = [member.partner for member in members]
+            self._assign_referral_codes(partners)
+            for objs, model in (([member.profile for member in members], Profile),
+                                ([member.address for member in members if member.address], Profile_address),
+                                ([member.queue for member in members], Profile_queue),
+                                (partners, Profile_partner)):
+                self._bulk_create(objs, model)
+        self.created += len(members)
+
+
+def import_members(rows, chunk_size=CHUNK_SIZE, dry_run=False, with_history=False):
+    """Загружает строки read_rows, возвращает ImportResult(загружено, ошибки)."""
+    return MemberImporter(chunk_size, dry_run, with_history).run(rows)
+
+
+def write_error_report(errors, file):
+    writer = csv.writer(file)
+    writer.writerow(['Строка', 'Email', 'Ошибки'])
+    for error in errors:
+        writer.writerow(error)
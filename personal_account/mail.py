@@ -0,0 +1,205 @@
+# personal_account/mail.py
+import logging
+import time
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .delivery import get_audience
+from .models import OutgoingEmail
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 60  # 1, 2, 4, 8, 16 минут между попытками
+BULK_CHUNK_SIZE = 200
+CLAIM_SECONDS = 600  # письмо упавшего воркера снова попадёт в очередь через 10 минут
+
+BulkSendResult = namedtuple('BulkSendResult', ['sent', 'failed', 'seconds'])
+
+
+def enqueue_email(subject, body, to, from_email=None, attachment=None):
+    """Ставит письмо в очередь. Отправляет его команда send_queued_mail."""
+    email = OutgoingEmail(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+    )
+    if attachment:
+        attachment.seek(0)
+        email.attachment = attachment
+        email.attachment_name = attachment.name
+        email.attachment_mimetype = getattr(attachment, 'content_type', '') or ''
+    email.save()
+    return email
+
+
+def _build_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        connection=connection,
+    )
+    if email.attachment:
+        with email.attachment.open('rb') as f:
+            message.attach(email.attachment_name, f.read(), email.attachment_mimetype or None)
+    return message
+
+
+def _schedule_retry(email, error, max_attempts):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= max_attempts:
+        email.status = OutgoingEmail.STATUS_FAILED
+    else:
+        email.status = OutgoingEmail.STATUS_PENDING
+        delay = RETRY_BASE_SECONDS * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+    logger.warning("Не удалось отправить письмо %s (попытка %s): %s", email.pk, email.attempts, error)
+
+
+def _mark_sent(email):
+    email.status = OutgoingEmail.STATUS_SENT
+    email.sent_at = timezone.now()
+    email.attempts += 1
+    email.last_error = ''
+    if email.attachment:
+        email.attachment.delete(save=False)
+    email.save(update_fields=['status', 'sent_at', 'attempts', 'last_error', 'attachment'])
+
+
+def _claim_batch(batch_size):
+    """
+    Забирает до batch_size писем, готовых к отправке, в статус «Отправляется».
+
+    Письмо захватывается условным UPDATE: если его уже забрал другой
+    воркер (изменились статус или next_attempt_at), строка не обновится
+    и письмо останется тому воркеру. Захват действует CLAIM_SECONDS,
+    потом письмо снова доступно — на случай, если воркер упал.
+    """
+    now = timezone.now()
+    claimed_until = now + timedelta(seconds=CLAIM_SECONDS)
+    candidates = OutgoingEmail.objects.filter(
+        status__in=[OutgoingEmail.STATUS_PENDING, OutgoingEmail.STATUS_SENDING],
+        next_attempt_at__lte=now,
+    ).order_by('next_attempt_at')[:batch_size]
+    batch = []
+    with transaction.atomic():
+        for email in candidates:
+            claimed = OutgoingEmail.objects.filter(
+                pk=email.pk,
+                status=email.status,
+                next_attempt_at=email.next_attempt_at,
+            ).update(status=OutgoingEmail.STATUS_SENDING, next_attempt_at=claimed_until)
+            if claimed:
+                email.status = OutgoingEmail.STATUS_SENDING
+                email.next_attempt_at = claimed_until
+                batch.append(email)
+    return batch
+
+
+def send_queued_emails(batch_size=50, max_attempts=MAX_ATTEMPTS):
+    """
+    Отправляет пачку писем из очереди через одно SMTP-соединение.
+
+    Возвращает кортеж (отправлено, ошибок). Письма с ошибкой откладываются
+    с экспоненциальной задержкой, после max_attempts попыток получают
+    статус «Ошибка отправки». Несколько воркеров (send_queued_mail --loop)
+    могут работать одновременно: каждое письмо отправляет тот, кто его захватил.
+    """
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for email in batch:
+            _schedule_retry(email, e, max_attempts)
+        return 0, len(batch)
+
+    sent = failed = 0
+    try:
+        for email in batch:
+            try:
+                connection.send_messages([_build_message(email, connection)])
+            except Exception as e:
+                _schedule_retry(email, e, max_attempts)
+                failed += 1
+                # соединение могло оборваться — открываем заново для остальных писем
+                connection.close()
+                try:
+                    connection.open()
+                except Exception:
+                    pass
+            else:
+                _mark_sent(email)
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _send_chunk(notification, recipients):
+    connection = get_connection()
+    messages = [
+        EmailMessage(
+            subject=notification.title,
+            body=notification.message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[recipient],
+            connection=connection,
+        )
+        for recipient in recipients
+    ]
+    # send_messages открывает соединение один раз на всю пачку
+    return connection.send_messages(messages) or 0
+
+
+def send_bulk_notification(notification, chunk_size=BULK_CHUNK_SIZE):
+    """
+    Рассылает системное сообщение на почту всем его получателям.
+
+    Получатели читаются из базы порциями по chunk_size, каждая порция
+    уходит через одно SMTP-соединение. Ошибка одной порции не прерывает
+    рассылку, её письма считаются неотправленными.
+    """
+    recipients = (
+        get_audience(notification)
+        .exclude(email='')
+        .order_by('pk')
+        .values_list('email', flat=True)
+    )
+
+    started = time.monotonic()
+    sent = failed = 0
+    chunk = []
+
+    def flush():
+        nonlocal sent, failed
+        try:
+            count = _send_chunk(notification, chunk)
+        except Exception as e:
+            logger.warning("Ошибка рассылки уведомления %s: %s", notification.pk, e)
+            count = 0
+        sent += count
+        failed += len(chunk) - count
+        chunk.clear()
+
+    for email in recipients.iterator(chunk_size=chunk_size):
+        chunk.append(email)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    return BulkSendResult(sent, failed, time.monotonic() - started)
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from personal_account.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности; данные сценария в базе не остаются'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', nargs='?', choices=sorted(SCENARIOS),
+                            help='Сценарий; без него — список сценариев')
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            help='Размеры данных (число участников, узлов и т. п.)')
+        parser.add_argument('--iterations', type=int, help='Повторов на замер')
+        parser.add_argument('--threads', type=int, default=1, help='Параллельных потоков')
+        parser.add_argument('--redis-url', default='', help='Redis для сравнения, например redis://127.0.0.1:6379/15')
+
+    def handle(self, *args, **options):
+        if not options['scenario']:
+            for name, (func, description) in sorted(SCENARIOS.items()):
+                self.stdout.write(f'{name:14} {description}')
+            return
+        func, description = SCENARIOS[options['scenario']]
+        self.stdout.write(self.style.SUCCESS(description))
+        func(self.stdout, options)
@@ -0,0 +1,59 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_account.models import MediaBlob
+from personal_account.storage import is_blob, media_key, referenced_media, walk_media
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = ('Ищет в MEDIA_ROOT файлы, на которые не ссылается ни одна таблица (включая историю '
+            'изменений). По умолчанию только отчёт, удаление — с --delete')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Удалить найденные файлы')
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help='Не трогать файлы моложе указанного числа часов: '
+                                 'их загрузка могла ещё не сохраниться в базе')
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        if not os.path.isdir(root):
+            raise CommandError(f'Каталог MEDIA_ROOT не найден: {root}')
+        delete = options['delete']
+        cutoff = time.time() - options['grace_hours'] * 3600
+
+        started = time.monotonic()
+        referenced = referenced_media()
+        scanned = recent = orphans = size = 0
+        blobs = []
+        for path, entry in walk_media(root):
+            scanned += 1
+            if media_key(path) in referenced:
+                continue
+            stat = entry.stat(follow_symlinks=False)  # только для кандидатов на удаление
+            if stat.st_mtime > cutoff:
+                recent += 1
+                continue
+            orphans += 1
+            size += stat.st_size
+            if options['verbosity'] >= 2:
+                self.stdout.write(path)
+            if delete:
+                os.remove(entry.path)
+                if is_blob(path):
+                    blobs.append(path)
+            if len(blobs) >= BATCH_SIZE:
+                MediaBlob.objects.filter(name__in=blobs).delete()
+                blobs = []
+        if blobs:
+            MediaBlob.objects.filter(name__in=blobs).delete()
+
+        self.stdout.write(f'Файлов просмотрено: {scanned}, '
+                          f'пропущено новых: {recent}, за {time.monotonic() - started:.1f} с')
+        message = f'{"Удалено" if delete else "Без ссылок"}: {orphans} файлов, {size / 1024 / 1024:.1f} МБ'
+        self.stdout.write(self.style.SUCCESS(message) if delete else self.style.WARNING(message))
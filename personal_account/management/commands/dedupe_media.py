@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from personal_account.images import thumbnail_name
+from personal_account.models import MediaBlob
+from personal_account.storage import BLOB_DIR, blob_fields, document_storage
+
+
+class Command(BaseCommand):
+    help = ('Переносит фото документов из MEDIA_ROOT в хранилище по содержимому (одинаковые файлы '
+            'хранятся один раз), пересчитывает ссылки и, с --collect, удаляет блобы без ссылок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять')
+        parser.add_argument('--collect', action='store_true', help='Удалить блобы без ссылок')
+        parser.add_argument('--grace-hours', type=int, default=24,
+                            help='Не удалять блобы моложе указанного числа часов')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = missing = 0
+        blobs = {}  # старое имя -> блоб, один файл может стоять в нескольких полях
+        for model in MediaBlob.referencing_models():
+            for field in blob_fields(model):
+                storage = field.storage
+                names = (model._default_manager.exclude(**{field.attname: ''})
+                         .exclude(**{f'{field.attname}__isnull': True})
+                         .exclude(**{f'{field.attname}__startswith': BLOB_DIR + '/'})
+                         .values_list(field.attname, flat=True).distinct())
+                for name in list(names):
+                    if name not in blobs:
+                        if not storage.exists(name):
+                            missing += 1
+                            self.stdout.write(self.style.WARNING(f'Нет файла: {name}'))
+                            continue
+                        with storage.open(name, 'rb') as f:
+                            blobs[name] = storage.blob_name(f, name) if dry_run else storage.save_blob(name, f)
+                    moved += 1
+                    if dry_run:
+                        continue
+                    # история тоже переводится на блоб, иначе старые версии потеряют файл
+                    with transaction.atomic():
+                        for target in (model, model.history.model):
+                            target._default_manager.filter(**{field.attname: name}) \
+                                                   .update(**{field.attname: blobs[name]})
+
+        duplicates = len(blobs) - len(set(blobs.values()))
+        freed = 0
+        if blobs and not dry_run:
+            storage = document_storage()
+            for name in blobs:
+                freed += storage.size(name)
+                storage.delete(thumbnail_name(name))
+                storage.delete(name)
+            freed -= sum(MediaBlob.objects.filter(name__in=set(blobs.values())).values_list('size', flat=True))
+
+        self.stdout.write(f'Ссылок перенесено: {moved}, файлов: {len(blobs)}, из них повторов: {duplicates}, '
+                          f'не найдено: {missing}')
+        if not dry_run:
+            self.stdout.write(f'Освобождено байт: {max(freed, 0)}')
+            fixed = MediaBlob.recount()
+            self.stdout.write(f'Исправлено счётчиков ссылок: {fixed}')
+
+        if options['collect']:
+            older_than = timezone.now() - timedelta(hours=options['grace_hours'])
+            removed, size = MediaBlob.collect_garbage(older_than, dry_run=dry_run)
+            self.stdout.write(self.style.SUCCESS(f'Удалено блобов без ссылок: {removed} ({size} байт)'))
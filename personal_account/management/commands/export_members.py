@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_account.exporter import write_members_csv, write_members_xlsx
+
+
+class Command(BaseCommand):
+    help = 'Выгружает участников со всеми таблицами профиля в CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv или .xlsx')
+        parser.add_argument('--status', action='append',
+                            help='Только участники с этим статусом (можно указать несколько раз)')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        users = User.objects.all()
+        if options['status']:
+            users = users.filter(profile_queue__status__in=options['status'])
+
+        if path.suffix.lower() == '.xlsx':
+            try:
+                count = write_members_xlsx(users, path)
+            except ValueError as e:
+                raise CommandError(e)
+        else:
+            with path.open('w', newline='', encoding='utf-8-sig') as file:
+                count = write_members_csv(users, file)
+        self.stdout.write(self.style.SUCCESS(f'Выгружено участников: {count}, файл: {path}'))
@@ -0,0 +1,39 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from personal_account.importer import CHUNK_SIZE, import_members, read_rows, write_error_report
+
+
+class Command(BaseCommand):
+    help = 'Загружает участников кооператива из CSV или XLSX'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл .csv или .xlsx, первая строка — названия колонок')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Сколько строк записывать одной транзакцией')
+        parser.add_argument('--delimiter', default=',', help='Разделитель колонок CSV')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить файл, ничего не записывая')
+        parser.add_argument('--with-history', action='store_true',
+                            help='Записать начальные версии в историю изменений (загрузка примерно в 1,5 раза дольше)')
+        parser.add_argument('--report', help='Куда записать отчёт об ошибках (по умолчанию <файл>.errors.csv)')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+
+        with path.open('rb') as file:
+            try:
+                result = import_members(read_rows(file, path.name, options['delimiter']),
+                                        options['chunk_size'], options['dry_run'], options['with_history'])
+            except ValueError as e:
+                raise CommandError(e)
+
+        verb = 'Можно загрузить' if options['dry_run'] else 'Загружено'
+        self.stdout.write(self.style.SUCCESS(f'{verb}: {result.created}'))
+        if result.errors:
+            report = Path(options['report'] or f'{path}.errors.csv')
+            with report.open('w', newline='', encoding='utf-8-sig') as file:
+                write_error_report(result.errors, file)
+            self.stdout.write(self.style.WARNING(f'Строк с ошибками: {len(result.errors)}, отчёт: {report}'))
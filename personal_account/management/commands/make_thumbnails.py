@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from personal_account.images import THUMBNAIL_SIZE, image_fields, make_thumbnail, thumbnail_name
+
+
+class Command(BaseCommand):
+    help = 'Создаёт превью для уже загруженных изображений всех ImageField личного кабинета'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=THUMBNAIL_SIZE)
+
+    def handle(self, *args, **options):
+        size = options['size']
+        created = existing = failed = 0
+        for model, field in image_fields():
+            names = (model._default_manager.exclude(**{field.name: ''})
+                     .exclude(**{f'{field.name}__isnull': True})
+                     .values_list(field.name, flat=True))
+            for name in names.iterator():
+                if field.storage.exists(thumbnail_name(name, size)):
+                    existing += 1
+                elif make_thumbnail(field.storage, name, size):
+                    created += 1
+                else:
+                    failed += 1
+        self.stdout.write(f'Создано превью: {created}, уже были: {existing}, ошибок: {failed}')
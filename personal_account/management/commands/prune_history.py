@@ -0,0 +1,62 @@
+import os
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from personal_account.revisions import (archive_history, collapse_history, collapsible, delete_in_batches,
+                                           historical_models)
+
+
+class Command(BaseCommand):
+    help = ('Сокращает таблицы истории Historical*: последние --keep-days дней хранятся целиком, '
+            'более старые версии схлопываются до одной в день, версии старше --archive-after-days '
+            'выгружаются в gzip JSONL и удаляются')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=365)
+        parser.add_argument('--archive-after-days', type=int, default=None,
+                            help='Без этого параметра версии не архивируются и не удаляются целиком')
+        parser.add_argument('--archive-dir', default='history_archive')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Пауза между пачками удаления, секунд')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        keep_days, archive_days = options['keep_days'], options['archive_after_days']
+        if archive_days is not None and archive_days <= keep_days:
+            raise CommandError('--archive-after-days должен быть больше --keep-days')
+        now = timezone.now()
+        keep_from = now - timedelta(days=keep_days)
+        archive_before = now - timedelta(days=archive_days) if archive_days is not None else None
+        if archive_before is not None and not options['dry_run']:
+            os.makedirs(options['archive_dir'], exist_ok=True)
+
+        for historical in historical_models():
+            table = historical._meta.db_table
+            archived = 0
+            if archive_before is not None:
+                if options['dry_run']:
+                    archived = historical.objects.filter(history_date__lt=archive_before).count()
+                else:
+                    path = os.path.join(options['archive_dir'], f'{table}_{now:%Y%m%d-%H%M%S}.jsonl.gz')
+                    written, last = archive_history(historical, archive_before, path, options['batch_size'])
+                    if written:
+                        # только записанное в архив: версии, появившиеся после выгрузки, не трогаем
+                        archived = delete_in_batches(
+                            historical.objects.filter(history_date__lt=archive_before, history_id__lte=last),
+                            options['batch_size'], options['pause'])
+                        self.stdout.write(f'{table}: архив {path}')
+                    else:
+                        os.remove(path)
+
+            if options['dry_run']:
+                collapsed = collapsible(historical, archive_before, keep_from).count()
+            else:
+                collapsed = collapse_history(historical, archive_before, keep_from,
+                                             options['batch_size'], options['pause'])
+
+            if archived or collapsed:
+                self.stdout.write(f'{table}: в архив {archived}, схлопнуто {collapsed}')
+        self.stdout.write(self.style.SUCCESS('Готово' if not options['dry_run'] else 'Проверка без изменений'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from personal_account.referrals import check_aggregates, rebuild_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Проверяет итоги по структурам консультантов и при необходимости пересчитывает их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать итоги заново по таблице замыкания и Profile_queue')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = rebuild_aggregates()
+            self.stdout.write(f'Итоги пересчитаны, строк: {count}')
+            return
+
+        mismatched = check_aggregates()
+        if mismatched:
+            self.stdout.write(self.style.WARNING(
+                f'Итоги расходятся у {len(mismatched)} пользователей. Запустите с --rebuild'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Итоги по структурам в порядке'))
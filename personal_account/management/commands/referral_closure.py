@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from personal_account.referrals import check_closure, rebuild_closure
+
+
+class Command(BaseCommand):
+    help = 'Проверяет таблицу замыкания реферальной структуры и при необходимости перестраивает её'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересоздать таблицу по Profile_partner.referred')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count, cycles = rebuild_closure()
+            self.stdout.write(f'Таблица перестроена, строк: {count}')
+        else:
+            missing, extra, cycles = check_closure()
+            if missing or extra:
+                self.stdout.write(self.style.WARNING(
+                    f'Расхождения: не хватает строк {len(missing)}, лишних {len(extra)}. '
+                    f'Запустите с --rebuild'
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS('Таблица замыкания в порядке'))
+        if cycles:
+            self.stdout.write(self.style.ERROR(
+                f'Зацикленные цепочки приглашений у пользователей: {", ".join(map(str, sorted(cycles)))}'
+            ))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from personal_account.codes import is_generated_code
+from personal_account.models import Profile_partner
+
+
+class Command(BaseCommand):
+    help = 'Показывает реферальные коды старого (случайного) формата и при необходимости заменяет их'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rewrite', action='store_true',
+                            help='Выдать новые коды. Старые ссылки с прежними кодами перестанут работать')
+
+    def handle(self, *args, **options):
+        partners = Profile_partner.objects.exclude(referral_code__isnull=True).exclude(referral_code='')
+        legacy = [partner for partner in partners.iterator() if not is_generated_code(partner.referral_code)]
+        self.stdout.write(f'Кодов старого формата: {len(legacy)}')
+        if not options['rewrite']:
+            return
+
+        for partner in legacy:
+            old_code = partner.referral_code
+            partner.referral_code = None
+            partner.referral_link = None
+            partner.save()
+            self.stdout.write(f'{partner.user_id}: {old_code} -> {partner.referral_code}')
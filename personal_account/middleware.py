@@ -0,0 +1,44 @@
+# personal_account/middleware.py
+from django.contrib.auth.models import User
+from django.utils.functional import SimpleLazyObject
+
+# Связи OneToOne, которые читают страницы личного кабинета и теги is_status
+PROFILE_BUNDLE_RELATIONS = (
+    'profile',
+    'profile_address',
+    'profile_queue',
+    'profile_partner',
+    'profile_partner__referred',
+    'profile_partner__referred__profile',
+    'profile_invitee',
+    'notification_counter',
+    'referral_aggregate',
+)
+
+
+def load_profile_bundle(user):
+    """Загружает пользователя вместе со всеми таблицами профиля одним JOIN-запросом."""
+    if not user.is_authenticated:
+        return user
+    try:
+        return User.objects.select_related(*PROFILE_BUNDLE_RELATIONS).get(pk=user.pk)
+    except User.DoesNotExist:
+        return user
+
+
+class ProfileBundleMiddleware:
+    """
+    Подменяет request.user ленивым объектом с предзагруженным профилем.
+
+    Должен стоять после AuthenticationMiddleware. Загрузка происходит только
+    при первом обращении к request.user, отсутствующие связи кешируются
+    и повторно в базу не запрашиваются.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        user = request.user
+        request.user = SimpleLazyObject(lambda: load_profile_bundle(user))
+        return self.get_response(request)
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:39
+
+import django.db.models.deletion
+import django.utils.timezone
+import personal_account.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0033_systemnotification_messagenotification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='messagenotification',
+            options={'ordering': ['-created_at'], 'verbose_name': 'Личное сообщение', 'verbose_name_plural': 'Личные сообщения'},
+        ),
+        migrations.AlterModelOptions(
+            name='systemnotification',
+            options={'ordering': ['-created_at'], 'verbose_name': 'Системное сообщение', 'verbose_name_plural': 'Системные сообщения'},
+        ),
+        migrations.AlterField(
+            model_name='messagenotification',
+            name='to_user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_notification', to=settings.AUTH_USER_MODEL, verbose_name='Сообщение для пользователя'),
+        ),
+        migrations.AlterField(
+            model_name='systemnotification',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='systemnotification',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата обновления'),
+        ),
+        migrations.CreateModel(
+            name='OutgoingEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Тема')),
+                ('body', models.TextField(verbose_name='Текст письма')),
+                ('from_email', models.CharField(max_length=254, verbose_name='Отправитель')),
+                ('to', models.JSONField(default=list, verbose_name='Получатели')),
+                ('attachment', models.FileField(blank=True, null=True, upload_to=personal_account.models.outbox_attachment_upload_path, verbose_name='Вложение')),
+                ('attachment_name', models.CharField(blank=True, default='', max_length=255, verbose_name='Имя вложения')),
+                ('attachment_mimetype', models.CharField(blank=True, default='', max_length=100, verbose_name='Тип вложения')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('sent', 'Отправлено'), ('failed', 'Ошибка отправки')], default='pending', max_length=10, verbose_name='Статус')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Попыток отправки')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Следующая попытка')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Последняя ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Отправлено')),
+            ],
+            options={
+                'verbose_name': 'Исходящее письмо',
+                'verbose_name_plural': 'Исходящие письма',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='personal_ac_status_8d9f58_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0035_notificationcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemNotificationRead',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_at', models.DateTimeField(auto_now_add=True, verbose_name='Время прочтения')),
+            ],
+            options={
+                'verbose_name': 'Прочтение системного сообщения',
+                'verbose_name_plural': 'Прочтения системных сообщений',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='messagenotification',
+            index=models.Index(fields=['to_user', '-created_at', '-id'], name='personal_ac_to_user_adf2b7_idx'),
+        ),
+        migrations.AddField(
+            model_name='systemnotificationread',
+            name='notification',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reads', to='personal_account.systemnotification', verbose_name='Системное сообщение'),
+        ),
+        migrations.AddField(
+            model_name='systemnotificationread',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='system_notification_reads', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddConstraint(
+            model_name='systemnotificationread',
+            constraint=models.UniqueConstraint(fields=('user', 'notification'), name='unique_system_notification_read'),
+        ),
+    ]
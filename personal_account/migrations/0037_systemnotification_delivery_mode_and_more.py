@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0036_systemnotificationread_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemnotification',
+            name='delivery_mode',
+            field=models.CharField(choices=[('read', 'При чтении'), ('write', 'Личными сообщениями')], default='read', max_length=5, verbose_name='Способ доставки'),
+        ),
+        migrations.CreateModel(
+            name='SystemNotificationTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('status', 'Статус'), ('additional_status', 'Дополнительный статус'), ('consultant_level', 'Уровень консультанта')], max_length=20, verbose_name='Тип получателей')),
+                ('value', models.CharField(max_length=36, verbose_name='Значение')),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='personal_account.systemnotification', verbose_name='Системное сообщение')),
+            ],
+            options={
+                'verbose_name': 'Получатели системного сообщения',
+                'verbose_name_plural': 'Получатели системного сообщения',
+                'indexes': [models.Index(fields=['kind', 'value'], name='personal_ac_kind_96c4ca_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0037_systemnotification_delivery_mode_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveSmallIntegerField(verbose_name='Уровень')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='referral_descendants', to=settings.AUTH_USER_MODEL, verbose_name='Предок')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='referral_ancestors', to=settings.AUTH_USER_MODEL, verbose_name='Потомок')),
+            ],
+            options={
+                'verbose_name': 'Связь в структуре',
+                'verbose_name_plural': 'Связи в структуре',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='personal_ac_descend_af7e28_idx')],
+                'constraints': [models.UniqueConstraint(fields=('ancestor', 'descendant'), name='unique_referral_closure')],
+            },
+        ),
+    ]
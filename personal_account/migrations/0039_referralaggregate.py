@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 09:49
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('personal_account', '0038_referralclosure'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralAggregate',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='referral_aggregate', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('subtree_size', models.PositiveIntegerField(default=0, verbose_name='Всего в структуре')),
+                ('status_counts', models.JSONField(default=dict, verbose_name='Участники по статусам')),
+                ('total_price', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Сумма стоимостей объектов')),
+                ('total_price_in_queue', models.DecimalField(decimal_places=2, default=0, max_digits=18, verbose_name='Сумма стоимостей при переходе в очередь')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Итоги по структуре',
+                'verbose_name_plural': 'Итоги по структуре',
+            },
+        ),
+    ]
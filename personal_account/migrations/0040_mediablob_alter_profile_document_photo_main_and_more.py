@@ -0,0 +1,59 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:21
+
+import personal_account.models
+import personal_account.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0039_referralaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Размер, байт')),
+                ('refcount', models.IntegerField(default=0, verbose_name='Число ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Загружен')),
+            ],
+            options={
+                'verbose_name': 'Файл документа',
+                'verbose_name_plural': 'Файлы документов',
+            },
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='document_photo_main',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.document_photo_main_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Фото главной старницы'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='document_photo_reg',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.document_photo_reg_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Фото прописки'),
+        ),
+        migrations.AlterField(
+            model_name='profile_queue',
+            name='consultant_contract_photo',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.contract_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Заявление консультанта'),
+        ),
+        migrations.AlterField(
+            model_name='profile_queue',
+            name='contract_photo',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.contract_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Договор/Соглашение'),
+        ),
+        migrations.AlterField(
+            model_name='profile_queue',
+            name='membership_fee_photo',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.membership_fee_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Последня квитанция об оплате членского взноса'),
+        ),
+        migrations.AlterField(
+            model_name='profile_queue',
+            name='share_payment_photo',
+            field=models.ImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.share_payment_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Последняя квитанция об оплате паевого взноса'),
+        ),
+    ]
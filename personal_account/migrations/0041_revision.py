@@ -0,0 +1,39 @@
+# Generated by Django 5.2.4 on 2026-10-18 10:24
+
+import django.core.serializers.json
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('personal_account', '0040_mediablob_alter_profile_document_photo_main_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.BigIntegerField(verbose_name='ID объекта')),
+                ('number', models.PositiveIntegerField(verbose_name='Номер версии')),
+                ('is_keyframe', models.BooleanField(default=False, verbose_name='Полный снимок')),
+                ('changes', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Изменённые поля')),
+                ('history_type', models.CharField(choices=[('+', 'Создание'), ('~', 'Изменение'), ('-', 'Удаление')], max_length=1, verbose_name='Тип изменения')),
+                ('history_date', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Дата')),
+                ('change_reason', models.CharField(blank=True, max_length=100, null=True, verbose_name='Причина')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype', verbose_name='Тип объекта')),
+                ('history_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Кто изменил')),
+            ],
+            options={
+                'verbose_name': 'Версия объекта',
+                'verbose_name_plural': 'Версии объектов',
+                'constraints': [models.UniqueConstraint(fields=('content_type', 'object_id', 'number'), name='unique_revision_number')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:04
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_delivered(apps, schema_editor):
+    # существующие сообщения уже доставлены (админкой) — повторно их не раскладывать
+    SystemNotification = apps.get_model('personal_account', 'SystemNotification')
+    SystemNotification.objects.update(delivered_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0042_alter_outgoingemail_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='systemnotification',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Доставлено'),
+        ),
+        migrations.RunPython(mark_existing_delivered, migrations.RunPython.noop),
+    ]
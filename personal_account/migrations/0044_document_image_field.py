@@ -0,0 +1,48 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:33
+
+import personal_account.models
+import personal_account.storage
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('personal_account', '0043_systemnotification_delivered_at'),
+    ]
+
+    # колонки те же (varchar), меняется только класс поля — без пересборки таблиц в SQLite
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+                migrations.AlterField(
+                    model_name='profile',
+                    name='document_photo_main',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.document_photo_main_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Фото главной старницы'),
+                ),
+                migrations.AlterField(
+                    model_name='profile',
+                    name='document_photo_reg',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.document_photo_reg_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Фото прописки'),
+                ),
+                migrations.AlterField(
+                    model_name='profile_queue',
+                    name='consultant_contract_photo',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.contract_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Заявление консультанта'),
+                ),
+                migrations.AlterField(
+                    model_name='profile_queue',
+                    name='contract_photo',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.contract_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Договор/Соглашение'),
+                ),
+                migrations.AlterField(
+                    model_name='profile_queue',
+                    name='membership_fee_photo',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.membership_fee_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Последня квитанция об оплате членского взноса'),
+                ),
+                migrations.AlterField(
+                    model_name='profile_queue',
+                    name='share_payment_photo',
+                    field=personal_account.storage.DocumentImageField(blank=True, default='', null=True, storage=personal_account.storage.document_storage, upload_to=personal_account.models.share_payment_photo_upload_path, validators=[personal_account.models.clean_document_photo], verbose_name='Последняя квитанция об оплате паевого взноса'),
+                ),
+        ]),
+    ]
@@ -1,16 +1,25 @@
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import RegexValidator
 from simple_history.models import HistoricalRecords
 from django.contrib.auth.models import User
 from uuid import uuid4
-import random
-import string
 import os
 import re
+from collections import Counter, namedtuple
+from decimal import Decimal, InvalidOperation
 from django.utils import timezone
+from django.db import IntegrityError, transaction
+from . import events
+from .codes import MAX_TWEAKS as MAX_REFERRAL_CODE_TWEAKS, make_referral_code
+from .images import MAX_PHOTO_SIZE, make_thumbnails_for, process_uploaded_images, thumbnail_name
+from .storage import BLOB_DIR, DocumentImageField, blob_fields, blob_names, document_storage, is_blob
+from .tracking import DirtyFieldsMixin
 
 
 
@@ -101,9 +110,14 @@ def membership_fee_photo_upload_path(instance, filename):
     return get_profile_upload_path(instance, filename, "membership_fee_photo")
 
 
+def outbox_attachment_upload_path(instance, filename):
+    return os.path.join("outbox", f"{uuid4().hex}_{filename}")
+
+
 def clean_document_photo(value):
+    # новые загрузки к этому моменту уже перекодированы (clean_fields), проверяется итоговый файл
     filesize = value.size
-    if filesize > 5 * 1024 * 1024:  # 5MB
+    if filesize > MAX_PHOTO_SIZE:
         raise ValidationError("Максимальный размер фото 5MB")
 
 
@@ -112,7 +126,7 @@ def validate_consultant_level(value):
         raise ValidationError('Уровень консультанта должен быть от 1 до 10')
 
 
-class Profile(models.Model):
+class Profile(DirtyFieldsMixin, models.Model):
 
     DOCUMENT_CHOICES = [
         ('', '--- Выберите документ ---'),
@@ -187,8 +201,9 @@ class Profile(models.Model):
                                      null=True,
                                      default=None)
 
-    document_photo_main = models.ImageField(
+    document_photo_main = DocumentImageField(
                                     upload_to=document_photo_main_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Фото главной старницы",
                                     null=True,
                                     blank=True,
@@ -196,8 +211,9 @@ class Profile(models.Model):
                                     validators=[clean_document_photo]
                                     )
 
-    document_photo_reg = models.ImageField(
+    document_photo_reg = DocumentImageField(
                                     upload_to=document_photo_reg_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Фото прописки",
                                     null=True,
                                     blank=True,
@@ -213,6 +229,11 @@ class Profile(models.Model):
 
     history = HistoricalRecords()
 
+    def clean_fields(self, exclude=None):
+        # фото проверяется по размеру после перекодирования
+        process_uploaded_images(self)
+        super().clean_fields(exclude)
+
     def clean(self):
         super().clean()
 
@@ -224,9 +245,17 @@ class Profile(models.Model):
         #     if int(self.price_in_queue) > int(self.price):
         #         raise ValidationError('Стоимость в очереди не может быть больше исходной стоимости')
 
+    def validate_changes(self, dirty):
+        # загруженный из базы объект проверяется только по изменённым полям
+        self.full_clean(exclude=self.clean_exclude(dirty))
+
     def save(self, *args, **kwargs):
-        self.full_clean()
-        super().save(*args, **kwargs)
+        uploaded = process_uploaded_images(self)
+        old_blobs = MediaBlob.loaded_names(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            MediaBlob.update_references(old_blobs, blob_names(self))
+        make_thumbnails_for(self, uploaded)
 
     def __str__(self):
         return f"{self.user.email} - {self.phone}"
@@ -236,7 +265,7 @@ class Profile(models.Model):
         verbose_name_plural = "Личные данные"
 
 
-class Profile_address(models.Model):
+class Profile_address(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User,
                                 on_delete=models.CASCADE,
                                 primary_key=True,
@@ -361,7 +390,7 @@ class Profile_address(models.Model):
         verbose_name_plural = "Регистрационные данные"
 
 
-class Profile_partner(models.Model):
+class Profile_partner(DirtyFieldsMixin, models.Model):
 
     CONSULTANT_LEVEL_CHOICES = [
         (1, 'Уровень 1'),
@@ -411,20 +440,49 @@ class Profile_partner(models.Model):
                                            validators=[validate_consultant_level]
                                            )
 
-    def save(self, *args, **kwargs):
-        if not self.referral_code:
-            self.referral_code = self.generate_referral_code()
-        if not self.referral_link:
-            self.referral_link = f"/register?ref={self.referral_code}"
-        super().save(*args, **kwargs)
-
-    def generate_referral_code(self):
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
-
-        while Profile_partner.objects.filter(referral_code=code):
-            code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=10))
+    def clean(self):
+        super().clean()
+        if self.referred_id and self.user_id and (
+            self.referred_id == self.user_id
+            or ReferralClosure.objects.filter(ancestor_id=self.user_id, descendant_id=self.referred_id).exists()
+        ):
+            raise ValidationError({'referred': 'Нельзя указать пригласившим самого себя или своего партнёра'})
 
-        return code
+    def save(self, *args, **kwargs):
+        moved = self._state.adding or self.referred_id != self.loaded_value('referred_id')
+        with transaction.atomic():
+            self._save_with_referral_code(*args, **kwargs)
+            if moved:
+                old_ancestors = ReferralClosure.ancestor_ids(self.user_id)
+                ReferralClosure.move(self.user_id, self.referred_id)
+                ReferralAggregate.move_subtree(self.user_id, old_ancestors,
+                                               ReferralClosure.ancestor_ids(self.user_id))
+
+    def _save_with_referral_code(self, *args, **kwargs):
+        if self.referral_code:
+            if not self.referral_link:
+                self.referral_link = f"/register?ref={self.referral_code}"
+            super().save(*args, **kwargs)
+            return
+
+        # без предварительной проверки: при совпадении со старым кодом
+        # срабатывает уникальный индекс и берётся следующий вариант кода
+        generate_link = not self.referral_link
+        for tweak in range(MAX_REFERRAL_CODE_TWEAKS):
+            self.referral_code = self.generate_referral_code(tweak)
+            if generate_link:
+                self.referral_link = f"/register?ref={self.referral_code}"
+            try:
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                if not Profile_partner.objects.filter(referral_code=self.referral_code).exclude(pk=self.pk).exists():
+                    raise
+        raise IntegrityError("Не удалось подобрать свободный реферальный код")
+
+    def generate_referral_code(self, tweak=0):
+        return make_referral_code(self.user_id, tweak)
 
     history = HistoricalRecords()
 
@@ -436,7 +494,172 @@ class Profile_partner(models.Model):
         verbose_name_plural = "Информация о структура"
 
 
-class Profile_invitee(models.Model):
+class ReferralClosure(models.Model):
+    """
+    Таблица замыкания структуры Profile_partner.referred.
+
+    Для каждой пары «предок — потомок» хранится строка с расстоянием
+    между ними, включая строку самого пользователя с depth=0. Все
+    потомки, предки до уровня N и размер структуры читаются одним
+    запросом по индексу. Таблицу ведёт Profile_partner.save, сверить
+    и перестроить её можно командой referral_closure.
+    """
+    ancestor = models.ForeignKey(User,
+                                 on_delete=models.CASCADE,
+                                 related_name='referral_descendants',
+                                 verbose_name='Предок'
+                                 )
+    descendant = models.ForeignKey(User,
+                                   on_delete=models.CASCADE,
+                                   related_name='referral_ancestors',
+                                   verbose_name='Потомок'
+                                   )
+    depth = models.PositiveSmallIntegerField(verbose_name='Уровень')
+
+    class Meta:
+        verbose_name = 'Связь в структуре'
+        verbose_name_plural = 'Связи в структуре'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'descendant'], name='unique_referral_closure'),
+        ]
+        indexes = [
+            models.Index(fields=['descendant', 'depth']),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor} -> {self.descendant} ({self.depth})"
+
+    @classmethod
+    def ancestor_ids(cls, user_id):
+        return list(cls.objects.filter(descendant_id=user_id, depth__gt=0).values_list('ancestor_id', flat=True))
+
+    @classmethod
+    def detach(cls, user_id):
+        """Отрывает поддерево пользователя от всех его предков."""
+        subtree = cls.objects.filter(ancestor_id=user_id).values('descendant_id')
+        cls.objects.filter(descendant_id__in=subtree).exclude(ancestor_id__in=subtree).delete()
+
+    @classmethod
+    def move(cls, user_id, parent_id):
+        """Переносит поддерево user_id под parent_id (None — в корень)."""
+        cls.objects.get_or_create(ancestor_id=user_id, descendant_id=user_id, defaults={'depth': 0})
+        subtree = list(cls.objects.filter(ancestor_id=user_id).values_list('descendant_id', 'depth'))
+        if parent_id is not None and any(descendant_id == parent_id for descendant_id, _ in subtree):
+            raise ValueError("Пользователь не может быть приглашён участником своей структуры")
+
+        cls.detach(user_id)
+        if parent_id is None:
+            return
+        cls.objects.get_or_create(ancestor_id=parent_id, descendant_id=parent_id, defaults={'depth': 0})
+        ancestors = cls.objects.filter(descendant_id=parent_id).values_list('ancestor_id', 'depth')
+        cls.objects.bulk_create(
+            [cls(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+             for ancestor_id, up in ancestors
+             for descendant_id, down in subtree],
+            batch_size=1000
+        )
+
+    @classmethod
+    def detach_descendants(cls, user_id):
+        """Отрывает от предков пользователя всех его потомков (перед удалением пользователя)."""
+        cls.objects.filter(
+            ancestor_id__in=cls.objects.filter(descendant_id=user_id).values('ancestor_id'),
+            descendant_id__in=cls.objects.filter(ancestor_id=user_id, depth__gt=0).values('descendant_id'),
+        ).delete()
+
+
+def parse_price(value):
+    try:
+        return Decimal(value or 0)
+    except InvalidOperation:
+        return Decimal(0)
+
+
+# Вклад участника (или целого поддерева) в итоги его предков
+Rollup = namedtuple('Rollup', ['size', 'statuses', 'price', 'price_in_queue'])
+
+
+def queue_rollup(status, price, price_in_queue):
+    return Rollup(0, Counter({status: 1}) if status else Counter(), parse_price(price), parse_price(price_in_queue))
+
+
+class ReferralAggregate(models.Model):
+    """
+    Итоги по всей структуре консультанта: размер, число участников
+    по статусам и сумма стоимостей объектов.
+
+    Строка обновляется приращениями при сохранении Profile_queue и при
+    переносе в структуре Profile_partner, поэтому реферальная страница
+    читает готовые числа. Пересчитать всё заново можно командой
+    referral_aggregates --rebuild.
+    """
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='referral_aggregate'
+                                )
+    subtree_size = models.PositiveIntegerField(default=0, verbose_name='Всего в структуре')
+    status_counts = models.JSONField(default=dict, verbose_name='Участники по статусам')
+    total_price = models.DecimalField(max_digits=18,
+                                      decimal_places=2,
+                                      default=0,
+                                      verbose_name='Сумма стоимостей объектов'
+                                      )
+    total_price_in_queue = models.DecimalField(max_digits=18,
+                                               decimal_places=2,
+                                               default=0,
+                                               verbose_name='Сумма стоимостей при переходе в очередь'
+                                               )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Обновлено')
+
+    class Meta:
+        verbose_name = 'Итоги по структуре'
+        verbose_name_plural = 'Итоги по структуре'
+
+    def __str__(self):
+        return f"{self.user} - {self.subtree_size}"
+
+    @classmethod
+    def subtree_rollup(cls, user_id):
+        """Вклад пользователя вместе со всей его структурой."""
+        queue = Profile_queue.objects.filter(user_id=user_id).values_list('status', 'price', 'price_in_queue').first()
+        own = queue_rollup(*queue) if queue else Rollup(0, Counter(), Decimal(0), Decimal(0))
+        row = cls.objects.filter(user_id=user_id).first()
+        if row is None:
+            return own._replace(size=1)
+        return Rollup(1 + row.subtree_size,
+                      own.statuses + Counter(row.status_counts),
+                      own.price + row.total_price,
+                      own.price_in_queue + row.total_price_in_queue)
+
+    @classmethod
+    def apply(cls, user_ids, rollup, sign=1):
+        """Прибавляет (sign=-1 — вычитает) вклад к итогам пользователей user_ids."""
+        if not user_ids or not (rollup.size or any(rollup.statuses.values()) or rollup.price or rollup.price_in_queue):
+            return
+        cls.objects.bulk_create([cls(user_id=pk) for pk in user_ids], ignore_conflicts=True)
+        with transaction.atomic():
+            for row in cls.objects.select_for_update().filter(user_id__in=user_ids):
+                row.subtree_size += sign * rollup.size
+                counts = Counter(row.status_counts)
+                for status, count in rollup.statuses.items():
+                    counts[status] += sign * count
+                row.status_counts = {status: count for status, count in counts.items() if count > 0}
+                row.total_price += sign * rollup.price
+                row.total_price_in_queue += sign * rollup.price_in_queue
+                row.save()
+
+    @classmethod
+    def move_subtree(cls, user_id, old_ancestors, new_ancestors):
+        old_ancestors, new_ancestors = set(old_ancestors), set(new_ancestors)
+        if old_ancestors == new_ancestors:
+            return
+        rollup = cls.subtree_rollup(user_id)
+        cls.apply(old_ancestors - new_ancestors, rollup, sign=-1)
+        cls.apply(new_ancestors - old_ancestors, rollup)
+
+
+class Profile_invitee(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User,
                                 on_delete=models.CASCADE,
                                 primary_key=True,
@@ -467,7 +690,7 @@ class Profile_invitee(models.Model):
         verbose_name_plural = "Информация о пригласившем"
 
 
-class Profile_queue(models.Model):
+class Profile_queue(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(User,
                                 on_delete=models.CASCADE,
                                 primary_key=True,
@@ -516,8 +739,9 @@ class Profile_queue(models.Model):
                               default='Обработка'
                               )
 
-    consultant_contract_photo = models.ImageField(
+    consultant_contract_photo = DocumentImageField(
                                     upload_to=contract_photo_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Заявление консультанта",
                                     null=True,
                                     blank=True,
@@ -558,8 +782,9 @@ class Profile_queue(models.Model):
                                validators=[RegexValidator(r'^[0-9A-Za-z-]+$', 'Номер счёта может содержать только цифры, латинские буквы и дефис')]
                                )
 
-    contract_photo = models.ImageField(
+    contract_photo = DocumentImageField(
                                     upload_to=contract_photo_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Договор/Соглашение",
                                     null=True,
                                     blank=True,
@@ -567,8 +792,9 @@ class Profile_queue(models.Model):
                                     validators=[clean_document_photo]
                                     )
 
-    share_payment_photo = models.ImageField(
+    share_payment_photo = DocumentImageField(
                                     upload_to=share_payment_photo_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Последняя квитанция об оплате паевого взноса",
                                     null=True,
                                     blank=True,
@@ -576,8 +802,9 @@ class Profile_queue(models.Model):
                                     validators=[clean_document_photo]
                                     )
 
-    membership_fee_photo = models.ImageField(
+    membership_fee_photo = DocumentImageField(
                                     upload_to=membership_fee_photo_upload_path,
+                                    storage=document_storage,
                                     verbose_name="Последня квитанция об оплате членского взноса",
                                     null=True,
                                     blank=True,
@@ -587,6 +814,33 @@ class Profile_queue(models.Model):
 
     history = HistoricalRecords()
 
+    def clean_fields(self, exclude=None):
+        # фото проверяется по размеру после перекодирования
+        process_uploaded_images(self)
+        super().clean_fields(exclude)
+
+    def save(self, *args, **kwargs):
+        rollup_fields = ('status', 'price', 'price_in_queue')
+        if self._state.adding:
+            old = Rollup(0, Counter(), Decimal(0), Decimal(0))
+        elif all(name in getattr(self, '_loaded_values', {}) for name in rollup_fields):
+            old = queue_rollup(*(self.loaded_value(name) for name in rollup_fields))
+        else:
+            values = Profile_queue.objects.filter(pk=self.pk).values_list(*rollup_fields).first()
+            old = queue_rollup(*values) if values else Rollup(0, Counter(), Decimal(0), Decimal(0))
+        new = queue_rollup(self.status, self.price, self.price_in_queue)
+        uploaded = process_uploaded_images(self)
+        old_blobs = MediaBlob.loaded_names(self)
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            MediaBlob.update_references(old_blobs, blob_names(self))
+            if new != old:
+                statuses = Counter(new.statuses)
+                statuses.subtract(old.statuses)
+                delta = Rollup(0, statuses, new.price - old.price, new.price_in_queue - old.price_in_queue)
+                ReferralAggregate.apply(ReferralClosure.ancestor_ids(self.user_id), delta)
+        make_thumbnails_for(self, uploaded)
+
     def __str__(self):
         return f" {self.user.email}"
 
@@ -632,6 +886,21 @@ class SystemNotification(models.Model):
         verbose_name='Приоритет'
     )
 
+    DELIVERY_ON_READ = 'read'
+    DELIVERY_ON_WRITE = 'write'
+    DELIVERY_CHOICES = [
+        (DELIVERY_ON_READ, 'При чтении'),
+        (DELIVERY_ON_WRITE, 'Личными сообщениями'),
+    ]
+
+    delivery_mode = models.CharField(
+        max_length=5,
+        choices=DELIVERY_CHOICES,
+        default=DELIVERY_ON_READ,
+        verbose_name='Способ доставки'
+    )
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name='Доставлено')
+
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата обновления')
 
@@ -644,6 +913,37 @@ class SystemNotification(models.Model):
         return f"{self.title} - {self.get_status_display()}"
 
 
+class MessageNotificationQuerySet(models.QuerySet):
+    """
+    bulk_create, update и delete набора строк не вызывают сигналы отдельных
+    сообщений — счётчики NotificationCounter поправляются здесь.
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        NotificationCounter.add_unread_messages(Counter(obj.to_user_id for obj in objs if not obj.is_read))
+        return objs
+
+    def update(self, **kwargs):
+        if not kwargs.keys() & {'is_read', 'to_user', 'to_user_id'}:
+            return super().update(**kwargs)
+        user_ids = set(self.values_list('to_user_id', flat=True))
+        updated = super().update(**kwargs)
+        new_user = kwargs.get('to_user_id', getattr(kwargs.get('to_user'), 'pk', kwargs.get('to_user')))
+        if new_user is not None:
+            user_ids.add(new_user)
+        NotificationCounter.recount_messages(user_ids)
+        return updated
+
+    def delete(self):
+        user_ids = set(self.values_list('to_user_id', flat=True))
+        result = super().delete()
+        NotificationCounter.recount_messages(user_ids)
+        return result
+
+    delete.alters_data = True
+
+
 class MessageNotification(models.Model):
     to_user = models.ForeignKey(
         User,
@@ -657,6 +957,8 @@ class MessageNotification(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
     is_read = models.BooleanField(default=False, verbose_name='Прочитано')
 
+    objects = MessageNotificationQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Личное сообщение'
@@ -664,6 +966,8 @@ class MessageNotification(models.Model):
         indexes = [
             models.Index(fields=['to_user', 'is_read', 'created_at']),
             models.Index(fields=['created_at']),
+            # постраничный просмотр всех сообщений пользователя по (created_at, id)
+            models.Index(fields=['to_user', '-created_at', '-id']),
         ]
 
     def __str__(self):
@@ -675,7 +979,393 @@ class MessageNotification(models.Model):
             self.read_at = timezone.now()
             self.save()
 
+
+class SystemNotificationTarget(models.Model):
+
+    KIND_STATUS = 'status'
+    KIND_ADDITIONAL_STATUS = 'additional_status'
+    KIND_CONSULTANT_LEVEL = 'consultant_level'
+    KIND_CHOICES = [
+        (KIND_STATUS, 'Статус'),
+        (KIND_ADDITIONAL_STATUS, 'Дополнительный статус'),
+        (KIND_CONSULTANT_LEVEL, 'Уровень консультанта'),
+    ]
+
+    notification = models.ForeignKey(SystemNotification,
+                                     on_delete=models.CASCADE,
+                                     related_name='targets',
+                                     verbose_name='Системное сообщение'
+                                     )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='Тип получателей')
+    value = models.CharField(max_length=36, verbose_name='Значение')
+
+    class Meta:
+        verbose_name = 'Получатели системного сообщения'
+        verbose_name_plural = 'Получатели системного сообщения'
+        indexes = [
+            models.Index(fields=['kind', 'value']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()}: {self.value}"
+
+    def clean(self):
+        super().clean()
+        valid = {
+            self.KIND_STATUS: [value for value, _ in Profile_queue.STATUS_CHOICES],
+            self.KIND_ADDITIONAL_STATUS: [value for value, _ in Profile_queue.ADDITIONAL_STATUS_CHOICES if value],
+            self.KIND_CONSULTANT_LEVEL: [str(value) for value, _ in Profile_partner.CONSULTANT_LEVEL_CHOICES],
+        }
+        if self.kind in valid and self.value not in valid[self.kind]:
+            raise ValidationError({'value': f"Допустимые значения: {', '.join(valid[self.kind])}"})
+
+
+class SystemNotificationRead(models.Model):
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='system_notification_reads',
+                             verbose_name='Пользователь'
+                             )
+    notification = models.ForeignKey(SystemNotification,
+                                     on_delete=models.CASCADE,
+                                     related_name='reads',
+                                     verbose_name='Системное сообщение'
+                                     )
+    read_at = models.DateTimeField(auto_now_add=True, verbose_name='Время прочтения')
+
+    class Meta:
+        verbose_name = 'Прочтение системного сообщения'
+        verbose_name_plural = 'Прочтения системных сообщений'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'notification'], name='unique_system_notification_read'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.notification}"
+
+
+class NotificationCounter(models.Model):
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='notification_counter'
+                                )
+    unread_messages = models.PositiveIntegerField(default=0, verbose_name='Непрочитанные личные сообщения')
+    unseen_system = models.PositiveIntegerField(default=0, verbose_name='Непросмотренные системные сообщения')
+
+    class Meta:
+        verbose_name = 'Счётчик уведомлений'
+        verbose_name_plural = 'Счётчики уведомлений'
+
+    def __str__(self):
+        return f"{self.user} - {self.total}"
+
+    @property
+    def total(self):
+        return self.unread_messages + self.unseen_system
+
+    @classmethod
+    def recount_messages(cls, user_ids, chunk_size=500):
+        """Пересчёт по индексу (to_user, is_read, created_at): один UPDATE с подзапросом на порцию."""
+        user_ids = sorted(set(user_ids))
+        unread = (MessageNotification.objects.filter(to_user=OuterRef('user_id'), is_read=False)
+                  .order_by().values('to_user').annotate(count=Count('pk')).values('count'))
+        for start in range(0, len(user_ids), chunk_size):
+            chunk = user_ids[start:start + chunk_size]
+            cls._ensure_rows(User.objects.filter(pk__in=chunk))
+            cls.objects.filter(user_id__in=chunk).update(unread_messages=Coalesce(Subquery(unread), 0))
+
+    @classmethod
+    def _ensure_rows(cls, users):
+        missing = users.filter(notification_counter__isnull=True).values_list('pk', flat=True)
+        cls.objects.bulk_create([cls(user_id=pk) for pk in missing.iterator()],
+                                batch_size=500,
+                                ignore_conflicts=True
+                                )
+
+    @classmethod
+    def add_unseen_system(cls, users):
+        cls._ensure_rows(users)
+        cls.objects.filter(user__in=users).update(unseen_system=F('unseen_system') + 1)
+
+    @classmethod
+    def add_unread_messages(cls, counts, chunk_size=500):
+        """counts: {user_id: число новых непрочитанных}; один UPDATE на порцию с одинаковым числом."""
+        by_count = {}
+        for user_id, count in counts.items():
+            by_count.setdefault(count, []).append(user_id)
+        for count, user_ids in by_count.items():
+            for start in range(0, len(user_ids), chunk_size):
+                chunk = user_ids[start:start + chunk_size]
+                cls._ensure_rows(User.objects.filter(pk__in=chunk))
+                cls.objects.filter(user_id__in=chunk).update(unread_messages=F('unread_messages') + count)
+
+    @classmethod
+    def mark_system_seen(cls, user, count):
+        if count:
+            cls.objects.filter(user=user).update(unseen_system=Greatest(F('unseen_system') - count, 0))
+
+
+class OutgoingEmail(models.Model):
+
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_SENDING, 'Отправляется'),
+        (STATUS_SENT, 'Отправлено'),
+        (STATUS_FAILED, 'Ошибка отправки'),
+    ]
+
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    body = models.TextField(verbose_name='Текст письма')
+    from_email = models.CharField(max_length=254, verbose_name='Отправитель')
+    to = models.JSONField(default=list, verbose_name='Получатели')
+
+    attachment = models.FileField(upload_to=outbox_attachment_upload_path,
+                                  null=True,
+                                  blank=True,
+                                  verbose_name='Вложение'
+                                  )
+    attachment_name = models.CharField(max_length=255, blank=True, default='', verbose_name='Имя вложения')
+    attachment_mimetype = models.CharField(max_length=100, blank=True, default='', verbose_name='Тип вложения')
+
+    status = models.CharField(max_length=10,
+                              choices=STATUS_CHOICES,
+                              default=STATUS_PENDING,
+                              verbose_name='Статус'
+                              )
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Попыток отправки')
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+    last_error = models.TextField(blank=True, default='', verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name='Отправлено')
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)}"
+
+
+class MediaBlob(models.Model):
+    """
+    Файл в хранилище по содержимому и число ссылок на него из полей
+    Profile и Profile_queue. Блоб без ссылок удаляет collect_garbage.
+    """
+
+    name = models.CharField(max_length=255, unique=True, verbose_name='Файл')
+    size = models.PositiveBigIntegerField(default=0, verbose_name='Размер, байт')
+    refcount = models.IntegerField(default=0, verbose_name='Число ссылок')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Загружен')
+
+    class Meta:
+        verbose_name = 'Файл документа'
+        verbose_name_plural = 'Файлы документов'
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+    @staticmethod
+    def referencing_models():
+        return [model for model in (Profile, Profile_queue) if blob_fields(model)]
+
+    @classmethod
+    def register(cls, name, size):
+        cls.objects.get_or_create(name=name, defaults={'size': size})
+
+    @classmethod
+    def update_references(cls, old_names, new_names):
+        delta = Counter(new_names)
+        delta.subtract(old_names)
+        for name, count in delta.items():
+            if count:
+                cls.objects.filter(name=name).update(refcount=F('refcount') + count)
+
+    @classmethod
+    def loaded_names(cls, instance):
+        """Блобы, на которые объект ссылался до сохранения: из загруженных значений или из базы."""
+        if instance._state.adding:
+            return []
+        loaded = getattr(instance, '_loaded_values', None)
+        if loaded is not None:
+            return blob_names(instance, loaded)
+        stored = type(instance).objects.filter(pk=instance.pk).only(
+            *[field.attname for field in blob_fields(type(instance))]).first()
+        return blob_names(stored) if stored else []
+
+    @classmethod
+    def references(cls, history=False):
+        """Счётчик ссылок на блобы из живых строк (и из истории изменений, если history)."""
+        counts = Counter()
+        for model in cls.referencing_models():
+            models_to_scan = [model, model.history.model] if history else [model]
+            for scanned in models_to_scan:
+                for field in blob_fields(model):
+                    names = (scanned._default_manager.filter(**{f'{field.attname}__startswith': BLOB_DIR + '/'})
+                             .values_list(field.attname, flat=True))
+                    counts.update(names.iterator())
+            if history:
+                # при HISTORY_BACKEND = 'revisions' пути старых версий есть только в Revision.changes
+                attnames = [field.attname for field in blob_fields(model)]
+                counts.update(name for name in Revision.file_names(model, attnames) if is_blob(name))
+        return counts
+
+    @classmethod
+    def recount(cls):
+        """Пересчитывает refcount с нуля, возвращает число исправленных строк."""
+        counts = cls.references()
+        fixed = 0
+        for blob in cls.objects.only('name', 'refcount').iterator():
+            if blob.refcount != counts.get(blob.name, 0):
+                cls.objects.filter(pk=blob.pk).update(refcount=counts.get(blob.name, 0))
+                fixed += 1
+        return fixed
+
+    @classmethod
+    def collect_garbage(cls, older_than, dry_run=False):
+        """
+        Удаляет блобы без ссылок, загруженные раньше older_than: свежий блоб
+        мог быть записан загрузкой, чья транзакция ещё не закончилась.
+        Файлы, на которые ссылается история изменений, не удаляются.
+        Возвращает (число файлов, байт).
+        """
+        candidates = cls.objects.filter(refcount__lte=0, created_at__lt=older_than)
+        in_history = cls.references(history=True)
+        storage = document_storage()
+        removed = freed = 0
+        for blob in candidates.iterator():
+            if in_history.get(blob.name):
+                continue
+            removed += 1
+            freed += blob.size
+            if not dry_run:
+                storage.delete(thumbnail_name(blob.name))
+                storage.delete(blob.name)
+                blob.delete()
+        return removed, freed
+
+
+class Revision(models.Model):
+    """
+    Версия объекта при HISTORY_BACKEND = 'revisions': только изменённые поля,
+    а каждая KEYFRAME_INTERVAL-я версия и создание объекта — полный снимок.
+    Снимок на любой момент собирается в revisions.snapshot.
+    """
+
+    HISTORY_TYPE_CHOICES = [
+        ('+', 'Создание'),
+        ('~', 'Изменение'),
+        ('-', 'Удаление'),
+    ]
+
+    content_type = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, verbose_name='Тип объекта')
+    object_id = models.BigIntegerField(verbose_name='ID объекта')
+    number = models.PositiveIntegerField(verbose_name='Номер версии')
+    is_keyframe = models.BooleanField(default=False, verbose_name='Полный снимок')
+    changes = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name='Изменённые поля')
+    history_type = models.CharField(max_length=1, choices=HISTORY_TYPE_CHOICES, verbose_name='Тип изменения')
+    history_date = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='Дата')
+    history_user = models.ForeignKey(User,
+                                     on_delete=models.SET_NULL,
+                                     null=True,
+                                     blank=True,
+                                     related_name='+',
+                                     verbose_name='Кто изменил'
+                                     )
+    change_reason = models.CharField(max_length=100, null=True, blank=True, verbose_name='Причина')
+
+    class Meta:
+        verbose_name = 'Версия объекта'
+        verbose_name_plural = 'Версии объектов'
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'number'], name='unique_revision_number'),
+        ]
+
+    def __str__(self):
+        return f"{self.content_type.model} #{self.object_id} v{self.number}"
+
+    @classmethod
+    def file_names(cls, model, attnames, chunk_size=2000):
+        """Пути файлов, записанные в changes версий объектов model по полям attnames."""
+        if not attnames:
+            return
+        revisions = cls.objects.filter(content_type__app_label=model._meta.app_label,
+                                       content_type__model=model._meta.model_name,
+                                       changes__has_any_keys=attnames)
+        for changes in revisions.values_list('changes', flat=True).iterator(chunk_size=chunk_size):
+            for attname in attnames:
+                name = changes.get(attname)
+                if name:
+                    yield name
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.get_or_create(user=instance)
+
+
+@receiver(pre_delete, sender=User)
+def detach_referrals(sender, instance, **kwargs):
+    # referred у приглашённых обнулится (SET_NULL), их структуры становятся корнями
+    ReferralAggregate.apply(ReferralClosure.ancestor_ids(instance.pk),
+                            ReferralAggregate.subtree_rollup(instance.pk), sign=-1)
+    ReferralClosure.detach_descendants(instance.pk)
+    ReferralClosure.detach(instance.pk)
+
+
+@receiver(post_delete, sender=Profile_partner)
+def remove_from_closure(sender, instance, **kwargs):
+    ReferralAggregate.move_subtree(instance.user_id, ReferralClosure.ancestor_ids(instance.user_id), [])
+    ReferralClosure.detach(instance.user_id)
+    if not Profile_partner.objects.filter(referred_id=instance.user_id).exists():
+        ReferralClosure.objects.filter(ancestor_id=instance.user_id).delete()
+
+
+@receiver(post_delete, sender=Profile_queue)
+def remove_from_aggregates(sender, instance, **kwargs):
+    rollup = queue_rollup(instance.status, instance.price, instance.price_in_queue)
+    ReferralAggregate.apply(ReferralClosure.ancestor_ids(instance.user_id), rollup, sign=-1)
+
+
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=Profile_queue)
+def release_blobs(sender, instance, **kwargs):
+    MediaBlob.update_references(blob_names(instance), [])
+
+
+@receiver(post_save, sender=MessageNotification)
+@receiver(post_delete, sender=MessageNotification)
+def update_message_counter(sender, instance, created=False, origin=None, **kwargs):
+    if created:
+        if not instance.is_read:
+            NotificationCounter.add_unread_messages({instance.to_user_id: 1})
+    elif origin is None or origin is instance:
+        # удаление набором строк пересчитывает счётчики один раз (MessageNotificationQuerySet.delete),
+        # при удалении пользователя его счётчик удаляется вместе с ним
+        NotificationCounter.recount_messages([instance.to_user_id])
+
+
+@receiver(post_save, sender=SystemNotification)
+def deliver_created_notification(sender, instance, created, raw=False, **kwargs):
+    # получатели (инлайн админки, targets.create) пишутся в той же транзакции — доставка после COMMIT;
+    # если deliver() уже вызвали явно, deliver_pending ничего не сделает
+    if created and not raw:
+        from .delivery import deliver_pending
+
+        transaction.on_commit(lambda: deliver_pending(instance.pk))
+
+
+@receiver(post_save, sender=MessageNotification)
+def publish_message(sender, instance, created, **kwargs):
+    if created:
+        event = {'type': 'message', 'id': instance.pk, 'title': instance.title}
+        transaction.on_commit(lambda: events.publish(events.user_channel(instance.to_user_id), event))
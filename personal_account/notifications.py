@@ -0,0 +1,93 @@
+# personal_account/notifications.py
+import base64
+from datetime import datetime
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .delivery import notifications_for_user
+from .models import MessageNotification, NotificationCounter, SystemNotificationRead
+
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(obj):
+    raw = f"{obj.created_at.isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Возвращает (created_at, id) или бросает ValueError для испорченного курсора."""
+    created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pk)
+
+
+def keyset_page(queryset, cursor=None, limit=PAGE_SIZE):
+    """
+    Страница по ключу (created_at, id) в порядке убывания.
+
+    В отличие от OFFSET стоимость не зависит от номера страницы: база
+    начинает чтение индекса сразу с позиции курсора.
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    items = list(queryset[:limit + 1])
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def personal_messages_for(user):
+    return MessageNotification.objects.filter(to_user=user)
+
+
+def system_notifications_for(user):
+    receipts = SystemNotificationRead.objects.filter(user=user, notification=OuterRef('pk'))
+    return notifications_for_user(user).annotate(is_read=Exists(receipts))
+
+
+def mark_messages_read(user, messages):
+    ids = [message.pk for message in messages if not message.is_read]
+    if ids:
+        # update пересчитывает счётчик пользователя (MessageNotificationQuerySet)
+        MessageNotification.objects.filter(pk__in=ids, to_user=user).update(is_read=True, read_at=timezone.now())
+
+
+def mark_system_read(user, notifications):
+    """Число отметок, созданных этим вызовом: уже прочитанные и дубли не считаются."""
+    ids = [notification.pk for notification in notifications if not notification.is_read]
+    if not ids:
+        return 0
+    receipts = SystemNotificationRead.objects.filter(user=user, notification_id__in=ids)
+    before = receipts.count()
+    SystemNotificationRead.objects.bulk_create(
+        [SystemNotificationRead(user=user, notification_id=pk) for pk in ids],
+        ignore_conflicts=True
+    )
+    created = receipts.count() - before
+    NotificationCounter.mark_system_seen(user, created)
+    return created
+
+
+def serialize_message(message):
+    return {
+        'id': message.pk,
+        'title': message.title,
+        'message': message.message,
+        'created_at': message.created_at.isoformat(),
+        'is_read': message.is_read,
+        'read_at': message.read_at.isoformat() if message.read_at else None,
+    }
+
+
+def serialize_system_notification(notification):
+    return {
+        'id': notification.pk,
+        'title': notification.title,
+        'message': notification.message,
+        'priority': notification.priority,
+        'created_at': notification.created_at.isoformat(),
+        'is_read': notification.is_read,
+    }
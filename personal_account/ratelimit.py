@@ -0,0 +1,116 @@
+# personal_account/ratelimit.py
+import threading
+import time
+from collections import namedtuple
+
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'remaining', 'reset_in'])
+
+# KEYS: текущее и предыдущее окно; ARGV: вес предыдущего, лимит, срок жизни счётчика
+SLIDING_WINDOW_LUA = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if current + previous * tonumber(ARGV[1]) + 1 > tonumber(ARGV[2]) then
+    return {0, current, previous}
+end
+current = redis.call('INCR', KEYS[1])
+if current == 1 then
+    redis.call('EXPIRE', KEYS[1], ARGV[3])
+end
+return {1, current, previous}
+"""
+
+_local_lock = threading.Lock()
+
+
+class RateLimit:
+    """
+    Ограничение частоты по скользящему окну (sliding window counter).
+
+    Каждое окно длиной period секунд имеет свой счётчик в кеше. Оценка числа
+    запросов за последние period секунд = текущий счётчик + предыдущий,
+    взвешенный долей окна, которая ещё попадает в интервал. Проверка и
+    увеличение счётчика — одна атомарная операция: скрипт Lua в Redis,
+    одна транзакция в SQLiteCache, блокировка процесса для остальных
+    (локальных) бэкендов. Отклонённая попытка счётчик не увеличивает,
+    иначе клиент, который повторяет запросы, не дождался бы разблокировки.
+    """
+
+    def __init__(self, scope, limit, period, cache_alias='shared', cache=None):
+        self.scope = scope
+        self.limit = limit
+        self.period = period
+        self.cache_alias = cache_alias
+        self._backend = cache  # готовый бэкенд вместо алиаса (тесты, benchmark)
+        self._script = None
+
+    @property
+    def cache(self):
+        return self._backend if self._backend is not None else caches[self.cache_alias]
+
+    def _window_keys(self, key, now):
+        window = int(now // self.period)
+        return (f"rl:{self.scope}:{key}:{window}",
+                f"rl:{self.scope}:{key}:{window - 1}")
+
+    def _previous_weight(self, now):
+        return 1 - (now % self.period) / self.period
+
+    def _result(self, allowed, current, previous, now):
+        used = current + previous * self._previous_weight(now)
+        return RateLimitResult(
+            allowed=allowed,
+            remaining=max(0, int(self.limit - used)),
+            reset_in=int(self.period - now % self.period) + 1,
+        )
+
+    def _redis_hit(self, cache, current_key, previous_key, weight):
+        current_key = cache.make_and_validate_key(current_key)
+        previous_key = cache.make_and_validate_key(previous_key)
+        client = cache._cache.get_client(current_key, write=True)
+        if self._script is None:
+            self._script = client.register_script(SLIDING_WINDOW_LUA)
+        allowed, current, previous = self._script(keys=[current_key, previous_key],
+                                                  args=[weight, self.limit, self.period * 2],
+                                                  client=client)
+        return bool(allowed), current, previous
+
+    def _local_hit(self, cache, current_key, previous_key, weight):
+        # LocMemCache и подобные живут внутри процесса: блокировки процесса достаточно
+        with _local_lock:
+            counters = cache.get_many([current_key, previous_key])
+            current, previous = counters.get(current_key, 0), counters.get(previous_key, 0)
+            if current + previous * weight + 1 > self.limit:
+                return False, current, previous
+            if current:
+                cache.incr(current_key)
+            else:
+                cache.set(current_key, 1, self.period * 2)
+            return True, current + 1, previous
+
+    def hit(self, key):
+        """Учитывает попытку, если она укладывается в лимит, и возвращает RateLimitResult."""
+        cache = self.cache
+        now = time.time()
+        current_key, previous_key = self._window_keys(key, now)
+        weight = self._previous_weight(now)
+        # счётчик живёт два окна: в следующем он нужен как «предыдущий»
+        if hasattr(cache, 'sliding_window_hit'):
+            allowed, current, previous = cache.sliding_window_hit(current_key, previous_key, weight,
+                                                                  self.limit, self.period * 2)
+        elif isinstance(cache, RedisCache):
+            allowed, current, previous = self._redis_hit(cache, current_key, previous_key, weight)
+        else:
+            allowed, current, previous = self._local_hit(cache, current_key, previous_key, weight)
+        return self._result(allowed, current, previous, now)
+
+    def get_usage(self, key):
+        """Возвращает остаток лимита, не учитывая попытку."""
+        now = time.time()
+        current_key, previous_key = self._window_keys(key, now)
+        counters = self.cache.get_many([current_key, previous_key])
+        current, previous = counters.get(current_key, 0), counters.get(previous_key, 0)
+        allowed = current + previous * self._previous_weight(now) + 1 <= self.limit
+        return self._result(allowed, current, previous, now)
@@ -0,0 +1,162 @@
+# personal_account/referrals.py
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Profile, Profile_partner, Profile_queue, ReferralAggregate, ReferralClosure, parse_price
+
+MAX_DEPTH = 10  # уровней консультантов тоже десять
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def get_downline(user, max_depth=MAX_DEPTH):
+    """
+    Вся структура партнёров пользователя одним запросом (WITH RECURSIVE).
+
+    Возвращает список User, у каждого дополнительно заполнены depth
+    (1 — прямой партнёр), referred_id, status, phone и direct_count —
+    число его собственных прямых партнёров. Ограничение глубины защищает
+    и от зацикленных ссылок referred.
+    """
+    partner, queue, profile = _table(Profile_partner), _table(Profile_queue), _table(Profile)
+    sql = f"""
+        WITH RECURSIVE downline (user_id, referred_id, depth) AS (
+            SELECT user_id, referred_id, 1 FROM {partner} WHERE referred_id = %s
+            UNION ALL
+            SELECT p.user_id, p.referred_id, d.depth + 1
+            FROM {partner} p JOIN downline d ON p.referred_id = d.user_id
+            WHERE d.depth < %s
+        )
+        SELECT u.*, d.depth, d.referred_id, q.status, pr.phone,
+               (SELECT COUNT(*) FROM {partner} c WHERE c.referred_id = d.user_id) AS direct_count
+        FROM downline d
+        JOIN {_table(User)} u ON u.id = d.user_id
+        LEFT JOIN {queue} q ON q.user_id = d.user_id
+        LEFT JOIN {profile} pr ON pr.user_id = d.user_id
+        ORDER BY d.depth, u.date_joined, u.id
+    """
+    return list(User.objects.raw(sql, [user.pk, max_depth]))
+
+
+def downline_stats(downline):
+    """Итоги по структуре: всего, прямых, по статусам и по уровням."""
+    return {
+        'total': len(downline),
+        'direct': sum(1 for node in downline if node.depth == 1),
+        'by_status': Counter(node.status for node in downline),
+        'by_depth': sorted(Counter(node.depth for node in downline).items()),
+    }
+
+
+def descendants(user, max_depth=None):
+    """Все партнёры структуры пользователя с полем depth (по таблице замыкания)."""
+    rows = ReferralClosure.objects.filter(ancestor=user, depth__gt=0)
+    if max_depth is not None:
+        rows = rows.filter(depth__lte=max_depth)
+    return User.objects.filter(referral_ancestors__in=rows).annotate(depth=F('referral_ancestors__depth'))
+
+
+def ancestors(user, max_depth=None):
+    """Цепочка пригласивших пользователя вверх до уровня max_depth, ближайший — depth=1."""
+    rows = ReferralClosure.objects.filter(descendant=user, depth__gt=0)
+    if max_depth is not None:
+        rows = rows.filter(depth__lte=max_depth)
+    return User.objects.filter(referral_descendants__in=rows).annotate(depth=F('referral_descendants__depth'))
+
+
+def subtree_size(user):
+    return ReferralClosure.objects.filter(ancestor=user, depth__gt=0).count()
+
+
+def closure_rows():
+    """
+    Строки таблицы замыкания, вычисленные заново по Profile_partner.referred.
+
+    Возвращает множество (предок, потомок, уровень) и список пользователей,
+    у которых цепочка пригласивших зациклена (их связи пропускаются).
+    """
+    parents = dict(Profile_partner.objects.values_list('user_id', 'referred_id').iterator(chunk_size=10000))
+    nodes = set(parents) | {parent for parent in parents.values() if parent is not None}
+    rows, cycles = set(), []
+    for node in nodes:
+        chain = [node]
+        parent = parents.get(node)
+        while parent is not None and parent not in chain:
+            chain.append(parent)
+            parent = parents.get(parent)
+        if parent is not None:
+            cycles.append(node)
+            chain = [node]
+        rows.update((ancestor, node, depth) for depth, ancestor in enumerate(chain))
+    return rows, cycles
+
+
+def check_closure():
+    """Возвращает (недостающие строки, лишние строки, зацикленные пользователи)."""
+    expected, cycles = closure_rows()
+    actual = set(ReferralClosure.objects.values_list('ancestor_id', 'descendant_id', 'depth').iterator(chunk_size=10000))
+    return expected - actual, actual - expected, cycles
+
+
+def rebuild_closure():
+    expected, cycles = closure_rows()
+    # сотни тысяч строк: executemany без создания объектов модели
+    sql = f"INSERT INTO {_table(ReferralClosure)} (ancestor_id, descendant_id, depth) VALUES (%s, %s, %s)"
+    with transaction.atomic(), connection.cursor() as cursor:
+        ReferralClosure.objects.all().delete()
+        cursor.executemany(sql, sorted(expected))
+    return len(expected), cycles
+
+
+def compute_aggregates():
+    """Итоги по структурам, посчитанные заново по таблице замыкания: {user_id: ReferralAggregate}."""
+    queues = {
+        user_id: (status, parse_price(price), parse_price(price_in_queue))
+        for user_id, status, price, price_in_queue
+        in Profile_queue.objects.values_list('user_id', 'status', 'price', 'price_in_queue').iterator()
+    }
+    aggregates = defaultdict(lambda: {'size': 0, 'statuses': Counter(), 'price': Decimal(0), 'price_in_queue': Decimal(0)})
+    rows = ReferralClosure.objects.filter(depth__gt=0).values_list('ancestor_id', 'descendant_id')
+    for ancestor_id, descendant_id in rows.iterator(chunk_size=10000):
+        aggregate = aggregates[ancestor_id]
+        aggregate['size'] += 1
+        if descendant_id in queues:
+            status, price, price_in_queue = queues[descendant_id]
+            if status:
+                aggregate['statuses'][status] += 1
+            aggregate['price'] += price
+            aggregate['price_in_queue'] += price_in_queue
+    return {
+        user_id: ReferralAggregate(user_id=user_id,
+                                   subtree_size=aggregate['size'],
+                                   status_counts=dict(aggregate['statuses']),
+                                   total_price=aggregate['price'],
+                                   total_price_in_queue=aggregate['price_in_queue'])
+        for user_id, aggregate in aggregates.items()
+    }
+
+
+def check_aggregates():
+    """Возвращает id пользователей, чьи сохранённые итоги расходятся с пересчётом."""
+    expected = compute_aggregates()
+    mismatched = []
+    for row in ReferralAggregate.objects.iterator():
+        fresh = expected.pop(row.user_id, ReferralAggregate(user_id=row.user_id))
+        if (row.subtree_size, row.status_counts, row.total_price, row.total_price_in_queue) != \
+                (fresh.subtree_size, fresh.status_counts, fresh.total_price, fresh.total_price_in_queue):
+            mismatched.append(row.user_id)
+    return mismatched + list(expected)
+
+
+def rebuild_aggregates(batch_size=1000):
+    aggregates = compute_aggregates()
+    with transaction.atomic():
+        ReferralAggregate.objects.all().delete()
+        ReferralAggregate.objects.bulk_create(aggregates.values(), batch_size=batch_size)
+    return len(aggregates)
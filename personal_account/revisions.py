@@ -0,0 +1,238 @@
+# personal_account/revisions.py
+import gzip
+import json
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber, TruncDate
+from django.db.models.signals import post_delete, post_save, pre_save
+from simple_history.models import HistoricalRecords
+from simple_history.utils import get_change_reason_from_object
+
+from .models import Revision
+
+KEYFRAME_INTERVAL = 20  # не больше 19 разностей при сборке снимка
+WRITE_ATTEMPTS = 5
+
+
+def enabled():
+    return getattr(settings, 'HISTORY_BACKEND', 'simple_history') == 'revisions'
+
+
+def history_models():
+    """Модели с HistoricalRecords: при HISTORY_BACKEND = 'revisions' их версии пишет этот модуль."""
+    return [model for model in apps.get_models() if hasattr(model._meta, 'simple_history_manager_attribute')]
+
+
+def _dump(value):
+    if value is None or isinstance(value, (bool, int, float, str, list, dict)):
+        return value
+    return str(value)  # даты, Decimal, FieldFile; обратно через field.to_python
+
+
+def _state(instance):
+    return {field.attname: _dump(getattr(instance, field.attname)) for field in instance._meta.concrete_fields}
+
+
+def _is_keyframe(number):
+    return number % KEYFRAME_INTERVAL == 1
+
+
+def _history_user(instance):
+    user = getattr(instance, '_history_user', None)
+    if user is None:
+        user = getattr(getattr(HistoricalRecords.context, 'request', None), 'user', None)
+    return user if user is not None and user.is_authenticated else None
+
+
+def _write(instance, history_type, changes, using, keyframe=False):
+    content_type = ContentType.objects.db_manager(using).get_for_model(type(instance))
+    revisions = Revision.objects.using(using).filter(content_type=content_type, object_id=instance.pk)
+    for attempt in range(WRITE_ATTEMPTS):
+        number = (revisions.order_by('-number').values_list('number', flat=True).first() or 0) + 1
+        full = history_type != '-' and (keyframe or _is_keyframe(number))
+        try:
+            # номер занял параллельный save того же объекта — берём следующий;
+            # точка сохранения не даёт ошибке оборвать транзакцию пользователя
+            with transaction.atomic(using=using):
+                Revision.objects.using(using).create(
+                    content_type=content_type,
+                    object_id=instance.pk,
+                    number=number,
+                    is_keyframe=full,
+                    changes=_state(instance) if full else changes,
+                    history_type=history_type,
+                    history_user=_history_user(instance),
+                    change_reason=get_change_reason_from_object(instance),
+                )
+            return
+        except IntegrityError:
+            if attempt == WRITE_ATTEMPTS - 1:
+                raise
+
+
+def _remember_previous(sender, instance, raw=False, using=None, **kwargs):
+    if not enabled() or raw or instance._state.adding:
+        return
+    attnames = [field.attname for field in sender._meta.concrete_fields]
+    loaded = getattr(instance, '_loaded_values', None)  # DirtyFieldsMixin: прежние значения уже в памяти
+    if loaded is not None and all(name in loaded for name in attnames):
+        instance._revision_previous = {name: _dump(loaded[name]) for name in attnames}
+        return
+    row = sender._base_manager.using(using).filter(pk=instance.pk).values_list(*attnames).first()
+    if row is not None:
+        instance._revision_previous = dict(zip(attnames, map(_dump, row)))
+
+
+def _record_save(sender, instance, created, raw=False, using=None, **kwargs):
+    if not enabled() or raw:
+        return
+    previous = instance.__dict__.pop('_revision_previous', None)
+    if created or previous is None:
+        _write(instance, '+' if created else '~', {}, using, keyframe=True)
+        return
+    changes = {name: value for name, value in _state(instance).items() if previous.get(name) != value}
+    # сохранение без изменений (или только auto_now) версию не создаёт
+    auto_now = {field.attname for field in sender._meta.concrete_fields if getattr(field, 'auto_now', False)}
+    if changes.keys() - auto_now:
+        _write(instance, '~', changes, using)
+
+
+def _record_delete(sender, instance, using=None, **kwargs):
+    if enabled():
+        _write(instance, '-', {}, using)
+
+
+def register(model):
+    uid = f'revisions_{model._meta.label_lower}'
+    pre_save.connect(_remember_previous, sender=model, dispatch_uid=uid)
+    post_save.connect(_record_save, sender=model, dispatch_uid=uid)
+    post_delete.connect(_record_delete, sender=model, dispatch_uid=uid)
+
+
+def record_created(objs, change_reason=None):
+    """Начальные полные снимки для объектов, созданных через bulk_create."""
+    if not objs:
+        return
+    content_type = ContentType.objects.get_for_model(type(objs[0]))
+    Revision.objects.bulk_create([
+        Revision(content_type=content_type, object_id=obj.pk, number=1, is_keyframe=True,
+                 changes=_state(obj), history_type='+', change_reason=change_reason)
+        for obj in objs
+    ], batch_size=1000)
+
+
+def revisions_for(model, pk):
+    return Revision.objects.filter(content_type=ContentType.objects.get_for_model(model), object_id=pk)
+
+
+def snapshot(model, pk, at=None):
+    """
+    Несохранённый объект model в состоянии на момент at (по умолчанию — по
+    последней версии): ближайший полный снимок и разности после него.
+    None, если объекта в этот момент не было или версий нет.
+    """
+    revisions = revisions_for(model, pk)
+    if at is not None:
+        revisions = revisions.filter(history_date__lte=at)
+    base = revisions.filter(is_keyframe=True).order_by('-number').values_list('number', flat=True).first()
+    if base is None:
+        return None
+    values = {}
+    history_type = None
+    for history_type, changes in revisions.filter(number__gte=base).order_by('number') \
+                                          .values_list('history_type', 'changes'):
+        values.update(changes)
+    if history_type == '-':
+        return None
+    fields = {field.attname: field for field in model._meta.concrete_fields}
+    return model(**{name: fields[name].to_python(value) for name, value in values.items() if name in fields})
+
+
+def historical_models():
+    """Таблицы Historical* для моделей с HistoricalRecords."""
+    return [getattr(model, model._meta.simple_history_manager_attribute).model for model in history_models()]
+
+
+def collapsible(historical, since, until):
+    """
+    Версии изменения ('~') из [since, until) (since=None — с самой первой),
+    кроме последней за день у каждого объекта. Создание и удаление объекта
+    не схлопываются и в нумерацию не входят: день, закончившийся удалением,
+    сохраняет и последнее изменение.
+    """
+    versions = historical.objects.filter(history_date__lt=until, history_type='~')
+    if since is not None:
+        versions = versions.filter(history_date__gte=since)
+    return (versions.annotate(rank=Window(RowNumber(),
+                                          partition_by=[F(historical.instance_type._meta.pk.attname),
+                                                        TruncDate('history_date')],
+                                          order_by=F('history_date').desc()))
+                    .filter(rank__gt=1))
+
+
+def collapse_history(historical, since, until, batch_size, pause=0):
+    """
+    Удаляет версии collapsible() по объектам: за проход берётся batch_size
+    объектов, нумерация считается только по их версиям. Последняя версия
+    дня не удаляется, поэтому повторный расчёт после удаления пачки даёт
+    те же версии без удалённых.
+    """
+    attname = historical.instance_type._meta.pk.attname
+    versions = collapsible(historical, since, until)
+    objects = (historical.objects.filter(history_date__lt=until, history_type='~')
+                                 .values_list(attname, flat=True).order_by(attname).distinct())
+    if since is not None:
+        objects = objects.filter(history_date__gte=since)
+    deleted = 0
+    last = None
+    while True:
+        chunk = list((objects if last is None else objects.filter(**{f'{attname}__gt': last}))[:batch_size])
+        if not chunk:
+            return deleted
+        last = chunk[-1]
+        deleted += delete_in_batches(versions.filter(**{f'{attname}__gte': chunk[0], f'{attname}__lte': last}),
+                                     batch_size, pause)
+
+
+def archive_history(historical, before, path, batch_size):
+    """
+    Пишет версии старше before в gzip JSONL (по строке на версию) и
+    возвращает (число записанных, последний history_id) — удалять их можно
+    только после закрытия файла.
+    """
+    archived = 0
+    last = 0
+    rows = historical.objects.filter(history_date__lt=before).order_by('history_id')
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        while True:
+            batch = list(rows.filter(history_id__gt=last).values()[:batch_size])
+            if not batch:
+                break
+            for row in batch:
+                archive.write(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n')
+            last = batch[-1]['history_id']
+            archived += len(batch)
+    return archived, last
+
+
+def delete_in_batches(queryset, batch_size, pause=0):
+    """
+    Удаляет строки queryset по batch_size за запрос, каждый запрос — отдельная
+    короткая транзакция, чтобы SQLite не блокировал запись сайта надолго.
+    В памяти только ключи текущей пачки.
+    """
+    deleted = 0
+    while True:
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        queryset.model.objects.filter(pk__in=ids).delete()
+        deleted += len(ids)
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,151 @@
+# personal_account/storage.py
+import hashlib
+import os
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage, storages
+from django.db import models
+from django.db.models.fields.files import ImageFieldFile
+
+from .images import thumbnail_name
+
+BLOB_DIR = 'documents/blobs'
+
+
+def is_blob(name):
+    return bool(name) and name.replace('\\', '/').startswith(BLOB_DIR + '/')
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище фото документов. Файлы, загруженные в поля DocumentImageField,
+    сохраняются под именем, вычисленным из содержимого
+    (documents/blobs/ab/cd/<sha256>.jpg), поэтому повторная загрузка тех же
+    байтов не создаёт копию; имя из upload_to не используется. Всё остальное
+    (превью, старые файлы вне blobs) пишется через save() под своим именем,
+    как в обычном FileSystemStorage. Учёт ссылок — модель MediaBlob.
+    """
+
+    def blob_name(self, content, name):
+        digest = content_hash(content)
+        ext = os.path.splitext(name)[1].lower()
+        return f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+    def save_blob(self, name, content):
+        """Сохраняет файл по адресу из содержимого (name даёт только расширение), возвращает имя блоба."""
+        from .models import MediaBlob
+
+        blob = self.blob_name(content, name)
+        if not self.exists(blob):
+            blob = self.save(blob, content)
+        MediaBlob.register(blob, content.size)
+        return blob
+
+
+class DocumentFieldFile(ImageFieldFile):
+
+    def save(self, name, content, save=True):
+        if not isinstance(self.storage, ContentAddressedStorage):
+            return super().save(name, content, save)
+        name = self.field.generate_filename(self.instance, name)
+        self.name = self.storage.save_blob(name, content)
+        setattr(self.instance, self.field.attname, self.name)
+        self._committed = True
+        if save:
+            self.instance.save()
+
+    save.alters_data = True
+
+
+class DocumentImageField(models.ImageField):
+    """ImageField, чьи загрузки хранятся в ContentAddressedStorage по содержимому."""
+
+    attr_class = DocumentFieldFile
+
+
+def document_storage():
+    return storages['documents']
+
+
+def blob_fields(model):
+    return [field for field in model._meta.concrete_fields
+            if isinstance(field, models.FileField) and isinstance(field.storage, ContentAddressedStorage)]
+
+
+def blob_names(instance, values=None):
+    """Имена блобов, на которые ссылаются файловые поля объекта (или словарь values по attname)."""
+    if values is None:
+        values = instance.__dict__  # без обращения к дескриптору: там может быть и строка, и FieldFile
+    names = []
+    for field in blob_fields(type(instance)):
+        value = values.get(field.attname)
+        name = getattr(value, 'name', value)
+        if is_blob(name):
+            names.append(name)
+    return names
+
+
+def file_reference_columns():
+    """
+    Пары (модель, колонка) для всех FileField проекта, включая те же колонки
+    в таблицах истории: simple_history хранит там путь обычным текстом.
+    """
+    for model in apps.get_models():
+        source = getattr(model, 'instance_type', model)
+        for field in source._meta.concrete_fields:
+            if isinstance(field, models.FileField):
+                yield model, field.attname
+
+
+def media_key(name):
+    # 8 байт вместо строки пути: миллион ссылок занимает десятки мегабайт
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big')
+
+
+def referenced_media(chunk_size=5000):
+    """
+    Ключи media_key всех путей, на которые ссылается база (включая версии
+    в истории), вместе с их превью стандартного размера (превью других
+    размеров создаются заново).
+    """
+    from .models import Revision
+
+    def add(names):
+        for name in names:
+            keys.add(media_key(name))
+            keys.add(media_key(thumbnail_name(name)))
+
+    keys = set()
+    revision_columns = {}
+    for model, column in file_reference_columns():
+        names = (model._default_manager.exclude(**{column: ''})
+                 .exclude(**{f'{column}__isnull': True})
+                 .values_list(column, flat=True))
+        add(names.iterator(chunk_size=chunk_size))
+        if not hasattr(model, 'instance_type'):
+            revision_columns.setdefault(model, []).append(column)
+    # при HISTORY_BACKEND = 'revisions' пути старых версий хранятся в JSON Revision.changes
+    for model, columns in revision_columns.items():
+        add(Revision.file_names(model, columns, chunk_size=chunk_size))
+    return keys
+
+
+def walk_media(root):
+    """Файлы под root: пары (путь относительно root через /, os.DirEntry)."""
+    stack = ['']
+    while stack:
+        relative = stack.pop()
+        with os.scandir(os.path.join(root, relative)) as entries:
+            for entry in entries:
+                path = f"{relative}/{entry.name}" if relative else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield path, entry
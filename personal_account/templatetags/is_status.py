@@ -1,5 +1,6 @@
 from django import template
-from .utils import user_is_status, agree_to_consultant
+from django.conf import settings
+from .utils import user_is_status, agree_to_consultant, unread_notifications
 
 register = template.Library()
 
@@ -10,3 +11,13 @@ def is_status_template(user):
 @register.filter
 def is_agree(user):
     return agree_to_consultant(user)
+
+
+@register.filter
+def unread_notifications_count(user):
+    return unread_notifications(user)
+
+
+@register.simple_tag
+def notification_stream_enabled():
+    return getattr(settings, 'NOTIFICATION_SSE_ENABLED', False)
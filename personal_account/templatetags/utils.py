@@ -26,3 +26,13 @@ def agree_to_consultant(user):
     if profile and getattr(profile, "agree_to_consultant", False) is True:
         return True
     return False
+
+
+def unread_notifications(user):
+
+    if not user or user.is_anonymous:
+        return 0
+    counter = getattr(user, "notification_counter", None)
+    if counter:
+        return counter.total
+    return 0
@@ -1,3 +1,1317 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import json
+import os
+import smtplib
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+from uuid import uuid4
 
-# Create your tests here.
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache.backends.redis import RedisCache
+from django.contrib.contenttypes.models import ContentType
+from django.core import mail as outbox
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_save, pre_save
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import delivery, exporter, images, importer, mail, notifications, referrals, revisions, utils
+from .benchmarks import PHOTO_FIXTURES, phone_photo
+from .forms import FeedbackForm, ProcessingApplicationForm
+from .images import make_thumbnail, thumbnail_name
+from .cache import SQLiteCache
+from .codes import ALPHABET, decode_referral_code, is_generated_code, make_referral_code
+from .events import InProcessBroker, RedisBroker, user_channel
+from .models import (MediaBlob, MessageNotification, NotificationCounter, OutgoingEmail, Profile, Profile_address,
+                     Profile_invitee, Profile_partner, Profile_queue, ReferralAggregate, Revision, SystemNotification,
+                     SystemNotificationTarget)
+from .ratelimit import RateLimit, RateLimitResult
+from .storage import ContentAddressedStorage, document_storage, media_key, referenced_media
+
+
+class InProcessBrokerTests(TestCase):
+
+    async def test_event_reaches_subscriber(self):
+        broker = InProcessBroker()
+        async with broker.subscribe([user_channel(1)]) as queue:
+            # publish вызывается из сигналов в другом потоке
+            thread = threading.Thread(target=broker.publish, args=(user_channel(1), {'type': 'message', 'id': 5}))
+            thread.start()
+            thread.join()
+            event = await asyncio.wait_for(queue.get(), 1)
+        self.assertEqual(event, {'type': 'message', 'id': 5})
+
+    async def test_other_channels_are_not_delivered(self):
+        broker = InProcessBroker()
+        async with broker.subscribe([user_channel(1)]) as queue:
+            broker.publish(user_channel(2), {'type': 'message'})
+            await asyncio.sleep(0)
+            self.assertTrue(queue.empty())
+
+
+@skipUnless(settings.REDIS_URL, 'нужен REDIS_URL')
+class RedisBrokerTests(SimpleTestCase):
+
+    async def test_subscribers_share_one_connection(self):
+        broker = RedisBroker(settings.REDIS_URL)
+        channel = user_channel(uuid4().hex)
+        async with broker.subscribe([channel]) as first, broker.subscribe([channel]) as second:
+            await asyncio.sleep(0.2)  # Redis подтверждает SUBSCRIBE асинхронно
+            await asyncio.to_thread(broker.publish, channel, {'type': 'message', 'id': 7})
+            self.assertEqual(await asyncio.wait_for(first.get(), 2), {'type': 'message', 'id': 7})
+            self.assertEqual(await asyncio.wait_for(second.get(), 2), {'type': 'message', 'id': 7})
+            self.assertEqual(broker._listeners[channel], 2)
+        self.assertNotIn(channel, broker._listeners)
+        broker._reader.cancel()
+        await broker._pubsub.aclose()
+
+
+class NotificationStreamViewTests(TestCase):
+
+    @override_settings(NOTIFICATION_SSE_ENABLED=False)
+    def test_disabled_stream_returns_no_content(self):
+        user = User.objects.create_user('stream', 'stream@example.com', 'x')
+        self.client.force_login(user)
+        response = self.client.get(reverse('personal_account:notifications_stream'))
+        self.assertEqual(response.status_code, 204)
+
+
+class NotificationCounterTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('reader', password='secret')
+        Profile_queue.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def notify(self, title):
+        notification = SystemNotification.objects.create(title=title, message='Текст', status='Обработка')
+        delivery.deliver(notification, fanout_on_write_limit=0)
+
+    def test_visit_marks_only_shown_page(self):
+        for i in range(30):
+            MessageNotification.objects.create(to_user=self.user, title=f'Сообщение {i}', message='Текст')
+        for i in range(25):
+            self.notify(f'Уведомление {i}')
+
+        response = self.client.get(reverse('personal_account:notifications_list'))
+        self.assertEqual(response.status_code, 200)
+
+        counter = NotificationCounter.objects.get(user=self.user)
+        unread = MessageNotification.objects.filter(to_user=self.user, is_read=False).count()
+        unseen = notifications.system_notifications_for(self.user).filter(is_read=False).count()
+        self.assertEqual(unread, 10)
+        self.assertEqual(counter.unread_messages, unread)
+        self.assertEqual(unseen, 5)
+        self.assertEqual(counter.unseen_system, unseen)
+
+    def test_repeated_marking_does_not_decrement_twice(self):
+        self.notify('Уведомление')
+        page = list(notifications.system_notifications_for(self.user))
+        self.assertEqual(notifications.mark_system_read(self.user, page), 1)
+        self.assertEqual(notifications.mark_system_read(self.user, page), 0)
+        self.assertEqual(NotificationCounter.objects.get(user=self.user).unseen_system, 0)
+
+
+@override_settings(HISTORY_BACKEND='revisions', SIMPLE_HISTORY_ENABLED=False)
+class RevisionTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('owner', password='secret')
+        self.queue = Profile_queue.objects.create(user=self.user)
+
+    def test_only_revisions_are_written(self):
+        self.queue.price = '100'
+        self.queue.save()
+
+        self.assertFalse(Profile_queue.history.exists())
+        self.assertEqual(revisions.revisions_for(Profile_queue, self.queue.pk).count(), 2)
+
+    def test_history_file_is_not_garbage(self):
+        name = 'documents/blobs/aa/bb/aabb.jpg'
+        blob = MediaBlob.objects.create(name=name, size=10)
+        MediaBlob.objects.filter(pk=blob.pk).update(created_at=timezone.now() - timedelta(days=2))
+        # фото есть только в прошлой версии объекта
+        revisions.revisions_for(Profile_queue, self.queue.pk).update(changes={'contract_photo': name})
+
+        self.assertEqual(MediaBlob.collect_garbage(timezone.now() - timedelta(days=1), dry_run=True), (0, 0))
+        self.assertIn(media_key(name), referenced_media())
+
+    def test_concurrent_number_is_retried(self):
+        content_type = ContentType.objects.get_for_model(Profile_queue)
+        is_keyframe = revisions._is_keyframe
+        taken = []
+
+        def competing_save(number):
+            if not taken:
+                # между выбором номера и записью другой процесс записал версию с тем же номером
+                taken.append(number)
+                Revision.objects.create(content_type=content_type, object_id=self.queue.pk, number=number,
+                                        history_type='~')
+            return is_keyframe(number)
+
+        self.queue.price = '100'
+        with mock.patch.object(revisions, '_is_keyframe', side_effect=competing_save):
+            self.queue.save()
+
+        self.assertEqual(taken, [2])
+        numbers = list(revisions.revisions_for(Profile_queue, self.queue.pk).order_by('number')
+                       .values_list('number', flat=True))
+        self.assertEqual(numbers, [1, 2, 3])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DirtyFieldsTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('member', password='secret')
+        self.profile = Profile.objects.get(user=user)
+        self.signals = []
+        for signal in (pre_save, post_save):
+            receiver = lambda signal, sender, **kwargs: self.signals.append(signal)
+            signal.connect(receiver, sender=Profile, weak=False)
+            self.addCleanup(signal.disconnect, receiver, sender=Profile)
+
+    def writes(self, context):
+        return [query['sql'] for query in context.captured_queries
+                if query['sql'].startswith(('UPDATE', 'INSERT'))]
+
+    def test_unchanged_save_is_skipped(self):
+        profile = Profile.objects.get(pk=self.profile.pk)
+        versions = profile.history.count()
+
+        with CaptureQueriesContext(connection) as context:
+            profile.save()
+
+        self.assertEqual(self.writes(context), [])
+        self.assertEqual(self.signals, [])
+        self.assertEqual(profile.history.count(), versions)
+
+    def test_only_changed_column_is_written(self):
+        profile = Profile.objects.get(pk=self.profile.pk)
+        versions = profile.history.count()
+        profile.can_edit = 'One_done'
+
+        with CaptureQueriesContext(connection) as context:
+            profile.save()
+
+        [update, history] = self.writes(context)
+        self.assertIn('SET "can_edit"', update)
+        self.assertNotIn('"phone"', update)
+        self.assertEqual(self.signals, [pre_save, post_save])
+        self.assertEqual(profile.history.count(), versions + 1)
+        self.assertEqual(profile.get_dirty_fields(), set())
+
+    def test_explicit_update_fields_still_send_signals(self):
+        profile = Profile.objects.get(pk=self.profile.pk)
+
+        profile.save(update_fields=['can_edit'])
+
+        self.assertEqual(self.signals, [pre_save, post_save])
+
+    def test_only_changed_fields_are_validated(self):
+        # телефон, записанный в обход проверок, не мешает сменить разрешение
+        Profile.objects.filter(pk=self.profile.pk).update(phone='8999')
+        profile = Profile.objects.get(pk=self.profile.pk)
+        profile.can_edit = 'False'
+        profile.save()
+        self.assertEqual(Profile.objects.get(pk=profile.pk).can_edit, 'False')
+
+        profile.phone = '8998'
+        with self.assertRaises(ValidationError):
+            profile.save()
+
+    def test_new_object_is_validated_in_full(self):
+        user = User.objects.create_user('other', password='secret')
+        Profile.objects.filter(user=user).delete()
+
+        with self.assertRaises(ValidationError):
+            Profile(user=user, phone='8999').save()
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PruneHistoryTests(TestCase):
+    historical = Profile_queue.history.model
+
+    def make_versions(self, username, days_ago, changes=2, delete=False):
+        """Создание, changes изменений и, при delete, удаление объекта в один день с интервалом в час."""
+        queue = Profile_queue.objects.create(user=User.objects.create_user(username, password='secret'))
+        pk = queue.pk
+        for i in range(changes):
+            queue.price = str(i)
+            queue.save()
+        if delete:
+            queue.delete()
+        day = timezone.localtime() - timedelta(days=days_ago)
+        versions = self.historical.objects.filter(user_id=pk).order_by('history_id')
+        for hour, history_id in enumerate(versions.values_list('history_id', flat=True), start=9):
+            self.historical.objects.filter(history_id=history_id).update(history_date=day.replace(hour=hour))
+        return pk
+
+    def history_types(self, pk):
+        return ''.join(self.historical.objects.filter(user_id=pk).order_by('history_date')
+                                              .values_list('history_type', flat=True))
+
+    def test_day_keeps_its_last_change(self):
+        pk = self.make_versions('changed', 400, changes=3)
+
+        call_command('prune_history', keep_days=365, pause=0, stdout=StringIO())
+
+        self.assertEqual(self.history_types(pk), '+~')
+        self.assertEqual(self.historical.objects.get(user_id=pk, history_type='~').price, '2')
+
+    def test_day_ending_with_delete_keeps_last_change(self):
+        pk = self.make_versions('deleted', 400, changes=3, delete=True)
+
+        call_command('prune_history', keep_days=365, pause=0, stdout=StringIO())
+
+        self.assertEqual(self.history_types(pk), '+~-')
+        self.assertEqual(self.historical.objects.get(user_id=pk, history_type='~').price, '2')
+
+    def test_recent_versions_are_kept(self):
+        pk = self.make_versions('recent', 10, changes=3)
+
+        call_command('prune_history', keep_days=365, pause=0, stdout=StringIO())
+
+        self.assertEqual(self.history_types(pk), '+~~~')
+
+    def test_small_batches_collapse_every_object(self):
+        pks = [self.make_versions(f'member{i}', 400, changes=3) for i in range(5)]
+
+        deleted = revisions.collapse_history(self.historical, None, timezone.now() - timedelta(days=365),
+                                             batch_size=2)
+
+        self.assertEqual(deleted, 10)
+        self.assertEqual([self.history_types(pk) for pk in pks], ['+~'] * 5)
+
+    def test_dry_run_changes_nothing(self):
+        pk = self.make_versions('dry', 400, changes=3)
+        out = StringIO()
+
+        call_command('prune_history', keep_days=365, dry_run=True, stdout=out)
+
+        self.assertEqual(self.history_types(pk), '+~~~')
+        self.assertIn(f'{self.historical._meta.db_table}: в архив 0, схлопнуто 2', out.getvalue())
+
+    def test_old_versions_are_archived_and_deleted(self):
+        old = self.make_versions('old', 800, changes=1)
+        kept = self.make_versions('kept', 400, changes=1)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        call_command('prune_history', keep_days=365, archive_after_days=730, archive_dir=directory.name,
+                     pause=0, stdout=StringIO())
+
+        self.assertEqual(self.history_types(old), '')
+        self.assertEqual(self.history_types(kept), '+~')
+        table = self.historical._meta.db_table
+        [name] = [name for name in os.listdir(directory.name) if name.startswith(table)]
+        with gzip.open(os.path.join(directory.name, name), 'rt', encoding='utf-8') as archive:
+            rows = [json.loads(line) for line in archive]
+        self.assertEqual([(row['user_id'], row['history_type']) for row in rows], [(old, '+'), (old, '~')])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PageQueryCountTests(TestCase):
+    """Число запросов не должно зависеть от размера структуры."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.consultant = User.objects.create_user('consultant', password='secret')
+        Profile_queue.objects.create(user=cls.consultant, status='Консультант')
+        Profile_partner.objects.create(user=cls.consultant)
+        for i in range(10):
+            user = User.objects.create_user(f'referral{i}', password='secret')
+            Profile_queue.objects.create(user=user, status='Пайщик')
+            Profile_partner.objects.create(user=user, referred=cls.consultant)
+
+    def setUp(self):
+        self.client.force_login(self.consultant)
+
+    def test_profile_page(self):
+        url = reverse('personal_account:user_profile', kwargs={'username': self.consultant.username})
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_referral_page(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('personal_account:referral'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['referrals']), 10)
+
+    def test_referral_page_counts_partners_below_max_depth(self):
+        # итоги структуры считаются по всем уровням, список — до MAX_DEPTH
+        ReferralAggregate.objects.filter(user=self.consultant).update(subtree_size=13)
+        response = self.client.get(reverse('personal_account:referral'))
+        self.assertEqual(response.context['structure']['total'], 10)
+        self.assertEqual(response.context['beyond_max_depth'], 3)
+        self.assertContains(response, 'Глубже 10-го уровня')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AdminChangelistQueryCountTests(TestCase):
+    """Списки админки на 1000+ строк: число запросов не растёт с числом строк на странице."""
+
+    ROWS = 1200
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        cls.referrer = User.objects.create_user('referrer', password='secret')
+        users = User.objects.bulk_create([User(username=f'user{i}', email=f'user{i}@example.com')
+                                          for i in range(cls.ROWS)])
+        Profile.objects.bulk_create([Profile(user=user) for user in users])
+        Profile_address.objects.bulk_create([Profile_address(user=user) for user in users])
+        Profile_invitee.objects.bulk_create([Profile_invitee(user=user) for user in users])
+        Profile_queue.objects.bulk_create([Profile_queue(user=user, status='Пайщик') for user in users])
+        Profile_partner.objects.bulk_create([Profile_partner(user=user, referral_code=f'T{i:06d}',
+                                                             referred=cls.referrer)
+                                             for i, user in enumerate(users)])
+        MessageNotification.objects.bulk_create([MessageNotification(to_user=cls.referrer, title=f'Сообщение {i}',
+                                                                     message='Текст')
+                                                 for i in range(cls.ROWS)])
+        OutgoingEmail.objects.bulk_create([OutgoingEmail(subject=f'Письмо {i}', body='Текст',
+                                                         to=[f'user{i}@example.com'])
+                                           for i in range(cls.ROWS)])
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def assertChangelistQueries(self, model, num, query=''):
+        url = reverse(f'admin:personal_account_{model._meta.model_name}_changelist') + query
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['cl'].result_list), 100)
+
+    def test_profile_changelists(self):
+        # list_filter без связей добавляет по запросу на фильтр (значения для боковой панели)
+        expected = {Profile: 6, Profile_address: 9, Profile_invitee: 7, Profile_queue: 6, Profile_partner: 6}
+        for model, num in expected.items():
+            with self.subTest(model=model.__name__):
+                self.assertChangelistQueries(model, num)
+
+    def test_partner_filtered_by_referrer(self):
+        # +1 запрос: выбранный пользователь для виджета фильтра
+        self.assertChangelistQueries(Profile_partner, 7, f'?referred__id__exact={self.referrer.pk}')
+
+    def test_message_changelists(self):
+        self.assertChangelistQueries(MessageNotification, 6)
+        self.assertChangelistQueries(MessageNotification, 7, f'?to_user__id__exact={self.referrer.pk}')
+
+    def test_outgoing_email_changelist(self):
+        self.assertChangelistQueries(OutgoingEmail, 6)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class QueuedMailTests(TestCase):
+
+    def enqueue(self, count=1):
+        return [mail.enqueue_email(f'Письмо {i}', 'Текст', [f'user{i}@example.com']) for i in range(count)]
+
+    def make_due(self):
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+
+    def smtp_down(self):
+        return mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                          side_effect=smtplib.SMTPServerDisconnected('нет соединения'))
+
+    def test_sends_pending_emails(self):
+        self.enqueue(3)
+        self.assertEqual(mail.send_queued_emails(), (3, 0))
+        self.assertEqual(len(outbox.outbox), 3)
+        self.assertEqual(set(OutgoingEmail.objects.values_list('status', 'attempts')),
+                         {(OutgoingEmail.STATUS_SENT, 1)})
+        self.assertEqual(mail.send_queued_emails(), (0, 0))
+
+    def test_retry_with_backoff(self):
+        email, = self.enqueue()
+        with self.smtp_down():
+            self.assertEqual(mail.send_queued_emails(), (0, 1))
+            email.refresh_from_db()
+            self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_PENDING, 1))
+            delay = email.next_attempt_at - timezone.now()
+            self.assertAlmostEqual(delay.total_seconds(), mail.RETRY_BASE_SECONDS, delta=5)
+            # до срока письмо не отправляется повторно
+            self.assertEqual(mail.send_queued_emails(), (0, 0))
+
+            self.make_due()
+            mail.send_queued_emails()
+            email.refresh_from_db()
+            delay = email.next_attempt_at - timezone.now()
+            self.assertAlmostEqual(delay.total_seconds(), mail.RETRY_BASE_SECONDS * 2, delta=5)
+
+        self.make_due()
+        self.assertEqual(mail.send_queued_emails(), (1, 0))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_SENT, 3))
+
+    def test_fails_after_max_attempts(self):
+        email, = self.enqueue()
+        with self.smtp_down():
+            for _ in range(3):
+                self.make_due()
+                mail.send_queued_emails(max_attempts=3)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutgoingEmail.STATUS_FAILED, 3))
+        self.make_due()
+        self.assertEqual(mail.send_queued_emails(max_attempts=3), (0, 0))
+        self.assertEqual(outbox.outbox, [])
+
+    def test_claimed_email_is_not_sent_twice(self):
+        self.enqueue(2)
+        claimed = mail._claim_batch(10)
+        self.assertEqual(len(claimed), 2)
+        # второй воркер не видит захваченные письма
+        self.assertEqual(mail.send_queued_emails(), (0, 0))
+        self.assertEqual(outbox.outbox, [])
+
+    def test_stale_claim_is_released(self):
+        self.enqueue()
+        mail._claim_batch(10)
+        self.make_due()  # воркер упал, срок захвата истёк
+        self.assertEqual(mail.send_queued_emails(), (1, 0))
+
+
+class SQLiteCacheTests(SimpleTestCase):
+    """Локальная замена Redis: общий файл для всех воркеров."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.path, {'OPTIONS': options})
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.set('key', {'email': 'a@example.com'})
+        self.assertEqual(self.cache.get('key'), {'email': 'a@example.com'})
+        self.assertTrue(self.cache.delete('key'))
+        self.assertEqual(self.cache.get('key', 'нет'), 'нет')
+
+    def test_many(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+
+    def test_add_and_incr(self):
+        self.assertTrue(self.cache.add('counter', 1))
+        self.assertFalse(self.cache.add('counter', 5))
+        self.assertEqual(self.cache.incr('counter'), 2)
+        self.assertEqual(self.cache.incr('counter', 3), 5)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_expiry(self):
+        now = 1_000_000.0
+        with mock.patch('personal_account.cache.time.time', return_value=now), \
+             mock.patch('django.core.cache.backends.base.time.time', return_value=now):
+            self.cache.set('code', '123456', 60)
+            self.assertTrue(self.cache.touch('code', 120))
+        with mock.patch('personal_account.cache.time.time', return_value=now + 119):
+            self.assertEqual(self.cache.get('code'), '123456')
+        with mock.patch('personal_account.cache.time.time', return_value=now + 121):
+            self.assertIsNone(self.cache.get('code'))
+            self.assertTrue(self.cache.add('code', '654321'))
+
+    def test_shared_between_workers(self):
+        other = self.make_cache()
+        self.cache.set('reg:code:123456', {'email': 'a@example.com'})
+        self.assertEqual(other.get('reg:code:123456'), {'email': 'a@example.com'})
+        other.add('rate', 0)
+        other.incr('rate')
+        self.assertEqual(self.cache.incr('rate'), 2)
+
+    def test_connection_is_reused(self):
+        self.cache.set('a', 1)
+        conn = self.cache._connection()
+        self.cache.get('a')
+        self.cache.close()
+        self.assertIs(self.cache._connection(), conn)
+
+    def test_cull_runs_every_n_writes(self):
+        cache = self.make_cache(cull_every=10)
+        cache._max_entries, cache._cull_frequency = 5, 2
+        for i in range(9):
+            cache.set(f'k{i}', i)
+        self.assertEqual(len(cache.get_many([f'k{i}' for i in range(9)])), 9)
+        cache.set('k9', 9)  # десятая запись чистит лишнее
+        self.assertEqual(len(cache.get_many([f'k{i}' for i in range(10)])), 5)
+
+    def test_registration_data(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                                       'shared': {'BACKEND': 'personal_account.cache.SQLiteCache',
+                                                  'LOCATION': self.path}}):
+            utils.cache_registration_data('123456', 'a@example.com', {'email': 'a@example.com'})
+            self.assertEqual(self.cache.get('reg:email:a@example.com', version=1), '123456')
+            self.assertEqual(utils.get_registration_data_by_code('123456'), {'email': 'a@example.com'})
+            utils.delete_registration_data('123456', 'a@example.com')
+            self.assertIsNone(utils.get_code_by_email('a@example.com'))
+
+
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backends = {
+            'locmem': LocMemCache(f'ratelimit-{id(self)}', {}),
+            'sqlite': SQLiteCache(os.path.join(directory.name, 'cache.sqlite3'), {}),
+        }
+        if settings.REDIS_URL:
+            self.backends['redis'] = RedisCache(settings.REDIS_URL, {})
+
+    def at(self, seconds):
+        return mock.patch('personal_account.ratelimit.time.time', return_value=seconds)
+
+    def limiter(self, cache):
+        return RateLimit(f'test:{uuid4().hex}', limit=3, period=60, cache=cache)
+
+    def test_limit_and_remaining(self):
+        for name, cache in self.backends.items():
+            with self.subTest(backend=name), self.at(6000):
+                limiter = self.limiter(cache)
+                results = [limiter.hit('a@example.com') for _ in range(4)]
+                self.assertEqual([r.allowed for r in results], [True, True, True, False])
+                self.assertEqual([r.remaining for r in results], [2, 1, 0, 0])
+                self.assertEqual(limiter.get_usage('b@example.com').remaining, 3)
+
+    def test_rejected_hits_are_not_counted(self):
+        for name, cache in self.backends.items():
+            with self.subTest(backend=name):
+                limiter = self.limiter(cache)
+                with self.at(6000):
+                    for _ in range(10):
+                        limiter.hit('key')
+                # в следующем окне предыдущее весит половину: 3 * 0.5 = 1.5, одна попытка проходит
+                with self.at(6090):
+                    self.assertEqual([limiter.hit('key').allowed for _ in range(2)], [True, False])
+
+    def test_window_slides(self):
+        for name, cache in self.backends.items():
+            with self.subTest(backend=name):
+                limiter = self.limiter(cache)
+                with self.at(6000):
+                    for _ in range(3):
+                        limiter.hit('key')
+                with self.at(6059):
+                    self.assertFalse(limiter.hit('key').allowed)
+                with self.at(6120):
+                    self.assertTrue(limiter.hit('key').allowed)
+
+
+class FeedbackRateLimitTests(TestCase):
+
+    @mock.patch.object(utils.FEEDBACK_LIMIT, 'hit', return_value=RateLimitResult(False, 0, 60))
+    def test_limited_page_keeps_context(self, hit):
+        self.client.force_login(User.objects.create_user('member', password='secret'))
+        response = self.client.post(reverse('personal_account:help'), {'subject': 'Тема', 'message': 'Текст'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('view', response.context)
+        self.assertEqual(response.context['form'].data['subject'], 'Тема')
+        self.assertContains(response, 'Слишком много обращений')
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BulkNotificationEmailTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(7):
+            user = User.objects.create_user(f'member{i}', f'member{i}@example.com', 'secret')
+            Profile_queue.objects.create(user=user, status='Пайщик')
+        other = User.objects.create_user('candidate', 'candidate@example.com', 'secret')
+        Profile_queue.objects.create(user=other, status='Кандидат')
+        cls.notification = SystemNotification.objects.create(title='Собрание', message='Текст', status='Пайщик')
+
+    def test_sends_to_audience_in_chunks(self):
+        result = mail.send_bulk_notification(self.notification, chunk_size=3)
+        self.assertEqual((result.sent, result.failed), (7, 0))
+        self.assertEqual(sorted(m.to[0] for m in outbox.outbox), [f'member{i}@example.com' for i in range(7)])
+        self.assertTrue(all(m.subject == 'Собрание' for m in outbox.outbox))
+
+    def test_failed_chunk_does_not_stop_the_rest(self):
+        send_messages = outbox.get_connection().__class__.send_messages
+        calls = []
+
+        def flaky(backend, messages):
+            calls.append(len(messages))
+            if len(calls) == 1:
+                raise smtplib.SMTPServerDisconnected('обрыв')
+            return send_messages(backend, messages)
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', flaky):
+            result = mail.send_bulk_notification(self.notification, chunk_size=3)
+        self.assertEqual(calls, [3, 3, 1])
+        self.assertEqual((result.sent, result.failed), (4, 3))
+
+    def test_admin_action(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:personal_account_systemnotification_changelist'), {
+            'action': 'send_by_email',
+            '_selected_action': [self.notification.pk],
+        }, follow=True)
+        self.assertContains(response, 'отправлено 7, ошибок 0')
+        self.assertEqual(len(outbox.outbox), 7)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MessageCounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{i}', password='secret') for i in range(3)]
+
+    def unread(self, user):
+        return NotificationCounter.objects.get(user=user).unread_messages
+
+    def message(self, user, **kwargs):
+        return MessageNotification(to_user=user, title='Заголовок', message='Текст', **kwargs)
+
+    def test_single_create_and_delete(self):
+        message = MessageNotification.objects.create(to_user=self.users[0], title='Заголовок', message='Текст')
+        self.assertEqual(self.unread(self.users[0]), 1)
+        message.mark_as_read()
+        self.assertEqual(self.unread(self.users[0]), 0)
+        message.delete()
+        self.assertEqual(self.unread(self.users[0]), 0)
+
+    def test_bulk_create_outside_delivery(self):
+        MessageNotification.objects.bulk_create([self.message(user) for user in self.users for _ in range(2)]
+                                                + [self.message(self.users[0], is_read=True)])
+        self.assertEqual([self.unread(user) for user in self.users], [2, 2, 2])
+
+    def test_queryset_update_and_delete(self):
+        MessageNotification.objects.bulk_create([self.message(user) for user in self.users for _ in range(3)])
+        MessageNotification.objects.filter(to_user=self.users[0]).update(is_read=True)
+        self.assertEqual(self.unread(self.users[0]), 0)
+        MessageNotification.objects.filter(to_user=self.users[1]).update(to_user=self.users[2])
+        self.assertEqual([self.unread(user) for user in self.users], [0, 0, 6])
+        MessageNotification.objects.filter(pk__in=MessageNotification.objects.filter(
+            to_user=self.users[2]).values('pk')[:4]).delete()
+        self.assertEqual(self.unread(self.users[2]), 2)
+
+    def test_deleting_user_with_messages(self):
+        MessageNotification.objects.bulk_create([self.message(self.users[0]) for _ in range(2)])
+        self.users[0].delete()
+        self.assertFalse(NotificationCounter.objects.filter(user_id=self.users[0].pk).exists())
+
+    def test_recount_is_one_update_per_chunk(self):
+        MessageNotification.objects.bulk_create([self.message(user) for user in self.users])
+        NotificationCounter.objects.update(unread_messages=0)
+        with self.assertNumQueries(2):  # недостающие строки счётчиков + UPDATE с подзапросом
+            NotificationCounter.recount_messages([user.pk for user in self.users])
+        self.assertEqual([self.unread(user) for user in self.users], [1, 1, 1])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DeliveryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.members = []
+        for i in range(4):
+            user = User.objects.create_user(f'member{i}', password='secret')
+            Profile_queue.objects.create(user=user, status='Пайщик', additional_status='Должник' if i == 0 else '')
+            cls.members.append(user)
+        cls.consultant = User.objects.create_user('consultant', password='secret')
+        Profile_queue.objects.create(user=cls.consultant, status='Консультант')
+        Profile_partner.objects.create(user=cls.consultant, consultant_level=3)
+
+    def create(self, status='', targets=()):
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = SystemNotification.objects.create(title='Собрание', message='Текст', status=status)
+            for kind, value in targets:
+                notification.targets.create(kind=kind, value=value)
+        notification.refresh_from_db()
+        return notification
+
+    def test_small_audience_gets_personal_messages(self):
+        notification = self.create(targets=[(SystemNotificationTarget.KIND_ADDITIONAL_STATUS, 'Должник'),
+                                            (SystemNotificationTarget.KIND_CONSULTANT_LEVEL, '3')])
+        self.assertEqual(notification.delivery_mode, SystemNotification.DELIVERY_ON_WRITE)
+        self.assertIsNotNone(notification.delivered_at)
+        self.assertEqual(set(MessageNotification.objects.values_list('to_user', flat=True)),
+                         {self.members[0].pk, self.consultant.pk})
+        self.assertEqual(NotificationCounter.objects.get(user=self.consultant).unread_messages, 1)
+
+    def test_large_audience_is_delivered_on_read(self):
+        with mock.patch.object(delivery, 'FANOUT_ON_WRITE_LIMIT', 2):
+            notification = self.create(status='Пайщик')
+        self.assertEqual(notification.delivery_mode, SystemNotification.DELIVERY_ON_READ)
+        self.assertFalse(MessageNotification.objects.exists())
+        for member in self.members:
+            self.assertEqual(NotificationCounter.objects.get(user=member).unseen_system, 1)
+            self.assertIn(notification, delivery.notifications_for_user(User.objects.get(pk=member.pk)))
+        self.assertNotIn(notification, delivery.notifications_for_user(User.objects.get(pk=self.consultant.pk)))
+
+    def test_explicit_delivery_is_not_repeated(self):
+        # так доставляет админка: deliver() в той же транзакции, до COMMIT
+        with self.captureOnCommitCallbacks(execute=True):
+            notification = SystemNotification.objects.create(title='Собрание', message='Текст', status='Пайщик')
+            delivery.deliver(notification)
+        self.assertEqual(MessageNotification.objects.count(), len(self.members))
+        self.assertIsNone(delivery.deliver_pending(notification.pk))
+
+
+def create_referral_tree():
+    """root -> a -> (b, c), b -> d; возвращает {имя: User}."""
+    users = {}
+    for name, parent, status in [('root', None, ''), ('a', 'root', 'Пайщик'), ('b', 'a', 'Пайщик'),
+                                 ('c', 'a', 'Кандидат'), ('d', 'b', 'Пайщик')]:
+        user = users[name] = User.objects.create_user(name, f'{name}@example.com', 'x')
+        Profile_partner.objects.create(user=user, referred=users.get(parent))
+        if status:
+            Profile_queue.objects.create(user=user, status=status)
+    return users
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DownlineTests(TestCase):
+
+    def setUp(self):
+        self.users = create_referral_tree()
+
+    def test_whole_structure_in_one_query(self):
+        with self.assertNumQueries(1):
+            downline = referrals.get_downline(self.users['root'])
+        self.assertEqual([(node.username, node.depth) for node in downline],
+                         [('a', 1), ('b', 2), ('c', 2), ('d', 3)])
+        nodes = {node.username: node for node in downline}
+        self.assertEqual(nodes['a'].direct_count, 2)
+        self.assertEqual(nodes['c'].status, 'Кандидат')
+        self.assertEqual(nodes['d'].referred_id, self.users['b'].pk)
+
+    def test_depth_limit(self):
+        downline = referrals.get_downline(self.users['root'], max_depth=2)
+        self.assertEqual({node.username for node in downline}, {'a', 'b', 'c'})
+
+    def test_cycle_does_not_loop_forever(self):
+        # update() обходит проверку в save — такие данные бывают после ручных правок
+        Profile_partner.objects.filter(user=self.users['root']).update(referred=self.users['d'])
+        downline = referrals.get_downline(self.users['root'])
+        self.assertEqual(max(node.depth for node in downline), referrals.MAX_DEPTH)
+
+    def test_stats(self):
+        stats = referrals.downline_stats(referrals.get_downline(self.users['root']))
+        self.assertEqual(stats['total'], 4)
+        self.assertEqual(stats['direct'], 1)
+        self.assertEqual(stats['by_status'], {'Пайщик': 3, 'Кандидат': 1})
+        self.assertEqual(stats['by_depth'], [(1, 1), (2, 2), (3, 1)])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class ReferralClosureTests(TestCase):
+
+    def setUp(self):
+        self.users = create_referral_tree()
+
+    def names(self, users):
+        return {(user.username, user.depth) for user in users}
+
+    def assertClosureConsistent(self):
+        self.assertEqual(referrals.check_closure(), (set(), set(), []))
+
+    def test_queries(self):
+        self.assertEqual(self.names(referrals.descendants(self.users['a'])), {('b', 1), ('c', 1), ('d', 2)})
+        self.assertEqual(self.names(referrals.descendants(self.users['root'], max_depth=2)),
+                         {('a', 1), ('b', 2), ('c', 2)})
+        self.assertEqual(self.names(referrals.ancestors(self.users['d'], max_depth=2)), {('b', 1), ('a', 2)})
+        self.assertEqual(referrals.subtree_size(self.users['root']), 4)
+        self.assertClosureConsistent()
+
+    def test_moving_a_partner_moves_the_subtree(self):
+        partner = self.users['b'].profile_partner
+        partner.referred = self.users['root']
+        partner.save()
+        self.assertEqual(self.names(referrals.ancestors(self.users['d'])), {('b', 1), ('root', 2)})
+        self.assertEqual(referrals.subtree_size(self.users['a']), 1)
+        self.assertClosureConsistent()
+
+    def test_cycle_is_rejected(self):
+        partner = self.users['a'].profile_partner
+        partner.referred = self.users['d']
+        with self.assertRaises(ValidationError):
+            partner.clean()
+        with self.assertRaises(ValueError):
+            partner.save()
+
+    def test_deletions_detach_the_subtree(self):
+        self.users['b'].profile_partner.delete()
+        self.assertEqual(self.names(referrals.descendants(self.users['a'])), {('c', 1)})
+        self.users['a'].delete()
+        self.assertEqual(self.names(referrals.descendants(self.users['root'])), set())
+        self.assertClosureConsistent()
+
+    def test_command_rebuilds_after_update(self):
+        # QuerySet.update() минует save — таблица расходится, команда её чинит
+        Profile_partner.objects.filter(user=self.users['c']).update(referred=self.users['root'])
+        missing, extra, cycles = referrals.check_closure()
+        self.assertTrue(missing and extra)
+        out = StringIO()
+        call_command('referral_closure', stdout=out)
+        self.assertIn('--rebuild', out.getvalue())
+        call_command('referral_closure', rebuild=True, stdout=out)
+        self.assertClosureConsistent()
+        self.assertEqual(self.names(referrals.ancestors(self.users['c'])), {('root', 1)})
+
+
+class ReferralCodeTests(SimpleTestCase):
+
+    def test_codes_are_unique_and_reversible(self):
+        codes = {}
+        for user_id in [*range(1, 20001), 2 ** 40 - 1]:
+            for tweak in (0, 1):
+                code = make_referral_code(user_id, tweak)
+                self.assertEqual(len(code), 10)
+                self.assertTrue(is_generated_code(code))
+                self.assertEqual(decode_referral_code(code), (user_id, tweak))
+                codes[code] = user_id
+        self.assertEqual(len(codes), 2 * 20001)
+
+    def test_check_character_catches_typos(self):
+        swaps, missed = 0, 0
+        for user_id in range(1, 500):
+            code = make_referral_code(user_id)
+            for index in range(len(code)):
+                for char in ALPHABET:
+                    if char != code[index]:
+                        self.assertFalse(is_generated_code(code[:index] + char + code[index + 1:]))
+                if index and code[index] != code[index - 1]:
+                    swaps += 1
+                    missed += is_generated_code(code[:index - 1] + code[index] + code[index - 1] + code[index + 1:])
+        self.assertLess(missed / swaps, 0.01)
+        with self.assertRaises(ValueError):
+            decode_referral_code('ABCDEFGHIJ')
+
+    def test_out_of_range(self):
+        with self.assertRaises(ValueError):
+            make_referral_code(2 ** 40)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PartnerReferralCodeTests(TestCase):
+
+    def test_code_needs_no_lookup(self):
+        user = User.objects.create_user('partner', 'partner@example.com', 'x')
+        with CaptureQueriesContext(connection) as queries:
+            partner = Profile_partner.objects.create(user=user)
+        self.assertEqual(partner.referral_code, make_referral_code(user.pk))
+        self.assertEqual(partner.referral_link, f'/register?ref={partner.referral_code}')
+        self.assertFalse([query for query in queries if 'SELECT' in query['sql'] and 'referral_code' in query['sql']])
+
+    def test_clash_with_legacy_code_takes_next_tweak(self):
+        first, second = (User.objects.create_user(name, f'{name}@example.com', 'x') for name in ('first', 'second'))
+        # старый случайный код совпал с кодом, который получит second
+        Profile_partner.objects.create(user=first, referral_code=make_referral_code(second.pk))
+        partner = Profile_partner.objects.create(user=second)
+        self.assertEqual(partner.referral_code, make_referral_code(second.pk, 1))
+
+    def test_command_rewrites_legacy_codes(self):
+        user = User.objects.create_user('legacy', 'legacy@example.com', 'x')
+        Profile_partner.objects.create(user=user, referral_code='ABCDEFGHIJ', referral_link='/register?ref=ABCDEFGHIJ')
+        out = StringIO()
+        call_command('referral_codes', stdout=out)
+        self.assertIn('Кодов старого формата: 1', out.getvalue())
+        call_command('referral_codes', rewrite=True, stdout=out)
+        partner = Profile_partner.objects.get(user=user)
+        self.assertEqual(partner.referral_code, make_referral_code(user.pk))
+        self.assertEqual(partner.referral_link, f'/register?ref={partner.referral_code}')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MemberImportTests(TestCase):
+
+    header = 'email,first_name,phone,status,consultant_level,referrer_email'
+
+    def import_csv(self, *lines, **kwargs):
+        file = StringIO('\n'.join([self.header, *lines]))
+        return importer.import_members(importer.read_rows(file, 'members.csv'), **kwargs)
+
+    def test_rows_are_imported_with_structure(self):
+        result = self.import_csv('lead@example.com,Иван,+79990000001,Пайщик,3,',
+                                 'member@example.com,Пётр,+79990000002,Пайщик,,LEAD@example.com')
+        self.assertEqual(result, (2, []))
+        member = User.objects.get(email='member@example.com')
+        self.assertEqual(member.profile.phone, '+79990000002')
+        self.assertEqual(member.profile_queue.status, 'Пайщик')
+        self.assertEqual(member.profile_partner.referred.email, 'lead@example.com')
+        self.assertEqual(member.profile_partner.referral_code, make_referral_code(member.pk))
+        self.assertFalse(member.has_usable_password())
+        self.assertEqual(referrals.check_closure(), (set(), set(), []))
+        self.assertEqual(ReferralAggregate.objects.get(user__email='lead@example.com').subtree_size, 1)
+
+    def test_duplicates_are_reported(self):
+        User.objects.create_user('Existing@Example.com', 'Existing@Example.com', 'x')
+        result = self.import_csv('existing@example.com,Иван,+79990000001,,,',
+                                 'new@example.com,Иван,+79990000002,,,',
+                                 'NEW@example.com,Иван,+79990000003,,,')
+        self.assertEqual(result.created, 1)
+        self.assertEqual([(error.line, error.message) for error in result.errors],
+                         [(2, 'Пользователь уже зарегистрирован'), (4, 'Повтор пользователя в файле')])
+        self.assertEqual(User.objects.filter(email__iexact='existing@example.com').count(), 1)
+
+    def test_existing_referrer_is_found_by_email_in_any_case(self):
+        lead = User.objects.create_user('Lead@Example.com', 'Lead@Example.com', 'x')
+        result = self.import_csv('member@example.com,Пётр,+79990000002,,,lead@example.com')
+        self.assertEqual(result, (1, []))
+        self.assertEqual(Profile_partner.objects.get(user__email='member@example.com').referred, lead)
+
+    def test_invalid_rows_and_dry_run(self):
+        result = self.import_csv('bad@example.com,Иван,89990000001,,,',
+                                 'orphan@example.com,Иван,+79990000002,,,nobody@example.com',
+                                 'ok@example.com,Иван,+79990000003,,,', dry_run=True)
+        self.assertEqual(result.created, 1)
+        self.assertEqual([(error.line, error.email) for error in result.errors],
+                         [(2, 'bad@example.com'), (3, 'orphan@example.com')])
+        self.assertIn('phone', result.errors[0].message)
+        self.assertFalse(User.objects.exists())
+
+    def test_command_writes_error_report(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'members.csv')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join([self.header, 'ok@example.com,Иван,+79990000001,,,', ',Иван,,,,']))
+            out = StringIO()
+            call_command('import_members', path, stdout=out)
+            with open(f'{path}.errors.csv', encoding='utf-8-sig') as report:
+                self.assertIn('Не указан email', report.read())
+        self.assertIn('Загружено: 1', out.getvalue())
+        self.assertTrue(User.objects.filter(email='ok@example.com').exists())
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MemberExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        cls.lead = User.objects.create_user('lead', 'lead@example.com', 'x', first_name='Иван')
+        Profile_queue.objects.create(user=cls.lead, status='Пайщик', price='100')
+        Profile_partner.objects.create(user=cls.lead, consultant_level=2)
+        for i in range(30):
+            user = User.objects.create_user(f'member{i}', f'member{i}@example.com', 'x')
+            Profile_queue.objects.create(user=user, status='Кандидат')
+            Profile_partner.objects.create(user=user, referred=cls.lead)
+
+    def rows(self, content):
+        return [row for _, row in importer.read_rows(StringIO(content.lstrip('\ufeff')), 'members.csv')]
+
+    def test_rows_are_read_in_one_query(self):
+        with self.assertNumQueries(1):
+            rows = list(exporter.member_rows(User.objects.all(), chunk_size=10))
+        header = rows[0]
+        self.assertEqual(len(rows), 1 + User.objects.count())
+        lead = dict(zip(header, rows[2]))
+        self.assertEqual((lead['email'], lead['first_name'], lead['status'], lead['price']),
+                         ('lead@example.com', 'Иван', 'Пайщик', '100'))
+        self.assertEqual(lead['consultant_level'], 2)
+        # у администратора нет строк очереди и структуры — пустые ячейки
+        admin = dict(zip(header, rows[1]))
+        self.assertEqual((admin['status'], admin['referral_code'], admin['referrer_email']), ('', '', ''))
+
+    def test_admin_action_streams_csv(self):
+        self.client.force_login(self.admin)
+        queue = Profile_queue.objects.filter(status='Кандидат')
+        response = self.client.post(reverse('admin:personal_account_profile_queue_changelist'),
+                                    {'action': 'export_members',
+                                     '_selected_action': list(queue.values_list('pk', flat=True))})
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="members_', response['Content-Disposition'])
+        rows = self.rows(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(rows), 30)
+        self.assertEqual({row['referrer_email'] for row in rows}, {'lead@example.com'})
+
+    def test_export_can_be_imported_back(self):
+        buffer = StringIO()
+        exporter.write_members_csv(User.objects.exclude(pk=self.admin.pk), buffer)
+        content = buffer.getvalue()
+        User.objects.exclude(pk=self.admin.pk).delete()
+        result = importer.import_members(importer.read_rows(StringIO(content), 'members.csv'))
+        self.assertEqual(result, (31, []))
+        self.assertEqual(Profile_partner.objects.filter(referred__email='lead@example.com').count(), 30)
+        self.assertEqual(Profile_queue.objects.get(user__email='lead@example.com').status, 'Пайщик')
+
+    def test_command_filters_by_status(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'members.csv')
+            out = StringIO()
+            call_command('export_members', path, status=['Пайщик'], stdout=out)
+            with open(path, encoding='utf-8-sig') as file:
+                rows = self.rows(file.read())
+        self.assertIn('Выгружено участников: 1', out.getvalue())
+        self.assertEqual([row['email'] for row in rows], ['lead@example.com'])
+
+
+def jpeg_bytes(size=(800, 600), color='navy', **save_options):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', **save_options)
+    return buffer.getvalue()
+
+
+class ThumbnailTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.storage = ContentAddressedStorage(location=directory.name, base_url='/media/')
+
+    def test_legacy_file_gets_thumbnail_next_to_it(self):
+        # файл, загруженный до хранилища по содержимому, лежит под именем из upload_to
+        name = FileSystemStorage(location=self.storage.location).save('documents/1_Иван/паспорт.jpg',
+                                                                       ContentFile(jpeg_bytes()))
+        thumb = make_thumbnail(self.storage, name)
+        self.assertEqual(thumb, thumbnail_name(name))
+        self.assertEqual(thumb, 'documents/1_Иван/thumbs/паспорт_350.webp')
+        with self.storage.open(thumb) as f:
+            self.assertEqual(Image.open(f).width, 350)
+        self.assertFalse(MediaBlob.objects.exists())
+        # второй вызов находит готовое превью
+        self.assertEqual(make_thumbnail(self.storage, name), thumb)
+        self.assertEqual(self.storage.listdir('documents/1_Иван/thumbs')[1], ['паспорт_350.webp'])
+
+    def test_blob_thumbnail(self):
+        name = self.storage.save_blob('documents/1_Иван/паспорт.jpg', ContentFile(jpeg_bytes()))
+        self.assertTrue(name.startswith('documents/blobs/'))
+        self.assertEqual(make_thumbnail(self.storage, name), thumbnail_name(name))
+        self.assertEqual(list(MediaBlob.objects.values_list('name', flat=True)), [name])
+
+    def test_broken_image_falls_back_to_original(self):
+        name = FileSystemStorage(location=self.storage.location).save('documents/1_Иван/скан.jpg',
+                                                                       ContentFile(b'not an image'))
+        self.assertIsNone(make_thumbnail(self.storage, name))
+        self.assertFalse(self.storage.exists(thumbnail_name(name)))
+
+
+def use_temporary_media(test):
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    media = override_settings(MEDIA_ROOT=directory.name)
+    media.enable()
+    test.addCleanup(media.disable)
+
+
+def photo_fixture(name):
+    with open(os.path.join(PHOTO_FIXTURES, name), 'rb') as f:
+        return SimpleUploadedFile(name, f.read(), content_type='image/jpeg')
+
+
+class PhotoRecompressionTests(SimpleTestCase):
+
+    def test_phone_photo_is_rotated_and_stripped(self):
+        upload = photo_fixture('passport_rotated_gps.jpg')
+        result = images.recompress_image(upload)
+        self.assertEqual(result.name, 'passport_rotated_gps.jpg')
+        self.assertLess(result.size, upload.size / 2)
+        image = Image.open(result)
+        self.assertEqual(image.size, (1200, 1600))  # Orientation=6 применён к пикселям
+        self.assertFalse(image.getexif())
+
+    def test_long_side_is_capped(self):
+        upload = SimpleUploadedFile('wide.jpg', phone_photo(3200, 1800, seed=1, orientation=None))
+        image = Image.open(images.recompress_image(upload))
+        self.assertEqual(image.size, (images.MAX_IMAGE_SIDE, 1440))
+
+    def test_transparency_becomes_white(self):
+        buffer = BytesIO()
+        Image.new('RGBA', (3000, 200), (0, 0, 0, 0)).save(buffer, 'PNG')
+        image = Image.open(images.recompress_image(SimpleUploadedFile('screen.png', buffer.getvalue())))
+        self.assertEqual((image.format, image.mode), ('JPEG', 'RGB'))
+        self.assertEqual(image.getpixel((10, 10)), (255, 255, 255))
+
+    def test_cmyk_scan_is_converted(self):
+        image = Image.open(images.recompress_image(photo_fixture('scan_cmyk.jpg')))
+        self.assertEqual(image.mode, 'RGB')
+
+    def test_files_kept_as_is(self):
+        for name in ('small_optimized.jpg', 'receipt_screenshot.png'):
+            with self.subTest(name):
+                self.assertIsNone(images.recompress_image(photo_fixture(name)))
+        with self.assertLogs('personal_account.images', 'WARNING'):
+            self.assertIsNone(images.recompress_image(photo_fixture('not_an_image.jpg')))
+        with mock.patch.object(images, 'MAX_UPLOAD_SIZE', 1000), \
+                mock.patch.object(images.Image, 'open', side_effect=AssertionError('файл декодирован')):
+            self.assertIsNone(images.recompress_image(photo_fixture('passport_rotated_gps.jpg')))
+
+    def test_feedback_photo_limit_applies_to_the_copy(self):
+        with mock.patch('personal_account.forms.MAX_PHOTO_SIZE', 300 * 1024):
+            form = FeedbackForm({'subject': 'Фото', 'message': 'Текст'},
+                                {'photo': photo_fixture('passport_rotated_gps.jpg')})
+            self.assertTrue(form.is_valid(), form.errors)
+        self.assertLess(form.cleaned_data['photo'].size, 300 * 1024)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PhotoUploadLimitTests(TestCase):
+
+    def setUp(self):
+        use_temporary_media(self)
+        user = User.objects.create_user('consultant', 'consultant@example.com', 'x')
+        self.queue = Profile_queue.objects.create(user=user)
+
+    def form(self):
+        return ProcessingApplicationForm({'agree_to_consultant': True},
+                                         {'consultant_contract_photo': photo_fixture('passport_rotated_gps.jpg')},
+                                         instance=self.queue)
+
+    def test_limit_is_checked_after_recompression(self):
+        # исходник 427 КБ больше предела, перекодированный файл — меньше
+        with mock.patch('personal_account.models.MAX_PHOTO_SIZE', 300 * 1024), \
+                mock.patch.object(images, 'recompress_image', wraps=images.recompress_image) as recompress:
+            form = self.form()
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+        self.assertEqual(recompress.call_count, 1)
+        photo = Profile_queue.objects.get(pk=self.queue.pk).consultant_contract_photo
+        self.assertTrue(photo.name.endswith('.jpg'))
+        self.assertLess(photo.size, 300 * 1024)
+        self.assertTrue(photo.storage.exists(thumbnail_name(photo.name)))
+
+    def test_too_large_after_recompression(self):
+        with mock.patch('personal_account.models.MAX_PHOTO_SIZE', 50 * 1024):
+            form = self.form()
+            self.assertFalse(form.is_valid())
+        self.assertIn('consultant_contract_photo', form.errors)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class DocumentBlobTests(TestCase):
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.storage = document_storage()
+        self.profiles = [User.objects.create_user(name, f'{name}@example.com', 'x').profile
+                         for name in ('first', 'second')]
+
+    def upload(self, profile, data, name='паспорт.jpg'):
+        profile.document_photo_main = SimpleUploadedFile(name, data, content_type='image/jpeg')
+        profile.save()
+        return profile.document_photo_main.name
+
+    def refcounts(self):
+        return dict(MediaBlob.objects.values_list('name', 'refcount'))
+
+    def test_same_content_is_stored_once(self):
+        data = jpeg_bytes()
+        names = [self.upload(profile, data, f'{i}.jpg') for i, profile in enumerate(self.profiles)]
+        self.assertEqual(names[0], names[1])
+        self.assertTrue(names[0].startswith('documents/blobs/'))
+        self.assertEqual(self.refcounts(), {names[0]: 2})
+        directory, files = self.storage.listdir(os.path.dirname(names[0]))
+        self.assertEqual(files, [os.path.basename(names[0])])
+
+    def test_replacing_a_photo_moves_the_reference(self):
+        profile = self.profiles[0]
+        old = self.upload(profile, jpeg_bytes(color='navy'))
+        new = self.upload(profile, jpeg_bytes(color='maroon'))
+        self.assertNotEqual(old, new)
+        self.assertEqual(self.refcounts(), {old: 0, new: 1})
+
+    def test_deleted_owner_releases_the_blob(self):
+        name = self.upload(self.profiles[0], jpeg_bytes())
+        self.assertTrue(self.storage.exists(thumbnail_name(name)))
+        self.profiles[0].delete()
+        self.assertEqual(self.refcounts(), {name: 0})
+
+        later = timezone.now() + timedelta(minutes=1)
+        # старая версия профиля в истории ещё ссылается на файл
+        self.assertEqual(MediaBlob.collect_garbage(later), (0, 0))
+        Profile.history.all().delete()
+        size = MediaBlob.objects.get(name=name).size
+        self.assertEqual(MediaBlob.collect_garbage(later), (1, size))
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(thumbnail_name(name)))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_only_field_uploads_are_hashed(self):
+        name = self.storage.save('documents/reports/отчёт.jpg', ContentFile(jpeg_bytes()))
+        self.assertEqual(name, 'documents/reports/отчёт.jpg')
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_dedupe_command_moves_legacy_files_to_blobs(self):
+        plain = FileSystemStorage(location=self.storage.location)
+        legacy = [plain.save(f'documents/{profile.user_id}_Иван/паспорт.jpg', ContentFile(jpeg_bytes()))
+                  for profile in self.profiles]
+        for profile, name in zip(self.profiles, legacy):
+            Profile.objects.filter(pk=profile.pk).update(document_photo_main=name)
+        call_command('dedupe_media', stdout=StringIO())
+        names = set(Profile.objects.values_list('document_photo_main', flat=True))
+        self.assertEqual(len(names), 1)
+        blob = names.pop()
+        self.assertTrue(blob.startswith('documents/blobs/'))
+        self.assertEqual(self.refcounts(), {blob: 2})
+        self.assertFalse(any(plain.exists(name) for name in legacy))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class MediaGarbageTests(TestCase):
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.storage = FileSystemStorage()
+        self.profile = User.objects.create_user('member', 'member@example.com', 'x').profile
+
+    def file(self, name, age_hours=48):
+        name = self.storage.save(name, ContentFile(jpeg_bytes()))
+        moment = time.time() - age_hours * 3600
+        os.utime(self.storage.path(name), (moment, moment))
+        return name
+
+    def attach(self, name):
+        self.profile.document_photo_main = name
+        self.profile.save()
+
+    def collect(self, *args):
+        out = StringIO()
+        call_command('collect_media_garbage', *args, stdout=out)
+        return out.getvalue()
+
+    def test_only_unreferenced_old_files_are_removed(self):
+        replaced = self.file('documents/1_member/old.jpg')
+        current = self.file('documents/1_member/new.jpg')
+        thumb = self.file(thumbnail_name(current))
+        orphan = self.file('documents/1_member/lost.jpg')
+        fresh = self.file('documents/1_member/uploading.jpg', age_hours=1)
+        blob = self.file('documents/blobs/ab/cd/abcd.jpg')
+        MediaBlob.objects.create(name=blob, size=10)
+        # replaced остаётся только в истории изменений профиля
+        self.attach(replaced)
+        self.attach(current)
+
+        report = self.collect()
+        self.assertIn('Без ссылок: 2 файлов', report)
+        self.assertIn('пропущено новых: 1', report)
+        self.assertTrue(self.storage.exists(orphan))
+
+        report = self.collect('--delete')
+        self.assertIn('Удалено: 2 файлов', report)
+        remaining = {name for name in (replaced, current, thumb, orphan, fresh, blob) if self.storage.exists(name)}
+        self.assertEqual(remaining, {replaced, current, thumb, fresh})
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def test_missing_media_root(self):
+        with override_settings(MEDIA_ROOT=os.path.join(self.storage.location, 'missing')):
+            with self.assertRaises(CommandError):
+                self.collect()
@@ -0,0 +1,79 @@
+# personal_account/tracking.py
+import copy
+
+from django.db.models import DEFERRED
+from django.db.models.fields.files import FieldFile
+
+
+def _comparable(value):
+    if isinstance(value, FieldFile):
+        return value.name
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
+
+
+class DirtyFieldsMixin:
+    """
+    Запоминает значения полей, загруженные из базы. save() такого объекта
+    пишет только изменённые колонки (update_fields), а если ничего не
+    изменилось — ничего не пишет. Так же Django поступает с
+    save(update_fields=[]): не отправляются ни pre_save, ни post_save, и
+    версия в истории не пишется. На сохранение этих моделей подписана только
+    история; если получателю сигнала нужен каждый вызов save, передавайте
+    update_fields явно. Новые объекты сохраняются как обычно.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {name: _comparable(value)
+                                   for name, value in zip(field_names, values) if value is not DEFERRED}
+        return instance
+
+    def loaded_value(self, attname, default=None):
+        return getattr(self, '_loaded_values', {}).get(attname, default)
+
+    def get_dirty_fields(self):
+        """
+        attname изменённых полей или None, если прежние значения неизвестны
+        (объект ещё не сохранён или создан не из базы).
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or self._state.adding:
+            return None
+        dirty = set()
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue  # отложенные поля save и так не пишет
+            if field.attname not in loaded or loaded[field.attname] != _comparable(self.__dict__[field.attname]):
+                dirty.add(field.attname)
+        return dirty
+
+    def clean_exclude(self, dirty):
+        """Поля, которые full_clean может не проверять: они не менялись с загрузки."""
+        if dirty is None:
+            return None
+        return [field.name for field in self._meta.concrete_fields if field.attname not in dirty]
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in self._meta.concrete_fields:
+            if (fields is None or field.name in fields or field.attname in fields) and field.attname in self.__dict__:
+                loaded[field.attname] = _comparable(self.__dict__[field.attname])
+
+    def validate_changes(self, dirty):
+        """Проверка перед записью изменённых полей dirty (None — всех); по умолчанию её нет."""
+
+    def save(self, *args, **kwargs):
+        dirty = self.get_dirty_fields()
+        if not args and kwargs.get('update_fields') is None and not kwargs.get('force_insert') and dirty is not None:
+            if not dirty:
+                return
+            auto_now = {field.attname for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)}
+            kwargs['update_fields'] = dirty | auto_now
+        self.validate_changes(dirty)
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: _comparable(self.__dict__[field.attname])
+                               for field in self._meta.concrete_fields if field.attname in self.__dict__}
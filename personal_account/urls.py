@@ -24,6 +24,8 @@ urlpatterns = [
     ), name="password_reset"),
     path('referral/', views.ReferralView.as_view(), name='referral'),
     path('notifications_list/', views.SystemNotificationListView.as_view(), name='notifications_list'),
+    path('notifications_list/inbox/', views.NotificationInboxView.as_view(), name='notifications_inbox'),
+    path('notifications_list/stream/', views.NotificationStreamView.as_view(), name='notifications_stream'),
     path('password_reset/done/', auth_views.PasswordResetDoneView.as_view(template_name="personal_account/password_reset_done.html"), name="password_reset_done"),
     path('reset/<uidb64>/<token>/',views.CustomPasswordResetConfirmView.as_view(),name="password_reset_confirm"),
     path('reset/done/', auth_views.PasswordResetCompleteView.as_view(template_name="personal_account/password_reset_complete.html"), name="password_reset_complete"),
@@ -1,12 +1,23 @@
 # personal_account/utils.py
 import secrets
 import string
-from django.core.cache import cache
-from django.core.mail import send_mail
+from django.core.cache import caches
 from django.contrib.auth.hashers import make_password
 from django.conf import settings
+from .ratelimit import RateLimit
+from .mail import enqueue_email
 
 CODE_TIMEOUT_SECONDS = 15 * 60  # 15 минут
+SHARED_CACHE_ALIAS = "shared"  # общий для всех воркеров кеш (settings.CACHES)
+
+# Лимиты попыток (ключ — email, IP или id пользователя)
+SEND_CODE_LIMIT = RateLimit('reg_rate', limit=5, period=3600)
+SIGNUP_IP_LIMIT = RateLimit('signup_ip', limit=20, period=3600)
+LOGIN_LIMIT = RateLimit('login', limit=10, period=15 * 60)
+FEEDBACK_LIMIT = RateLimit('feedback', limit=5, period=3600)
+
+def shared_cache():
+    return caches[SHARED_CACHE_ALIAS]
 
 def generate_code(length=6):
     digits = string.digits
@@ -19,35 +30,33 @@ def _email_key(email):
     return f"reg:email:{email}"
 
 def cache_registration_data(code, email, data):
-    # сохраняем по коду и по email (удобно для повторной отправки)
-    cache.set(_code_key(code), data, CODE_TIMEOUT_SECONDS)
-    cache.set(_email_key(email), code, CODE_TIMEOUT_SECONDS)
+    # сохраняем по коду и по email (удобно для повторной отправки) одной пакетной записью
+    shared_cache().set_many({
+        _code_key(code): data,
+        _email_key(email): code,
+    }, CODE_TIMEOUT_SECONDS)
     return True
 
 def get_registration_data_by_code(code):
-    return cache.get(_code_key(code))
+    return shared_cache().get(_code_key(code))
 
 def get_code_by_email(email):
-    return cache.get(_email_key(email))
+    return shared_cache().get(_email_key(email))
 
 def delete_registration_data(code, email=None):
-    cache.delete(_code_key(code))
+    keys = [_code_key(code)]
     if email:
-        cache.delete(_email_key(email))
+        keys.append(_email_key(email))
+    shared_cache().delete_many(keys)
 
 def send_confirmation_email(to_email, code):
     subject = "Код подтверждения регистрации"
     message = f"Ваш код для подтверждения регистрации: {code}\nОн действителен 15 минут."
     from_email = settings.DEFAULT_FROM_EMAIL
-    send_mail(subject, message, from_email, [to_email], fail_silently=False)
-
-def can_send_code(email, limit=5, period_seconds=3600):
-    key = f"reg_rate:{email}"
-    count = cache.get(key) or 0
-    if count >= limit:
-        return False
-    if cache.get(key) is None:
-        cache.set(key, 1, period_seconds)
-    else:
-        cache.incr(key)
-    return True
+    enqueue_email(subject, message, [to_email], from_email=from_email)
+
+def can_send_code(email):
+    return SEND_CODE_LIMIT.hit(email).allowed
+
+def get_client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
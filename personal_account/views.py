@@ -6,11 +6,11 @@ from django.urls import reverse_lazy, reverse
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404, redirect, render
-from django.http import Http404
+from django.http import Http404, HttpResponse, JsonResponse, HttpResponseForbidden, StreamingHttpResponse
 from django.contrib.auth.mixins import LoginRequiredMixin
 from .forms import LoginForm, RegistrationForm, ProfileUpdateForm, ProfileAddressForm, ProfileInviteeForm, ProfileQueueForm, ProcessingApplicationForm, FeedbackForm
 from django.core.exceptions import ValidationError
-from .models import Profile, Profile_address, Profile_invitee, Profile_queue, Profile_partner, SystemNotification, MessageNotification
+from .models import Profile, Profile_address, Profile_invitee, Profile_queue, Profile_partner, ReferralAggregate
 from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.hashers import make_password
@@ -18,7 +18,15 @@ from django.views import View
 from django.db import transaction
 from django.utils import timezone
 from . import utils as reg_utils
-from django.core.mail import EmailMessage
+from .mail import enqueue_email
+from . import notifications
+from . import events
+from .delivery import channels_for_user
+from .referrals import MAX_DEPTH, get_downline, downline_stats
+from .middleware import load_profile_bundle
+from asgiref.sync import sync_to_async
+import asyncio
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -36,6 +44,14 @@ class CustomLoginView(LoginView):
     def get_success_url(self):
         return reverse_lazy('home')
 
+    def post(self, request, *args, **kwargs):
+        key = f"{reg_utils.get_client_ip(request)}:{request.POST.get('username', '').lower()}"
+        result = reg_utils.LOGIN_LIMIT.hit(key)
+        if not result.allowed:
+            messages.error(request, f"Слишком много попыток входа. Попробуйте через {result.reset_in // 60 + 1} мин.")
+            return self.render_to_response(self.get_context_data(form=self.get_form_class()(request)))
+        return super().post(request, *args, **kwargs)
+
 
 class CustomPasswordResetConfirmView(PasswordResetConfirmView):
     template_name = "personal_account/password_reset_confirm.html"
@@ -56,6 +72,11 @@ class CustomHelpView(TemplateView):
         return context
 
     def post(self, request, *args, **kwargs):
+        key = request.user.pk if request.user.is_authenticated else reg_utils.get_client_ip(request)
+        if not reg_utils.FEEDBACK_LIMIT.hit(key).allowed:
+            messages.error(request, "Слишком много обращений. Попробуйте позже.")
+            return self.render_to_response(self.get_context_data(form=FeedbackForm(request.POST)))
+
         form = FeedbackForm(request.POST, request.FILES)
 
         if form.is_valid():
@@ -76,8 +97,8 @@ class CustomHelpView(TemplateView):
                     - ID: {request.user.id}
                     """
 
-                # Создаем email сообщение для отправки на ВАШУ почту
-                email = EmailMessage(
+                # Ставим письмо в очередь на ВАШУ почту, отправит его send_queued_mail
+                enqueue_email(
                     subject=f'Обратная связь от пользователя: {request.user.username}',
                     body=f"""
                     {user_info}
@@ -93,17 +114,12 @@ class CustomHelpView(TemplateView):
                     ---
                     Прикреплённый файл - {photo}
                     """,
-                    from_email=settings.DEFAULT_FROM_EMAIL,
                     to=[settings.ADMIN_EMAIL],
+                    attachment=photo,
                 )
 
-                if photo:
-                    email.attach(photo.name, photo.read(), photo.content_type)
-
-                email.send()
-
                 messages.success(request, "Ваше сообщение успешно отправлено! Мы свяжемся с вами в ближайшее время.")
-                return render(request, self.template_name, {'form': FeedbackForm()})
+                return self.render_to_response(self.get_context_data())
             except Exception as e:
                 messages.error(request, f"Произошла ошибка при отправке: {str(e)}")
         else:
@@ -170,7 +186,8 @@ class RegistrationStartView(View):
             form.add_error('email', "Пользователь с таким email уже существует.")
             return render(request, self.template_name, {'form': form})
 
-        if not reg_utils.can_send_code(email):
+        ip_allowed = reg_utils.SIGNUP_IP_LIMIT.hit(reg_utils.get_client_ip(request)).allowed
+        if not ip_allowed or not reg_utils.can_send_code(email):
             messages.error(request, "Слишком много попыток отправки. Попробуйте позже.")
             return render(request, self.template_name, {'form': form})
 
@@ -533,11 +550,16 @@ class ReferralView(View):
 
         if user.profile_queue.status == "Консультант":
             try:
-                partner_profile = Profile_partner.objects.get(user=user)
+                partner_profile = user.profile_partner
             except Profile_partner.DoesNotExist:
                 partner_profile = Profile_partner.objects.create(user=user)
 
-            referrals = Profile_partner.objects.filter(referred=user).select_related('user')
+            referrals = get_downline(user)
+            structure = downline_stats(referrals)
+            try:
+                aggregate = user.referral_aggregate
+            except ReferralAggregate.DoesNotExist:
+                aggregate = ReferralAggregate(user=user)
 
             full_referral_link = f"{request.scheme}://{request.get_host()}/personal_account/signup?ref={partner_profile.referral_code}"
 
@@ -546,9 +568,14 @@ class ReferralView(View):
                 'referral_link': full_referral_link,
                 'referral_code': partner_profile.referral_code,
                 'referrals': referrals,
+                'structure': structure,
+                'aggregate': aggregate,
+                # итоги aggregate — по всей структуре, список и уровни — до MAX_DEPTH
+                'max_depth': MAX_DEPTH,
+                'beyond_max_depth': max(aggregate.subtree_size - structure['total'], 0),
                 'title': 'Реферальная программа',
                 'user_status': user.profile_queue.status,
-                'level': user.profile_partner.consultant_level,
+                'level': partner_profile.consultant_level,
                 'show_referral_info': True  # Флаг для шаблона
             }
 
@@ -601,28 +628,103 @@ class SystemNotificationListView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        user_status = self.request.user.profile_queue.status
+        user = self.request.user
+        user_status = user.profile_queue.status
 
-        context['system_notifications'] = SystemNotification.objects.filter(
-            status=user_status
+        personal_messages, messages_cursor = notifications.keyset_page(
+            notifications.personal_messages_for(user)
         )
-
-        unread_messages = MessageNotification.objects.filter(
-            to_user=self.request.user,
-            is_read=False
+        system_notifications, system_cursor = notifications.keyset_page(
+            notifications.system_notifications_for(user)
         )
 
-        unread_messages.update(is_read=True)
+        # Отмечаем прочитанным только то, что пользователь увидел на странице
+        notifications.mark_messages_read(user, personal_messages)
+        notifications.mark_system_read(user, system_notifications)
 
-        context['personal_messages'] = MessageNotification.objects.filter(
-            to_user=self.request.user
-        )
+        context['system_notifications'] = system_notifications
+        context['personal_messages'] = personal_messages
+        context['messages_next_cursor'] = messages_cursor
+        context['system_next_cursor'] = system_cursor
 
         context['user_status'] = user_status
-        context['system_notifications_count'] = context['system_notifications'].count()
-        context['personal_messages_count'] = context['personal_messages'].count()
+        context['system_notifications_count'] = len(system_notifications)
+        context['personal_messages_count'] = len(personal_messages)
         context['total_notifications'] = (
             context['system_notifications_count'] + context['personal_messages_count']
         )
 
         return context
+
+
+class NotificationInboxView(LoginRequiredMixin, View):
+    """JSON-страница уведомлений: ?kind=messages|system&cursor=...&limit=..."""
+
+    def get(self, request):
+        user = request.user
+        kind = request.GET.get('kind', 'messages')
+        try:
+            limit = min(int(request.GET.get('limit', notifications.PAGE_SIZE)), notifications.MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный параметр limit'}, status=400)
+        if limit < 1:
+            return JsonResponse({'error': 'Некорректный параметр limit'}, status=400)
+
+        if kind == 'messages':
+            queryset = notifications.personal_messages_for(user)
+            serialize = notifications.serialize_message
+        elif kind == 'system':
+            queryset = notifications.system_notifications_for(user)
+            serialize = notifications.serialize_system_notification
+        else:
+            return JsonResponse({'error': 'Некорректный параметр kind'}, status=400)
+
+        try:
+            items, next_cursor = notifications.keyset_page(queryset, request.GET.get('cursor'), limit)
+        except ValueError:
+            return JsonResponse({'error': 'Некорректный курсор'}, status=400)
+
+        results = [serialize(item) for item in items]
+        if kind == 'messages':
+            notifications.mark_messages_read(user, items)
+        else:
+            notifications.mark_system_read(user, items)
+
+        return JsonResponse({'results': results, 'next_cursor': next_cursor})
+
+
+class NotificationStreamView(View):
+    """
+    Поток новых уведомлений (text/event-stream) для значка в меню.
+
+    View асинхронный: открытое соединение не занимает поток, но держать
+    тысячи подключений можно только под ASGI-сервером (uvicorn, daphne).
+    Под WSGI бесконечный поток занял бы воркер навсегда, поэтому без
+    NOTIFICATION_SSE_ENABLED отвечаем 204 — EventSource не переподключается.
+    """
+    keepalive_seconds = 15
+
+    async def get(self, request):
+        if not settings.NOTIFICATION_SSE_ENABLED:
+            return HttpResponse(status=204)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return HttpResponseForbidden()
+        user = await sync_to_async(load_profile_bundle)(user)
+        channels = channels_for_user(user)
+
+        response = StreamingHttpResponse(self.stream(channels), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # nginx не должен буферизовать поток
+        return response
+
+    async def stream(self, channels):
+        async with events.get_broker().subscribe(channels) as queue:
+            yield f"retry: {self.keepalive_seconds * 1000}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), self.keepalive_seconds)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
@@ -43,6 +43,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'personal_account.middleware.ProfileBundleMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # 'simple_history.middleware.HistoryRequestMiddleware',
@@ -54,17 +55,28 @@ CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",  # dev
         "LOCATION": "unique-snowflake",
-    }
+    },
+    # Общий для всех воркеров кеш: коды регистрации и лимиты отправки
+    "shared": {
+        "BACKEND": "personal_account.cache.SQLiteCache",
+        "LOCATION": BASE_DIR / 'cache.sqlite3',
+    },
 }
 
-# Для продакшна (рекомендация):
-# CACHES = {
-#   "default": {
-#     "BACKEND": "django_redis.cache.RedisCache",
-#     "LOCATION": "redis://127.0.0.1:6379/1",
-#     "OPTIONS": {"CLIENT_CLASS": "django_redis.client.DefaultClient"},
-#   }
-# }
+# Доставка уведомлений в открытые страницы (SSE): внутри процесса или через Redis
+NOTIFICATION_BROKER = 'personal_account.events.InProcessBroker'
+# Поток бесконечный: включать только при запуске под ASGI (uvicorn, daphne).
+# Под WSGI каждое открытое соединение навсегда заняло бы воркер.
+NOTIFICATION_SSE_ENABLED = os.getenv('NOTIFICATION_SSE_ENABLED', '') == '1'
+
+# Для продакшна: REDIS_URL=redis://127.0.0.1:6379/1
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_URL,
+    }
+    NOTIFICATION_BROKER = 'personal_account.events.RedisBroker'
 
 TEMPLATES = [
     {
@@ -93,12 +105,60 @@ WSGI_APPLICATION = 'site_bw.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# База данных: SQLite по умолчанию, PostgreSQL — при DB_ENGINE=postgresql
+# (нужен пакет psycopg, для DB_POOL_MAX_SIZE — psycopg[pool]).
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'site_bw'),
+            'USER': os.getenv('POSTGRES_USER', 'site_bw'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            # соединение живёт между запросами и проверяется перед повторным использованием
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+            'CONN_HEALTH_CHECKS': True,
+            # .iterator() (выгрузки, обход истории и медиа) читает через серверный курсор;
+            # за pgbouncer в режиме transaction курсоры нужно отключить
+            'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_DISABLE_SERVER_SIDE_CURSORS', '') == '1',
+            'OPTIONS': {},
+        }
+    }
+    DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '0'))
+    if DB_POOL_MAX_SIZE:
+        # пул psycopg внутри процесса заменяет постоянные соединения
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.getenv('DB_POOL_MIN_SIZE', '2')),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': 10,
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Транзакция сразу берёт блокировку записи (BEGIN IMMEDIATE): конкурирующая
+                # запись ждёт своей очереди до timeout секунд, а не получает
+                # "database is locked" посреди транзакции при повышении блокировки.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,  # busy_timeout
+                # WAL: чтение не блокирует запись и наоборот; с WAL synchronous=NORMAL
+                # не теряет целостность, только последние транзакции при отключении питания.
+                'init_command': (
+                    'PRAGMA journal_mode=WAL;'
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=134217728;'  # 128 МБ
+                    'PRAGMA cache_size=-32000;'    # 32 МБ на соединение
+                    'PRAGMA temp_store=MEMORY;'
+                ),
+            },
+        }
     }
-}
 
 
 # Password validation
@@ -154,6 +214,19 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    # фото документов хранятся один раз на одинаковое содержимое, см. personal_account/storage.py
+    'documents': {'BACKEND': 'personal_account.storage.ContentAddressedStorage'},
+}
+
+# История изменений: 'simple_history' — полная копия строки на каждое сохранение
+# (таблицы Historical*), 'revisions' — только изменённые поля и периодические
+# полные снимки в одной таблице, см. personal_account/revisions.py
+HISTORY_BACKEND = os.getenv('HISTORY_BACKEND', 'simple_history')
+SIMPLE_HISTORY_ENABLED = HISTORY_BACKEND == 'simple_history'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 